@@ -0,0 +1,121 @@
+"""
+Peak-memory benchmark: streaming DOCX extractor vs. python-docx
+
+Builds a Word file with many paragraphs, a table and large embedded images,
+then extracts it in a fresh process per extractor and reports the growth of
+peak RSS during extraction (Linux only, read from /proc/self/status).
+
+Usage:
+    python benchmarks/docx_memory.py [--paragraphs 10000] [--images 20]
+"""
+
+import argparse
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import zlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+
+def make_png(width, height):
+    """Build an incompressible RGB PNG of the given size"""
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    rows = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(rows, 0))
+        + chunk(b"IEND", b"")
+    )
+
+
+def build_docx(path, paragraphs, images):
+    import docx
+    from docx.shared import Inches
+
+    document = docx.Document()
+    image_every = max(paragraphs // images, 1) if images else 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(paragraphs):
+            document.add_paragraph(
+                f"Paragraph {i}: pupils check the source, author and date of a news story."
+            )
+            if image_every and i % image_every == 0:
+                # Distinct images, so python-docx cannot share one image part
+                image_path = os.path.join(tmp, f"image{i}.png")
+                with open(image_path, "wb") as f:
+                    f.write(make_png(800, 800))
+                document.add_picture(image_path, width=Inches(2))
+        table = document.add_table(rows=20, cols=3)
+        for row in table.rows:
+            for cell in row.cells:
+                cell.text = "Table cell with a headline to evaluate"
+        document.save(path)
+
+
+def measure(extractor, path):
+    """Run one extractor in a child process; return (seconds, peak RSS MB, chars)"""
+    code = f"""
+import sys, time
+sys.path.insert(0, {SRC_DIR!r})
+
+def peak_kb():
+    with open("/proc/self/status") as f:
+        return int(f.read().split("VmHWM:")[1].split()[0])
+
+import docx
+from material_extraction import read_docx_text
+
+# Reset the peak-RSS counter (it survives exec on Linux) after the imports
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")
+baseline = peak_kb()
+started = time.perf_counter()
+if {extractor!r} == "streaming":
+    text = read_docx_text({path!r})
+else:
+    document = docx.Document({path!r})
+    text = "\\n".join(p.text for p in document.paragraphs)
+elapsed = time.perf_counter() - started
+print(elapsed, (peak_kb() - baseline) / 1024, len(text))
+"""
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(out[0]), float(out[1]), int(out[2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paragraphs", type=int, default=10000)
+    parser.add_argument("--images", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.docx")
+        build_docx(path, args.paragraphs, args.images)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(
+            f"{args.paragraphs} paragraphs, {args.images} images, {size_mb:.1f} MB file"
+        )
+        print(f"{'extractor':<12}{'seconds':>10}{'peak MB':>10}{'chars':>12}")
+        for extractor in ("python-docx", "streaming"):
+            seconds, peak, chars = measure(extractor, path)
+            print(f"{extractor:<12}{seconds:>10.2f}{peak:>10.1f}{chars:>12}")
+
+
+if __name__ == "__main__":
+    main()
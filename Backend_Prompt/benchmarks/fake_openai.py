@@ -0,0 +1,93 @@
+"""
+Offline stand-in for the OpenAI Chat Completions API
+
+Answers POST /v1/chat/completions with a canned worksheet response after a
+configurable delay, so the servers can be load-tested and benchmarked
+without network access. Point the OpenAI SDK at it with
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Usage:
+    python benchmarks/fake_openai.py --port 8900 --latency 2.0
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from quart import Quart, request
+
+ACTIVITIES = {
+    "activities": [
+        {
+            "title": f"Fake News Detectives {i}",
+            "difficulty_level": "beginner",
+            "estimated_duration": 15,
+            "materials_needed": ["Printed headlines", "Checklist"],
+            "min_number_students": 2,
+            "max_number_students": 25,
+            "description": "Pupils sort real and fake headlines with a checklist "
+            "(source, author, date) and explain their reasoning to the class.",
+        }
+        for i in range(3)
+    ]
+}
+
+LESSON_IDEAS = [
+    {
+        "title": "Newsroom Simulation",
+        "learning_objectives": "Check the source, author and date of a story.",
+        "activity_description": "Groups act as editors deciding which stories to publish.",
+        "materials_needed": ["Tablets"],
+        "estimated_duration": "45 minutes",
+    }
+]
+
+
+def create_app(latency=1.0):
+    app = Quart(__name__)
+    app.config["latency"] = latency
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    async def chat_completions():
+        body = await request.get_json()
+        await asyncio.sleep(app.config["latency"])
+
+        prompt = json.dumps(body.get("messages", []))
+        content = LESSON_IDEAS if "lesson ideas" in prompt else ACTIVITIES
+        prompt_tokens = len(prompt) // 4
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": json.dumps(content)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 300,
+                "total_tokens": prompt_tokens + 300,
+            },
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI upstream")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{args.port}"]
+    config.accesslog = None
+    asyncio.run(serve(create_app(args.latency), config))
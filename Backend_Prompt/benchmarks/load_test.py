@@ -0,0 +1,213 @@
+"""
+Load test for /api/generate_worksheet against a fake OpenAI upstream
+
+Starts benchmarks/fake_openai.py and the API server (sync Flask or async
+mode), fires requests at a fixed concurrency and reports throughput and
+latency percentiles. /api/health is probed throughout, to show whether the
+load spills over to other endpoints. Runs fully offline.
+
+Usage:
+    python benchmarks/load_test.py --mode sync --concurrency 50 --requests 200
+    python benchmarks/load_test.py --mode async --concurrency 500 --requests 1000
+    python benchmarks/load_test.py --concurrency 300 --requests 900 --timeout 30 \
+        --env ADMISSION_MAX_INFLIGHT=1000 --env ADMISSION_QUEUE_SIZE=0
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+PAYLOAD = {
+    "competency_id": "MI_MEDIEN_2",
+    "learning_objective": "Pupils can tell real news from fake news by checking sources.",
+    "materials_available": "Tablets, projector",
+    "time_available": "45",
+    "class_size_composition": "22 pupils",
+    "num_questions_per_level": 3,
+    "include_beginner": True,
+    "include_intermediate": True,
+    "include_advanced": True,
+    "include_lesson_ideas": True,
+}
+
+SERVER_COMMANDS = {
+    "sync": (
+        "import sys; sys.path.insert(0, {src!r}); from api_server import app; "
+        "app.run(host='127.0.0.1', port={port}, threaded=True)"
+    ),
+    "async": (
+        "import asyncio, sys; sys.path.insert(0, {src!r}); "
+        "from hypercorn.asyncio import serve; from hypercorn.config import Config; "
+        "from async_server import app; c = Config(); c.bind = ['127.0.0.1:{port}']; "
+        "c.accesslog = None; c.backlog = 2048; asyncio.run(serve(app, c))"
+    ),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_stack(mode, latency, extra_env=None):
+    """Start the fake upstream and the API server; return (base_url, processes)"""
+    upstream_port = free_port()
+    server_port = free_port()
+
+    upstream = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(BENCH_DIR, "fake_openai.py"),
+            "--port",
+            str(upstream_port),
+            "--latency",
+            str(latency),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="offline-test",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{upstream_port}/v1",
+        **(extra_env or {}),
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            SERVER_COMMANDS[mode].format(src=SRC_DIR, port=server_port),
+        ],
+        env=env,
+        cwd=SRC_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{server_port}"
+    wait_until_up(f"http://127.0.0.1:{upstream_port}/v1/chat/completions")
+    wait_until_up(f"{base_url}/api/health")
+    return base_url, [server, upstream]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run_load(base_url, concurrency, total, timeout, payload=PAYLOAD):
+    """Fire total requests with at most concurrency in flight"""
+    latencies = []
+    statuses = {}
+    retry_after = []
+    health_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(
+                        f"{base_url}/api/generate_worksheet", json=payload
+                    )
+                    status = response.status_code
+                    if response.headers.get("Retry-After"):
+                        retry_after.append(float(response.headers["Retry-After"]))
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(time.perf_counter() - started)
+
+        async def probe_health(done):
+            # Separate client, so the probe never waits for a load connection
+            async with httpx.AsyncClient(timeout=timeout) as probe:
+                while not done.is_set():
+                    probe_started = time.perf_counter()
+                    try:
+                        await probe.get(f"{base_url}/api/health")
+                        health_latencies.append(time.perf_counter() - probe_started)
+                    except httpx.HTTPError:
+                        health_latencies.append(timeout)
+                    await asyncio.sleep(0.2)
+
+        done = asyncio.Event()
+        prober = asyncio.create_task(probe_health(done))
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "goodput_rps": round(len(latencies) / elapsed, 2),
+        "p50_s": round(percentile(latencies, 0.50), 2),
+        "p95_s": round(percentile(latencies, 0.95), 2),
+        "statuses": statuses,
+        "retry_after_p50_s": percentile(retry_after, 0.50),
+        "health_p95_ms": round(percentile(health_latencies, 0.95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=sorted(SERVER_COMMANDS), default="async")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=2.0, help="fake upstream seconds per call")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="environment variable for the API server, e.g. ADMISSION_MAX_INFLIGHT=16",
+    )
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    base_url, processes = start_stack(args.mode, args.latency, extra_env)
+    try:
+        result = asyncio.run(
+            run_load(base_url, args.concurrency, args.requests, args.timeout)
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    print(f"mode={args.mode} upstream latency={args.latency}s {' '.join(args.env)}")
+    for key, value in result.items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
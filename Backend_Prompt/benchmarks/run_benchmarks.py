@@ -0,0 +1,594 @@
+"""
+Microbenchmarks for the backend hot paths, with JSON baselines
+
+Covers parse_agent_response, build_system_prompt (0-20 uploaded files),
+extract_material_content per format and size, the curriculum_topics catalog
+functions, competency search over a 21,000-entry catalog and
+/api/generate_worksheet end to end against a stubbed LLM and replayed
+from a recorded cassette.
+Everything runs offline.
+
+Usage:
+    python benchmarks/run_benchmarks.py run [--filter parse] [--output current.json]
+    python benchmarks/run_benchmarks.py run --save-baseline
+    python benchmarks/run_benchmarks.py compare [current.json] [--baseline baselines/baseline.json] [--threshold 0.25]
+
+`compare` exits with status 1 if any benchmark got slower than the
+baseline (fastest round) by more than the threshold (a fraction;
+0.25 = 25%).
+"""
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baselines", "baseline.json")
+
+# Offline, deterministic settings; must be set before the backend is imported
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ["EXTRACTION_WORKERS"] = "0"
+os.environ["TRACING_ENABLED"] = "0"
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a setup function returning the callable to time"""
+
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+def time_callable(func, rounds=7, min_round_seconds=0.05):
+    """
+    Time func over several rounds, each calibrated to run at least
+    min_round_seconds. Returns per-call timings in microseconds.
+    """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_round_seconds or number >= 1_000_000:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_round_seconds / elapsed) + 1)
+
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number * 1e6)
+
+    return {
+        "median_us": round(statistics.median(samples), 3),
+        "min_us": round(min(samples), 3),
+        "max_us": round(max(samples), 3),
+        "calls_per_round": number,
+        "rounds": rounds,
+    }
+
+
+# --- Fixtures --------------------------------------------------------------
+
+SENTENCES = [
+    "Pupils check the source, the author and the date of a news story.",
+    "Fake news is false or misleading information presented as news.",
+    "Headlines can be sensational to get clicks, so read the whole story.",
+    "Media literacy helps pupils evaluate images, videos and social posts.",
+    "The class compares two articles about the same event and lists differences.",
+]
+
+
+def make_text(chars):
+    """Deterministic paragraphed text of roughly the given length"""
+    parts = []
+    total = 0
+    i = 0
+    while total < chars:
+        sentence = f"{SENTENCES[i % len(SENTENCES)]} (Section {i // 5 + 1}.)"
+        parts.append(sentence)
+        total += len(sentence) + 1
+        i += 1
+        if i % 5 == 0:
+            parts.append("\n\n")
+    return " ".join(parts)
+
+
+def make_pdf(path, pages, lines_per_page=40):
+    """Write a minimal multi-page text PDF without third-party writers"""
+    objects = []
+    page_ids = []
+    font_id = 3
+    for page in range(pages):
+        lines = [
+            f"Page {page + 1}, line {line + 1}: {SENTENCES[line % len(SENTENCES)]}"
+            for line in range(lines_per_page)
+        ]
+        text = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(
+            f"({line}) '" for line in lines
+        ) + " ET"
+        stream = text.encode("latin-1")
+        content_id = 4 + page * 2
+        page_id = content_id + 1
+        objects.append(
+            (content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        )
+        objects.append(
+            (
+                page_id,
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+                % (font_id, content_id),
+            )
+        )
+        page_ids.append(page_id)
+
+    kids = b" ".join(b"%d 0 R" % pid for pid in page_ids)
+    objects.append((1, b"<< /Type /Catalog /Pages 2 0 R >>"))
+    objects.append((2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)))
+    objects.append((3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"))
+    objects.sort()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = out.tell()
+        out.write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+    xref = out.tell()
+    count = max(offsets) + 1
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % count)
+    for obj_id in range(1, count):
+        out.write(b"%010d 00000 n \n" % offsets[obj_id])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref))
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+
+
+def make_docx(path, paragraphs):
+    import docx
+
+    document = docx.Document()
+    for i in range(paragraphs):
+        document.add_paragraph(f"{SENTENCES[i % len(SENTENCES)]} ({i})")
+    document.save(path)
+
+
+FIXTURE_DIR = tempfile.mkdtemp(prefix="worksheet-bench-")
+atexit.register(shutil.rmtree, FIXTURE_DIR, ignore_errors=True)
+
+
+def fixture_file(name, build):
+    path = os.path.join(FIXTURE_DIR, name)
+    if not os.path.exists(path):
+        build(path)
+    return path
+
+
+def write_text(chars):
+    def build(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_text(chars))
+
+    return build
+
+
+def make_config(uploaded=()):
+    from teacher_interface import TeacherConfig
+
+    config = TeacherConfig()
+    config.competency_id = "MI_MEDIEN_2"
+    config.learning_objective = "Pupils can tell real news from fake news by checking sources."
+    config.materials_available = "Tablets, projector"
+    config.time_available = "45"
+    config.class_size_composition = "22 pupils"
+    config.uploaded_materials = list(uploaded)
+    return config
+
+
+def activities_json(count):
+    return json.dumps(
+        {
+            "activities": [
+                {
+                    "title": f"Activity {i}",
+                    "difficulty_level": "beginner",
+                    "estimated_duration": 15,
+                    "materials_needed": ["Checklist", "Headlines"],
+                    "min_number_students": 2,
+                    "max_number_students": 25,
+                    "description": " ".join(SENTENCES),
+                }
+                for i in range(count)
+            ]
+        }
+    )
+
+
+# --- parse_agent_response ---------------------------------------------------
+
+RESPONSE_SHAPES = {
+    "bare_object_3": lambda: activities_json(3),
+    "bare_object_30": lambda: activities_json(30),
+    "fenced_3": lambda: f"```json\n{activities_json(3)}\n```",
+    "fenced_30": lambda: f"```json\n{activities_json(30)}\n```",
+    "prose_wrapped_3": lambda: f"Here are the activities:\n{activities_json(3)}\nEnjoy!",
+    "array_3": lambda: json.dumps(json.loads(activities_json(3))["activities"]),
+    "invalid_json": lambda: "Sorry, I cannot help with { that request.",
+}
+
+
+def _register_parse(shape, build):
+    @benchmark(f"parse_agent_response[{shape}]")
+    def setup():
+        from worksheet_backend import parse_agent_response
+
+        response = build()
+
+        def run():
+            # The parser prints diagnostics for invalid input; keep output clean
+            with contextlib.redirect_stdout(io.StringIO()):
+                parse_agent_response(response)
+
+        return run
+
+
+for _shape, _build in RESPONSE_SHAPES.items():
+    _register_parse(_shape, _build)
+
+
+# --- build_system_prompt ----------------------------------------------------
+
+
+def _register_prompt(file_count):
+    @benchmark(f"build_system_prompt[files={file_count}]")
+    def setup():
+        import worksheet_backend
+
+        files = [
+            fixture_file(f"material_{i}.txt", write_text(4000 + 2000 * i))
+            for i in range(file_count)
+        ]
+        config = make_config(files)
+
+        def run():
+            # Measure the cold path: every material is re-read and summarized
+            worksheet_backend._material_cache.clear()
+            worksheet_backend.build_system_prompt(config, "intermediate")
+
+        return run
+
+
+for _count in (0, 1, 5, 10, 20):
+    _register_prompt(_count)
+
+
+# --- extract_material_content -----------------------------------------------
+
+EXTRACTION_FIXTURES = {
+    "txt_small": ("small.txt", write_text(2_000)),
+    "txt_large": ("large.txt", write_text(400_000)),
+    "md_small": ("small.md", write_text(2_000)),
+    "pdf_small": ("small.pdf", lambda path: make_pdf(path, 2)),
+    "pdf_large": ("large.pdf", lambda path: make_pdf(path, 100)),
+    "docx_small": ("small.docx", lambda path: make_docx(path, 50)),
+    "docx_large": ("large.docx", lambda path: make_docx(path, 5000)),
+}
+
+
+def _register_extract(label, name, build):
+    @benchmark(f"extract_material_content[{label}]")
+    def setup():
+        from worksheet_backend import extract_material_content
+
+        path = fixture_file(name, build)
+        return lambda: extract_material_content(path)
+
+
+for _label, (_name, _build) in EXTRACTION_FIXTURES.items():
+    _register_extract(_label, _name, _build)
+
+
+# --- curriculum_topics ------------------------------------------------------
+
+CATALOG_CALLS = {
+    "get_lehrplan_topics": lambda ct: ct.get_lehrplan_topics(),
+    "get_topics": lambda ct: ct.get_topics("Media", "Cycle 2 (Grades 3-6)"),
+    "get_competency_details": lambda ct: ct.get_competency_details("MI_MEDIEN_2"),
+    "get_competencies_by_cycle": lambda ct: ct.get_competencies_by_cycle("2"),
+    "get_competencies_by_domain": lambda ct: ct.get_competencies_by_domain("media"),
+}
+
+
+def _register_catalog(name, call):
+    @benchmark(f"curriculum_topics.{name}")
+    def setup():
+        import curriculum_topics
+
+        return lambda: call(curriculum_topics)
+
+
+for _name, _call in CATALOG_CALLS.items():
+    _register_catalog(_name, _call)
+
+
+# --- competency search over a full-size catalog --------------------------------
+
+SEARCH_QUERIES = {
+    "broad_prefix": "me",
+    "word": "medien",
+    "two_words": "medien prod",
+    "id": "MI_MEDIEN_2_12",
+    "no_match": "zzzzqx",
+}
+
+
+def make_catalog(entries_per_competency=3000, seed=7):
+    """
+    The bilingual catalog export extended with generated sub-competencies
+    (random pseudo-words), about the size of a full Lehrplan export
+    """
+    import curriculum_topics
+
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(rng.choice("abcdefghiklmnoprstuvwz") for _ in range(rng.randint(4, 11)))
+        for _ in range(20000)
+    ]
+    with open(curriculum_topics.LEHRPLAN_CATALOG_PATH, "r", encoding="utf-8") as f:
+        catalog = json.load(f)["competencies"]
+    entries = list(catalog)
+    for comp in catalog:
+        for i in range(entries_per_competency):
+            entries.append(
+                {
+                    "id": f"{comp['id']}_{i}",
+                    "name_de": " ".join(rng.sample(vocabulary, 4)),
+                    "name_en": " ".join(rng.sample(vocabulary, 4)),
+                    "focus_de": " ".join(rng.sample(vocabulary, 25)),
+                    "focus_en": " ".join(rng.sample(vocabulary, 25)),
+                }
+            )
+    return curriculum_topics.catalog_entries(
+        curriculum_topics.snapshot().competencies, {"competencies": entries}
+    )
+
+
+_search_index = None
+
+
+def _register_search(label, query):
+    @benchmark(f"competency_search[{label}]")
+    def setup():
+        global _search_index
+        from competency_search import CompetencyIndex
+
+        if _search_index is None:
+            _search_index = CompetencyIndex(make_catalog())
+        return lambda: _search_index.search(query, cycle="2", limit=20)
+
+
+for _label, _query in SEARCH_QUERIES.items():
+    _register_search(_label, _query)
+
+
+# --- /api/generate_worksheet end to end -------------------------------------
+
+
+class StubCompletions:
+    """Stands in for openai_client.chat.completions with canned responses"""
+
+    def __init__(self):
+        self.with_raw_response = self
+
+    def create(self, model, messages, temperature=None, **kwargs):
+        from openai.types.chat import ChatCompletion
+
+        prompt = json.dumps(messages)
+        content = (
+            json.dumps(json.loads(activities_json(4))["activities"])
+            if "lesson ideas" in prompt
+            else activities_json(3)
+        )
+        completion = ChatCompletion.model_validate(
+            {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": 300,
+                    "total_tokens": len(prompt) // 4 + 300,
+                },
+            }
+        )
+        return StubRawResponse(completion)
+
+
+class StubRawResponse:
+    headers = {}
+
+    def __init__(self, completion):
+        self._completion = completion
+
+    def parse(self):
+        return self._completion
+
+
+class StubClient:
+    def __init__(self):
+        self.chat = type("Chat", (), {"completions": StubCompletions()})()
+
+    def with_options(self, **kwargs):
+        return self
+
+
+@benchmark("api.generate_worksheet[stub_llm]")
+def setup_generate_worksheet():
+    import worksheet_backend
+    from api_server import app
+    from rate_limiter import scheduler
+
+    worksheet_backend.openai_client = StubClient()
+    scheduler.requests.set_limit(10**9)
+    scheduler.tokens.set_limit(10**12)
+    scheduler.requests.tokens = scheduler.requests.capacity
+    scheduler.tokens.tokens = scheduler.tokens.capacity
+
+    client = app.test_client()
+    payload = {
+        "competency_id": "MI_MEDIEN_2",
+        "learning_objective": "Pupils can tell real news from fake news by checking sources.",
+        "include_lesson_ideas": True,
+    }
+
+    def run():
+        response = client.post("/api/generate_worksheet", json=payload)
+        assert response.status_code == 200, response.get_json()
+
+    return run
+
+
+@benchmark("api.generate_worksheet[cassette_replay]")
+def setup_generate_worksheet_replay():
+    import cassettes
+
+    # Record one request against the stub, then replay it from the cassette
+    run = setup_generate_worksheet()
+    directory = os.path.join(FIXTURE_DIR, "cassettes")
+    recorder = cassettes.Cassette(directory, mode="record")
+    cassettes.use_cassette(recorder)
+    run()
+    recorder.close()
+    cassettes.use_cassette(cassettes.Cassette(directory, mode="replay", latency=0))
+    return run
+
+
+# --- Commands ---------------------------------------------------------------
+
+
+def run_benchmarks(name_filter=None, rounds=7):
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        timing = time_callable(setup(), rounds=rounds)
+        results[name] = timing
+        print(f"  {name:<50}{timing['median_us']:>14.1f} us")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Print a comparison table; return the names of regressed benchmarks.
+
+    Runs are compared on the fastest round (min_us), which is far less
+    sensitive to noise from other processes than the median.
+    """
+    regressions = []
+    print(f"  {'benchmark':<50}{'baseline us':>14}{'current us':>14}{'change':>10}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"  {name:<50}{'-':>14}{result['min_us']:>14.1f}{'new':>10}")
+            continue
+        change = result["min_us"] / base["min_us"] - 1 if base["min_us"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"  {name:<50}{base['min_us']:>14.1f}{result['min_us']:>14.1f}"
+            f"{change:>+10.1%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--filter", help="only run benchmarks containing this text")
+    run_parser.add_argument("--rounds", type=int, default=7)
+    run_parser.add_argument("--output", help="write results to this JSON file")
+    run_parser.add_argument(
+        "--save-baseline", action="store_true", help=f"write results to {BASELINE_PATH}"
+    )
+
+    compare_parser = commands.add_parser(
+        "compare", help="compare results against the baseline"
+    )
+    compare_parser.add_argument(
+        "current", nargs="?", help="results JSON (runs the benchmarks if omitted)"
+    )
+    compare_parser.add_argument("--baseline", default=BASELINE_PATH)
+    compare_parser.add_argument("--threshold", type=float, default=0.25)
+    compare_parser.add_argument("--filter")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run_benchmarks(args.filter, args.rounds)
+        outputs = [args.output] if args.output else []
+        if args.save_baseline:
+            outputs.append(BASELINE_PATH)
+        for output in outputs:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            with open(output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"✓ Results saved to: {output}")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if args.current:
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args.filter)
+
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"\n✗ {len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+        return 1
+    print(f"\n✓ No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Admission control for worksheet generation
+
+At most ADMISSION_MAX_INFLIGHT generations run at once. Further requests
+wait in a bounded FIFO queue for at most ADMISSION_MAX_WAIT_S (or until
+their deadline); when the queue is full or the wait runs out the request
+is rejected at once with 503 and a Retry-After derived from the recent
+completion rate. Under a burst the admitted requests keep their normal
+latency instead of every request slowing down until all of them time out.
+
+Only the generation endpoint is admission-controlled; catalog, health and
+metrics requests never wait here.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+# Generations running at once
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "32"))
+
+# Generations waiting for a slot; beyond this requests are rejected at once
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+
+# Longest a request waits for a slot before it is rejected
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "10"))
+
+# Completions the throughput estimate behind Retry-After is based on
+_THROUGHPUT_WINDOW = 100
+
+# Longest an async waiter sleeps before re-checking for a free slot
+_MAX_POLL_SECONDS = 0.05
+
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted; carries the Retry-After seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("enqueued",)
+
+    def __init__(self):
+        self.enqueued = time.monotonic()
+
+
+class AdmissionController:
+    """Caps concurrent generations behind a bounded, time-limited queue"""
+
+    def __init__(
+        self,
+        max_inflight=ADMISSION_MAX_INFLIGHT,
+        queue_size=ADMISSION_QUEUE_SIZE,
+        max_wait=ADMISSION_MAX_WAIT_S,
+    ):
+        self.max_inflight = max_inflight
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.inflight = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queue = deque()
+        self._completions = deque(maxlen=_THROUGHPUT_WINDOW)
+        self._waits = deque(maxlen=1000)
+        self._counts = {"admitted": 0, "rejected_queue_full": 0, "rejected_wait": 0}
+
+    def _enqueue(self):
+        # Returns None if admitted immediately, else the queued waiter
+        if self.inflight < self.max_inflight and not self._queue:
+            self._admit(None)
+            return None
+        if len(self._queue) >= self.queue_size:
+            self._counts["rejected_queue_full"] += 1
+            raise Overloaded("Server is at capacity, try again later", self._retry_after())
+        waiter = _Waiter()
+        self._queue.append(waiter)
+        return waiter
+
+    def _admit(self, waiter):
+        self.inflight += 1
+        self._counts["admitted"] += 1
+        if waiter is not None:
+            self._queue.popleft()
+            self._waits.append(time.monotonic() - waiter.enqueued)
+            self._changed.notify_all()
+
+    def _try_admit(self, waiter, timeout):
+        """
+        Admit the waiter if it is first in line and a slot is free.
+
+        Returns:
+            0.0 if admitted, otherwise how long to wait before checking again
+
+        Raises:
+            Overloaded once the waiter has waited timeout seconds
+        """
+        if self._queue[0] is waiter and self.inflight < self.max_inflight:
+            self._admit(waiter)
+            return 0.0
+        left = waiter.enqueued + timeout - time.monotonic()
+        if left <= 0:
+            self._counts["rejected_wait"] += 1
+            raise Overloaded("Timed out waiting for a free generation slot", self._retry_after())
+        return left
+
+    def _discard(self, waiter):
+        if waiter in self._queue:
+            self._queue.remove(waiter)
+            self._changed.notify_all()
+
+    def _release(self):
+        with self._lock:
+            self.inflight -= 1
+            self._completions.append(time.monotonic())
+            self._changed.notify_all()
+
+    def _retry_after(self):
+        """
+        Seconds until a new request would likely get a slot, from the recent
+        completion rate and the queue ahead of it
+        """
+        now = time.monotonic()
+        if len(self._completions) >= 2 and now > self._completions[0]:
+            rate = len(self._completions) / (now - self._completions[0])
+            seconds = (len(self._queue) + 1) / rate
+        else:
+            seconds = self.max_wait
+        return max(1, min(120, math.ceil(seconds)))
+
+    def _timeout(self, timeout):
+        return self.max_wait if timeout is None else max(0.0, min(self.max_wait, timeout))
+
+    @contextmanager
+    def admit(self, timeout=None):
+        """
+        Hold a generation slot for the duration of the block, waiting at
+        most min(timeout, max_wait) seconds for it.
+
+        Raises:
+            Overloaded if the queue is full or no slot freed up in time
+        """
+        timeout = self._timeout(timeout)
+        with self._lock:
+            waiter = self._enqueue()
+            try:
+                while waiter is not None:
+                    wait = self._try_admit(waiter, timeout)
+                    if wait == 0.0:
+                        break
+                    self._changed.wait(wait)
+            except BaseException:
+                self._discard(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def admit_async(self, timeout=None):
+        """Async variant of admit; waits without blocking the event loop"""
+        timeout = self._timeout(timeout)
+        with self._lock:
+            waiter = self._enqueue()
+        try:
+            while waiter is not None:
+                with self._lock:
+                    wait = self._try_admit(waiter, timeout)
+                if wait == 0.0:
+                    break
+                await asyncio.sleep(min(wait, _MAX_POLL_SECONDS))
+        except BaseException:
+            # Includes cancellation when the client disconnects
+            with self._lock:
+                self._discard(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        """In-flight and queued generations, admissions, rejections and waits"""
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_inflight": self.max_inflight,
+                "inflight": self.inflight,
+                "queued": len(self._queue),
+                **self._counts,
+                "wait_p50": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                "wait_p95": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+                "retry_after_s": self._retry_after(),
+            }
+
+
+admission = AdmissionController()
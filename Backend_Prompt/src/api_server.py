@@ -1,18 +1,258 @@
+import hmac
 import os
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from teacher_interface import TeacherConfig
+from idempotency import (
+    IdempotencyError,
+    get_idempotency_store,
+    payload_hash,
+    scoped_key,
+)
+from werkzeug.exceptions import RequestEntityTooLarge
+from admission import Overloaded, admission
+import curriculum_topics
+from cassettes import get_cassette
+from competency_search import MAX_LIMIT as MAX_SEARCH_LIMIT
+from teacher_interface import config_from_payload
+from tracing import finish_trace, start_trace
+from uploads import MAX_UPLOAD_REQUEST_BYTES, UploadRequest
+from material_extraction import MATERIAL_LABELS, extract_in_pool
+from model_router import router
+from pregenerate import pregenerated_activities
+from worksheet_store import config_hash, get_store, section_fingerprint
 from worksheet_backend import (
-    build_system_prompt,
+    COMPETENCY_LEVELS,
+    DeadlineExceeded,
+    build_lesson_ideas_messages,
+    build_level_messages,
     parse_agent_response,
+    parse_failed,
+    remaining_time,
     run_openai_chat,
+    selected_levels,
 )
 
-MODEL = os.getenv("MODEL", os.getenv("OPENAI_MODEL", "gpt-4.1-mini"))
+# Time budget of a generation request, unless the X-Request-Timeout header
+# asks for less (or more, up to the maximum)
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", "90"))
+MAX_REQUEST_DEADLINE_S = float(os.getenv("MAX_REQUEST_DEADLINE_S", "300"))
+
+# Shared secret for /api/admin/* (sent as X-Admin-Token); unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Serve sections whose prompt is unchanged since an earlier request of the
+# same tenant from the store (1) or always generate them (0)
+REUSE_SECTIONS = os.getenv("REUSE_SECTIONS", "1") == "1"
+
+SECTION_NAMES = (*COMPETENCY_LEVELS, "lesson_ideas")
 
 app = Flask(__name__)
+app.request_class = UploadRequest  # Stream uploads into spooled, hashed files.
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_REQUEST_BYTES
 CORS(app)  # Enable CORS for all routes.
 
+# Pick up edits of the curriculum data files without a restart.
+curriculum_topics.start_watcher()
+
+
+@app.before_request
+def begin_request_trace():
+    # No-op unless TRACING_ENABLED=1.
+    g.trace_token = start_trace(request.headers.get("X-Request-Id"))
+
+
+@app.after_request
+def end_request_trace(response):
+    # Adds Server-Timing / X-Request-Id headers and logs one JSON span line.
+    finish_trace(
+        g.pop("trace_token", None),
+        response.headers,
+        method=request.method,
+        path=request.path,
+        status=response.status_code,
+    )
+    return response
+
+
+def regenerate_sections(data):
+    """
+    The sections a request wants generated afresh: "regenerate" is true
+    (all of them) or a list of section names
+
+    Raises:
+        ValueError for any other value
+    """
+    regenerate = data.get("regenerate", False)
+    if isinstance(regenerate, bool):
+        return set(SECTION_NAMES) if regenerate else set()
+    if isinstance(regenerate, list) and all(
+        isinstance(name, str) and name in SECTION_NAMES for name in regenerate
+    ):
+        return set(regenerate)
+    raise ValueError(
+        f"regenerate must be true or a list of section names ({', '.join(SECTION_NAMES)})"
+    )
+
+
+def material_ids_error(config):
+    """
+    Why the requested material_ids cannot be used, or None if every one of
+    them is in the material library
+    """
+    material_ids = config.material_ids
+    if not material_ids:
+        return None
+    if not isinstance(material_ids, list) or not all(
+        isinstance(material_id, str) for material_id in material_ids
+    ):
+        return "material_ids must be a list of material ids"
+
+    from material_library import get_library
+
+    library = get_library()
+    unknown = [
+        material_id for material_id in material_ids
+        if library.get_material(material_id) is None
+    ]
+    if unknown:
+        return f"Unknown material_ids: {', '.join(unknown)}"
+    return None
+
+
+def find_section(name, messages, tenant, regenerate):
+    """
+    Look up an earlier result of a section with exactly these messages,
+    generated by the primary model of its task
+
+    Returns:
+        ((fingerprint, model), stored content or None)
+    """
+    task = "lesson_ideas" if name == "lesson_ideas" else f"level:{name}"
+    model = router.primary_model(task)
+    section_key = (section_fingerprint(tenant, messages, model), model)
+    if not REUSE_SECTIONS or name in regenerate:
+        return section_key, None
+    return section_key, get_store().find_section(section_key[0])
+
+
+def keep_section(section_key, name, content, models):
+    """
+    Store a generated section for reuse, unless its response did not parse
+    or it was answered by a model other than the one find_section looked
+    for (the SLO fallback); models lists the model that answered
+    """
+    fingerprint, model = section_key
+    if REUSE_SECTIONS and models == [model] and not parse_failed(content):
+        get_store().put_section(fingerprint, name, content)
+
+
+def reused_worksheet(stored):
+    """
+    Shape a stored worksheet like a fresh /api/generate_worksheet response
+    """
+    return {
+        "worksheet_id": stored["worksheet_id"],
+        "reused": True,
+        "competency_id": stored["competency_id"],
+        "learning_objective": stored["learning_objective"],
+        "activities": stored["activities"],
+        "lesson_ideas": stored.get("lesson_ideas"),
+        "complete": True,
+    }
+
+
+def page_args(req, default_limit=50, max_limit=500):
+    """
+    Read the limit and offset query parameters of a list endpoint; limit is
+    clamped to 1..max_limit (SQLite treats a negative LIMIT as unlimited)
+
+    Returns:
+        (limit, offset); raises ValueError for non-integers or a negative offset
+    """
+    try:
+        limit = int(req.args.get("limit", default_limit))
+        offset = int(req.args.get("offset", 0))
+    except ValueError:
+        raise ValueError("limit and offset must be integers")
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    return max(1, min(limit, max_limit)), offset
+
+
+def request_deadline(req):
+    """
+    The time.monotonic() deadline of a request: now plus the X-Request-Timeout
+    header (seconds), or REQUEST_DEADLINE_S
+    """
+    try:
+        seconds = float(req.headers.get("X-Request-Timeout", REQUEST_DEADLINE_S))
+    except ValueError:
+        seconds = REQUEST_DEADLINE_S
+    return time.monotonic() + max(0.0, min(seconds, MAX_REQUEST_DEADLINE_S))
+
+
+def request_tenant(req):
+    """
+    Identify the tenant (school) a request belongs to, for fair scheduling
+    of upstream calls. Uses the X-Tenant-Id header, else the client address.
+    """
+    return req.headers.get("X-Tenant-Id") or req.remote_addr or "default"
+
+
+def claim_idempotency_key(req, data, deadline):
+    """
+    Claim the request's Idempotency-Key header, waiting (up to the deadline)
+    while another request with the same key is running.
+
+    Returns:
+        (key, None) if the caller should generate (key is None without the
+        header), or (key, (body, status, headers)) with the response to send
+    """
+    header = req.headers.get("Idempotency-Key")
+    if header is None:
+        return None, None
+    key = scoped_key(request_tenant(req), header)
+    outcome, status, body = get_idempotency_store().begin(
+        key, payload_hash(data), deadline
+    )
+    return key, idempotency_reply(outcome, status, body)
+
+
+def idempotency_reply(outcome, status, body):
+    """
+    The response for the outcome of claiming a key: None if the caller
+    should generate, else (body, status, headers)
+    """
+    if outcome == "claimed":
+        return None
+    if outcome == "done":
+        return body, status, {"Idempotent-Replayed": "true"}
+    if outcome == "mismatch":
+        error = "Idempotency-Key was already used with a different request body"
+        return {"error": error}, 422, {}
+    error = "A request with this Idempotency-Key is still in progress"
+    return {"error": error}, 409, {"Retry-After": "1"}
+
+
+def finish_idempotency_key(key, body, status):
+    """
+    Keep the response of a claimed key for replay. Server errors and
+    partial worksheets (sections that missed the deadline) release the key,
+    so a retry generates again.
+    """
+    if key is None:
+        return
+    if status >= 500 or body.get("complete") is False:
+        get_idempotency_store().release(key)
+    else:
+        get_idempotency_store().finish(key, status, body)
+
+
+def release_idempotency_key(key):
+    if key is not None:
+        get_idempotency_store().release(key)
+
 
 # Frontend <-> Backend contract:
 # - Called by Next.js pages in app/design/page.tsx and app/designer/page.tsx.
@@ -40,11 +280,39 @@ def generate_worksheet():
         "include_beginner": true,
         "include_intermediate": true,
         "include_advanced": true,
-        "include_lesson_ideas": true
+        "include_lesson_ideas": true,
+        "material_ids": ["3f2a9c0d1e4b5a67"],
+        "reuse_previous": false
     }
 
+    With "reuse_previous": true, the newest stored worksheet generated from
+    an identical configuration is returned without calling the model.
+    Levels whose prompt matches a pre-generated baseline (pregenerate.py),
+    i.e. requests without personal context, are served from the store.
+
+    The whole request has a deadline (X-Request-Timeout header in seconds,
+    default REQUEST_DEADLINE_S). Each upstream call only gets the time left;
+    sections that miss the deadline are reported as "timeout", sections not
+    started anymore as "skipped", and the partial worksheet is returned
+    (not stored). If no section finished, the status is 504.
+
+    With an Idempotency-Key header the request is executed at most once per
+    key: retries get the stored response (marked Idempotent-Replayed) or
+    wait for the running execution, and a different body under the same key
+    is rejected with 422.
+
+    At most ADMISSION_MAX_INFLIGHT generations run at once; a request that
+    finds the wait queue full, or waits longer than ADMISSION_MAX_WAIT_S for
+    a slot, gets 503 with a Retry-After header.
+
     Response:
     {
+        "worksheet_id": "9c1d..." | null,
+        "reused": false,
+        "complete": true,
+        "sections": {"beginner": "ok", "intermediate": "timeout",
+                     "advanced": "skipped", "lesson_ideas": "skipped"},
+        "pregenerated_levels": ["beginner"],
         "competency_id": "MI_MEDIEN_1_A",
         "learning_objective": "...",
         "activities": [ ... ],
@@ -52,112 +320,414 @@ def generate_worksheet():
     }
     """
     try:
-        # Parse incoming JSON payload.
-        data = request.json
-
-        # Map request fields into a config object used by prompt builders.
-        config = TeacherConfig()
-        config.competency_id = data.get("competency_id")
-        config.subject = data.get("subject")
-        config.cycle = data.get("cycle")
-        config.learning_objective = data.get("learning_objective", "")
-        config.materials_available = data.get("materials_available", "")
-        config.time_available = data.get("time_available", "")
-        config.teaching_ideas = data.get("teaching_ideas", "")
-        config.class_size_composition = data.get("class_size_composition", "")
-        config.other_notes = data.get("other_notes", "")
-        config.num_questions_per_level = data.get("num_questions_per_level", 3)
-        config.include_beginner = data.get("include_beginner", True)
-        config.include_intermediate = data.get("include_intermediate", True)
-        config.include_advanced = data.get("include_advanced", True)
-        config.include_lesson_ideas = data.get("include_lesson_ideas", False)
-        config.class_composition = data.get("class_composition", "")
-
-        # Guard against missing required inputs before calling the model.
-        if not config.competency_id or not config.learning_objective:
-            return (
-                jsonify(
-                    {
-                        "error": "Missing required fields: competency_id, learning_objective"
-                    }
-                ),
-                400,
+        deadline = request_deadline(request)
+
+        # Retries of an already handled request never reach the model.
+        key, replay = claim_idempotency_key(request, request.json, deadline)
+        if replay is not None:
+            body, status, headers = replay
+            return jsonify(body), status, headers
+        try:
+            with admission.admit(remaining_time(deadline)):
+                body, status = worksheet_response(request.json, deadline)
+        except BaseException:
+            release_idempotency_key(key)
+            raise
+        finish_idempotency_key(key, body, status)
+        return jsonify(body), status
+
+    except Overloaded as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+    except IdempotencyError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        # Return a safe error payload for unexpected failures.
+        return jsonify({"error": str(e)}), 500
+
+
+def worksheet_response(data, deadline):
+    """
+    Generate a worksheet for a request payload and return (body, status)
+    """
+    # Parse incoming JSON payload.
+    config = config_from_payload(data)
+
+    # Guard against missing required inputs before calling the model.
+    if not config.competency_id or not config.learning_objective:
+        return {"error": "Missing required fields: competency_id, learning_objective"}, 400
+
+    error = material_ids_error(config)
+    if error is not None:
+        return {"error": error}, 400
+
+    try:
+        regenerate = regenerate_sections(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Serve an identical earlier generation from the store if asked to.
+    fingerprint = config_hash(config, router.fingerprint())
+    if data.get("reuse_previous"):
+        previous = get_store().find_latest(fingerprint)
+        if previous is not None:
+            return reused_worksheet(previous), 200
+
+    # Prepare the response payload; activities will be appended below.
+    worksheet = {
+        "competency_id": config.competency_id,
+        "learning_objective": config.learning_objective,
+        "activities": [],
+        "lesson_ideas": None,
+        "pregenerated_levels": [],
+        "reused_sections": [],
+        "sections": {},
+    }
+    sections = worksheet["sections"]
+    activities_by_level = {}
+    tenant = request_tenant(request)
+
+    # Call the LLM per difficulty level and normalize the response.
+    for difficulty in selected_levels(config):
+        if remaining_time(deadline) <= 0:
+            sections[difficulty] = "skipped"
+            continue
+
+        # Material extraction stops waiting at the deadline too.
+        messages = build_level_messages(config, difficulty, deadline=deadline)
+
+        # Levels without personal context may have been generated off-hours,
+        # and levels whose prompt did not change since the last request of
+        # this tenant were generated before.
+        structured_activities = None
+        if difficulty not in regenerate:
+            structured_activities = pregenerated_activities(messages, difficulty)
+        if structured_activities is not None:
+            worksheet["pregenerated_levels"].append(difficulty)
+        else:
+            section_key, structured_activities = find_section(
+                difficulty, messages, tenant, regenerate
             )
+            if structured_activities is not None:
+                worksheet["reused_sections"].append(difficulty)
+            else:
+                models = []
+                try:
+                    raw_response = run_openai_chat(
+                        messages,
+                        tenant=tenant,
+                        task=f"level:{difficulty}",
+                        deadline=deadline,
+                        models=models,
+                    )
+                except DeadlineExceeded:
+                    sections[difficulty] = "timeout"
+                    continue
+                structured_activities = parse_agent_response(raw_response)
+                keep_section(section_key, difficulty, structured_activities, models)
 
-        # Build the list of difficulty levels to generate.
-        difficulty_levels = []
-        if config.include_beginner:
-            difficulty_levels.append("beginner")
-        if config.include_intermediate:
-            difficulty_levels.append("intermediate")
-        if config.include_advanced:
-            difficulty_levels.append("advanced")
-
-        # Prepare the response payload; activities will be appended below.
-        worksheet = {
-            "competency_id": config.competency_id,
-            "learning_objective": config.learning_objective,
-            "activities": [],
-            "lesson_ideas": None,
-        }
+        sections[difficulty] = "ok"
+        activities_by_level[difficulty] = structured_activities
+        worksheet["activities"].extend(structured_activities)
 
-        # Call the LLM per difficulty level and normalize the response.
-        for difficulty in difficulty_levels:
-            system_prompt = build_system_prompt(config, difficulty)
+    # Optional second pass to generate lesson ideas as JSON.
+    if config.include_lesson_ideas:
+        if remaining_time(deadline) <= 0:
+            sections["lesson_ideas"] = "skipped"
+        else:
+            messages = build_lesson_ideas_messages(config)
+            section_key, lesson_ideas = find_section(
+                "lesson_ideas", messages, tenant, regenerate
+            )
+            if lesson_ideas is not None:
+                worksheet["lesson_ideas"] = lesson_ideas
+                worksheet["reused_sections"].append("lesson_ideas")
+                sections["lesson_ideas"] = "ok"
+            else:
+                models = []
+                try:
+                    lesson_response = run_openai_chat(
+                        messages,
+                        tenant=tenant,
+                        task="lesson_ideas",
+                        deadline=deadline,
+                        models=models,
+                    )
+                    worksheet["lesson_ideas"] = parse_agent_response(lesson_response)
+                    keep_section(
+                        section_key, "lesson_ideas", worksheet["lesson_ideas"], models
+                    )
+                    sections["lesson_ideas"] = "ok"
+                except DeadlineExceeded:
+                    sections["lesson_ideas"] = "timeout"
 
-            user_prompt = f"Generate {config.num_questions_per_level} activities for the {difficulty} level."
+    return finish_worksheet(worksheet, activities_by_level, fingerprint, config)
 
-            # Standard chat format expected by the OpenAI SDK.
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ]
 
-            raw_response = run_openai_chat(messages)
+def finish_worksheet(worksheet, activities_by_level, fingerprint, config):
+    """
+    Store a complete worksheet and return (response body, status code).
+    Partial worksheets (sections that missed the deadline) are returned but
+    not stored; if no section finished the status is 504.
+    """
+    statuses = worksheet["sections"].values()
+    worksheet["complete"] = all(status == "ok" for status in statuses)
+    worksheet_id = None
+    if worksheet["complete"]:
+        # Persist the result; earlier worksheets are never overwritten.
+        worksheet_id = get_store().add_worksheet(
+            worksheet, activities_by_level, fingerprint, "api", config.cycle
+        )
+    worksheet["worksheet_id"] = worksheet_id
+    worksheet["reused"] = False
+    if statuses and "ok" not in statuses:
+        return worksheet, 504
+    return worksheet, 200
 
-            structured_activities = parse_agent_response(raw_response)
 
-            worksheet["activities"].extend(structured_activities)
+@app.route("/api/assess_batch", methods=["POST"])
+def assess_batch():
+    """
+    Assess a class set of student answers
 
-        # Optional second pass to generate lesson ideas as JSON.
-        if config.include_lesson_ideas:
-            lesson_prompt = f"""
-Based on the following context, generate 3-5 creative lesson ideas.
+    Expected JSON body:
+    {
+        "competency_id": "MI_MEDIEN_1",
+        "questions": [
+            {"id": "q1", "question": "...", "difficulty_level": "beginner",
+             "reference_answer": "..."}
+        ],
+        "responses": [
+            {"student_id": "s01", "question_id": "q1", "answer": "..."}
+        ]
+    }
+
+    Response:
+    {
+        "results": [
+            {"student_id": "s01", "question_id": "q1", "level": "beginner",
+             "feedback": "...", "evidence": "...", "status": "ok"}
+        ],
+        "profiles": {
+            "s01": {"levels": {"beginner": 1, ...}, "assessed": 1,
+                    "overall_level": "beginner"}
+        },
+        "stats": {"answers": 1, "calls": 1, "answers_per_second": 2.1,
+                  "cost_per_answer_usd": 0.00004, ...}
+    }
+    """
+    from assessment import AssessmentError, assess_class_set
 
-Lehrplan 21 Competency: {config.competency_id}
-Learning Objective: {config.learning_objective}
-Class Context: {config.class_size_composition}, {config.time_available}, {config.class_composition}
-Materials: {config.materials_available}
+    try:
+        # Whole class sets queue behind interactive worksheet generation.
+        report = assess_class_set(
+            request.json or {}, priority="batch", tenant=request_tenant(request)
+        )
+        return jsonify(report), 200
 
-Structure your ideas as an array of JSON objects, each with:
-- title
-- learning_objectives
-- activity_description
-- materials_needed
-- estimated_duration
+    except AssessmentError as e:
+        return jsonify({"error": str(e)}), 400
 
-**IMPORTANT:** Your entire response must be a single, valid JSON array. Do not include any introductory text, explanations, or markdown formatting. The response should start with `[` and end with `]`.
-"""
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-            # Use a specialized system prompt for lesson ideas.
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are an expert education consultant specializing in Swiss Lehrplan 21 curriculum design.",
-                },
-                {"role": "user", "content": lesson_prompt},
-            ]
 
-            lesson_response = run_openai_chat(messages)
+@app.route("/api/materials", methods=["POST"])
+def upload_materials():
+    """
+    Upload teacher materials into the material library
 
-            worksheet["lesson_ideas"] = parse_agent_response(lesson_response)
+    Expects multipart/form-data with one or more "files" parts
+    (.txt, .md, .pdf, .docx). Files are streamed to spooled temporary
+    files and hashed on the way in; identical files map to the same id.
 
-        return jsonify(worksheet), 200
+    Response:
+    {
+        "materials": [
+            {
+                "id": "3f2a9c0d1e4b5a67",
+                "name": "fake_news.pdf",
+                "label": "PDF file",
+                "size": 183204,
+                "sha256": "3f2a9c0d1e4b5a67...",
+                "tokens": 5120,
+                "chunks": 38
+            }
+        ]
+    }
+
+    Pass the returned ids as "material_ids" to /api/generate_worksheet.
+    """
+    try:
+        uploads = request.files.getlist("files")
+    except RequestEntityTooLarge as e:
+        # Per-file limit (while streaming) or per-request limit was exceeded.
+        return jsonify({"error": e.description}), 413
+
+    try:
+        body, status = store_uploads(uploads)
+        return jsonify(body), status
 
     except Exception as e:
-        # Return a safe error payload for unexpected failures.
         return jsonify({"error": str(e)}), 500
 
+    finally:
+        for upload in uploads:
+            upload.close()
+
+
+def store_uploads(uploads):
+    """
+    Extract new uploaded files into the material library and return
+    (body, status) for /api/materials; the caller closes the uploads
+    """
+    from material_library import get_library, material_id_for
+
+    if not uploads:
+        return {"error": "No files uploaded (expected 'files' parts)"}, 400
+
+    # Reject unsupported formats before doing any extraction work.
+    for upload in uploads:
+        ext = os.path.splitext(upload.filename or "")[1].lower()
+        if ext not in MATERIAL_LABELS:
+            return {"error": f"Unsupported file type: {upload.filename}"}, 400
+
+    library = get_library()
+
+    # Skip extraction entirely for files that were uploaded before.
+    new_uploads = [
+        upload
+        for upload in uploads
+        if library.get_material(material_id_for(upload.stream.sha256)) is None
+    ]
+
+    # Parse new files in parallel in the extraction process pool. Workers
+    # open the uploads from disk, so no file body is copied into this
+    # process or pickled to the pool.
+    files = [(upload.filename, upload.stream.path) for upload in new_uploads]
+    for upload, result in zip(new_uploads, extract_in_pool(files)):
+        if isinstance(result, Exception):
+            return {"error": f"Could not read {upload.filename}: {result}"}, 422
+        label, text = result
+        library.add_text(
+            upload.filename, label, text, material_id_for(upload.stream.sha256)
+        )
+
+    materials = []
+    for upload in uploads:
+        material = library.get_material(material_id_for(upload.stream.sha256))
+        material["size"] = upload.stream.size
+        material["sha256"] = upload.stream.sha256
+        materials.append(material)
+    return {"materials": materials}, 201
+
+
+@app.route("/api/materials", methods=["GET"])
+def list_materials():
+    """
+    List materials in the library, newest first
+
+    Query parameters:
+        limit: page size, 1-500 (default 50)
+        offset: number of materials to skip (default 0)
+    """
+    from material_library import get_library
+
+    try:
+        limit, offset = page_args(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    materials = get_library().list_materials(limit=limit, offset=offset)
+    return jsonify({"materials": materials, "limit": limit, "offset": offset}), 200
+
+
+@app.route("/api/worksheets", methods=["GET"])
+def list_worksheets():
+    """
+    List stored worksheets (without activities), newest first
+
+    Query parameters:
+        competency_id, cycle, level, config_hash: optional filters
+        before: only worksheets created before this timestamp (cursor paging)
+        limit: page size, 1-500 (default 50)
+        offset: number of worksheets to skip (default 0)
+
+    Returns:
+    {
+        "worksheets": [
+            {
+                "id": "9c1d...",
+                "competency_id": "MI_MEDIEN_1_A",
+                "cycle": "Cycle 2 (Grades 3-6)",
+                "levels": ["beginner", "intermediate", "advanced"],
+                "activity_count": 9,
+                "source": "api",
+                "config_hash": "5b0e...",
+                "created_at": 1760000000.0
+            }
+        ],
+        "limit": 50,
+        "offset": 0
+    }
+    """
+    try:
+        limit, offset = page_args(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    worksheets = get_store().list_worksheets(
+        competency_id=request.args.get("competency_id"),
+        cycle=request.args.get("cycle"),
+        level=request.args.get("level"),
+        config_hash=request.args.get("config_hash"),
+        before=request.args.get("before", type=float),
+        limit=limit,
+        offset=offset,
+    )
+    return jsonify({"worksheets": worksheets, "limit": limit, "offset": offset}), 200
+
+
+@app.route("/api/worksheets/<worksheet_id>", methods=["GET"])
+def get_worksheet(worksheet_id):
+    """
+    Get a stored worksheet with its activities and lesson ideas
+    """
+    worksheet = get_store().get_worksheet(worksheet_id)
+    if worksheet is None:
+        return jsonify({"error": "Worksheet not found"}), 404
+    return jsonify(worksheet), 200
+
+
+@app.route("/api/baselines", methods=["GET"])
+def list_baselines():
+    """
+    List pre-generated baseline activities, e.g. as a starting point in the
+    designer
+
+    Query parameters:
+        competency_id, cycle ("1"-"3"), level, preset: optional filters
+
+    Returns:
+    {
+        "baselines": [
+            {
+                "competency_id": "MI_MEDIEN_1",
+                "cycle": "2",
+                "level": "beginner",
+                "preset": "",
+                "fingerprint": "a41c...",
+                "activities": [ ... ],
+                "created_at": 1760000000.0
+            }
+        ]
+    }
+    """
+    baselines = get_store().list_baselines(
+        competency_id=request.args.get("competency_id"),
+        cycle=request.args.get("cycle"),
+        level=request.args.get("level"),
+        preset=request.args.get("preset"),
+    )
+    return jsonify({"baselines": baselines}), 200
+
 
 @app.route("/api/cycles", methods=["GET"])
 def get_cycles():
@@ -221,21 +791,68 @@ def get_all_competencies():
         ]
     }
     """
-    from curriculum_topics import COMPETENCIES
+    # Serialized once per curriculum snapshot.
+    body = curriculum_topics.snapshot().competencies_json
+    return Response(body, status=200, mimetype="application/json")
+
 
-    # Flatten the competency map into a list for the client.
+@app.route("/api/competencies/search", methods=["GET"])
+def search_competencies():
+    """
+    Search the Lehrplan catalog by id, name and focus, in German and English
+
+    Query parameters:
+        q: search text; every word must match, the last one as a prefix
+           (empty lists everything passing the filters)
+        cycle: "1", "2" or "3" (optional)
+        domain: "media" or "informatics" (optional)
+        limit: page size, 1-100 (default 20)
+        offset: entries to skip (default 0)
+
+    Returns:
+    {
+        "query": "medien prod",
+        "total": 1,
+        "limit": 20,
+        "offset": 0,
+        "results": [
+            {
+                "id": "MI_MEDIEN_3",
+                "name": "Media Production and Publishing",
+                "name_de": "Medien produzieren und publizieren",
+                "domain": "media",
+                "cycles": ["2", "3"],
+                "parent_id": null,
+                "score": 6
+            }
+        ]
+    }
+    """
+    try:
+        limit = int(request.args.get("limit", 20))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({"error": "limit must be positive and offset not negative"}), 400
+
+    query = request.args.get("q", "")
+    index = curriculum_topics.snapshot().search_index
+    total, page = index.search(
+        query,
+        cycle=request.args.get("cycle"),
+        domain=request.args.get("domain"),
+        limit=limit,
+        offset=offset,
+    )
     return (
         jsonify(
             {
-                "competencies": [
-                    {
-                        "id": comp_id,
-                        "name": comp.get("name", "Unknown"),
-                        "domain": comp.get("domain", "unknown"),
-                        "cycles": comp.get("cycles", []),
-                    }
-                    for comp_id, comp in COMPETENCIES.items()
-                ]
+                "query": query,
+                "total": total,
+                "limit": min(limit, MAX_SEARCH_LIMIT),
+                "offset": offset,
+                "results": [{**entry, "score": score} for entry, score in page],
             }
         ),
         200,
@@ -267,30 +884,12 @@ def get_competencies_by_cycle(cycle_id):
         ]
     }
     """
-    from curriculum_topics import COMPETENCIES
-
     # Optional query string filter like ?subject=media.
     subject_filter = request.args.get("subject", None)
 
-    # Filter competencies by the path cycle_id.
-    filtered_competencies = [
-        {
-            "id": comp_id,
-            "name": comp.get("name", "Unknown"),
-            "domain": comp.get("domain", "unknown"),
-            "cycles": comp.get("cycles", []),
-        }
-        for comp_id, comp in COMPETENCIES.items()
-        if cycle_id in comp.get("cycles", [])
-    ]
-
-    # Optionally narrow results by subject domain.
-    if subject_filter:
-        filtered_competencies = [
-            c for c in filtered_competencies if c["domain"] == subject_filter
-        ]
-
-    return jsonify({"cycle": cycle_id, "competencies": filtered_competencies}), 200
+    # Pre-serialized per cycle and subject in the curriculum snapshot.
+    body = curriculum_topics.snapshot().cycle_response(cycle_id, subject_filter)
+    return Response(body, status=200, mimetype="application/json")
 
 
 @app.route("/api/competency/<competency_id>", methods=["GET"])
@@ -310,43 +909,123 @@ def get_competency_details(competency_id):
         "cycles": ["1", "2", "3"]
     }
     """
-    from curriculum_topics import COMPETENCIES
+    body = curriculum_topics.snapshot().details_json.get(competency_id)
 
     # Return 404 if the requested ID is unknown.
-    if competency_id not in COMPETENCIES:
+    if body is None:
         return jsonify({"error": "Competency not found"}), 404
 
-    comp = COMPETENCIES[competency_id]
+    return Response(body, status=200, mimetype="application/json")
+
 
-    # Shape the response with only the fields needed by the client.
+@app.route("/api/health", methods=["GET"])
+def health_check():
+    """
+    Health check endpoint to verify API is running
+
+    Returns:
+    {
+        "status": "healthy",
+        "version": "1.0",
+        "model": "gpt-4o-mini",
+        "curriculum": {"version": "3b9e0c41d2aa", "loaded_at": 1760000000.0,
+                       "competencies": 12, "last_error": null},
+        "routing": {
+            "default": "gpt-4o-mini",
+            "routes": {
+                "level:beginner": {"model": "gpt-4.1-nano", "fallback": null,
+                                   "latency_slo_s": null, "active": "gpt-4.1-nano"},
+                ...
+            }
+        }
+    }
+    """
+    # Surface basic service metadata for monitoring.
     return (
         jsonify(
             {
-                "id": competency_id,
-                "name": comp.get("name", "Unknown"),
-                "focus": comp.get("focus", ""),
-                "domain": comp.get("domain", "unknown"),
-                "cycles": comp.get("cycles", []),
+                "status": "healthy",
+                "version": "1.0",
+                "model": router.default,
+                "routing": router.table(),
+                "curriculum": curriculum_topics.status(),
             }
         ),
         200,
     )
 
 
-@app.route("/api/health", methods=["GET"])
-def health_check():
+@app.route("/api/admin/reload_curriculum", methods=["POST"])
+def reload_curriculum():
     """
-    Health check endpoint to verify API is running
+    Reload lehrplan21.json and level_descriptors.json now instead of at the
+    next poll. Requires the X-Admin-Token header to match ADMIN_TOKEN.
 
     Returns:
     {
-        "status": "healthy",
-        "version": "1.0",
-        "model": "llama3.2"
+        "reloaded": true,
+        "curriculum": {"version": "3b9e0c41d2aa", "loaded_at": 1760000000.0,
+                       "competencies": 12, "last_error": null}
     }
+    If a file is invalid the previous data stays in use and the status is
+    422 with the validation error.
     """
-    # Surface basic service metadata for monitoring.
-    return jsonify({"status": "healthy", "version": "1.0", "model": MODEL}), 200
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+
+    reloaded, error = curriculum_topics.reload(force=True)
+    body = {"reloaded": reloaded, "curriculum": curriculum_topics.status()}
+    if error:
+        body["error"] = error
+        return jsonify(body), 422
+    return jsonify(body), 200
+
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    """
+    Upstream scheduler metrics (rate limits in effect and queue wait times
+    per priority class) and model routing metrics (latency and tokens per
+    task and model)
+
+    Returns:
+    {
+        "scheduler": {
+            "limits": {"requests_per_minute": 500, "tokens_per_minute": 200000},
+            "priorities": {
+                "interactive": {"queued": 0, "admitted": 12, "wait_p50": 0.0, ...},
+                "batch": {...}
+            }
+        },
+        "routes": {
+            "level:beginner": {
+                "gpt-4.1-nano": {"calls": 4, "errors": 0, "latency_p50_s": 2.1, ...}
+            }
+        },
+        "idempotency": {"executed": 12, "replayed": 3, "waited": 1, "mismatched": 0},
+        "admission": {"max_inflight": 32, "inflight": 32, "queued": 5, "admitted": 410,
+                      "rejected_queue_full": 0, "rejected_wait": 12, ...},
+        "cassette": {"mode": "replay", "requests": 240, "replayed": 96, "missed": 0, ...}
+    }
+
+    "cassette" is null unless LLM_CASSETTE_MODE records or replays calls.
+    """
+    from rate_limiter import scheduler
+
+    cassette = get_cassette()
+    return (
+        jsonify(
+            {
+                "scheduler": scheduler.stats(),
+                "routes": router.stats(),
+                "idempotency": get_idempotency_store().stats(),
+                "admission": admission.stats(),
+                "cassette": cassette.stats() if cassette is not None else None,
+            }
+        ),
+        200,
+    )
 
 
 if __name__ == "__main__":
@@ -356,12 +1035,21 @@ if __name__ == "__main__":
     print("=" * 60)
     print("Available endpoints:")
     print("  GET  /api/health")
+    print("  GET  /api/metrics")
     print("  GET  /api/cycles")
     print("  GET  /api/subjects")
     print("  GET  /api/competencies")
+    print("  GET  /api/competencies/search?q=medien&cycle=2")
     print("  GET  /api/competencies/<cycle_id>?subject=media")
     print("  GET  /api/competency/<competency_id>")
     print("  POST /api/generate_worksheet")
+    print("  POST /api/assess_batch")
+    print("  POST /api/materials")
+    print("  GET  /api/materials")
+    print("  GET  /api/worksheets")
+    print("  GET  /api/worksheets/<worksheet_id>")
+    print("  GET  /api/baselines")
+    print("  POST /api/admin/reload_curriculum")
     print("=" * 60)
     print("Server running at: http://localhost:4000")
     print("=" * 60)
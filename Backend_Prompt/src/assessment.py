@@ -0,0 +1,527 @@
+"""
+Batch assessment of student responses
+
+Grades a whole class set at once. Answers are grouped per question and
+packed into a few calls (ASSESSMENT_BATCH_SIZE answers each), the groups run
+concurrently, and every answer gets a structured result: a level from
+COMPETENCY_LEVELS, feedback and evidence. Before that, a local pre-scorer
+grades empty and reference-matching answers by rule and sends identical
+answers to the model only once. Results are aggregated into a competency
+profile per student, and the run reports throughput, cost per answer and
+how much the pre-scorer saved.
+
+Usage:
+    python assessment.py <class_set.json> [--output results.json]
+
+A class set looks like:
+    {
+        "competency_id": "MI_MEDIEN_1",
+        "questions": [
+            {"id": "q1", "question": "...", "difficulty_level": "beginner",
+             "reference_answer": "..."}
+        ],
+        "responses": [
+            {"student_id": "s01", "question_id": "q1", "answer": "..."}
+        ]
+    }
+"""
+
+import json
+import math
+import os
+import re
+import sys
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from model_router import router
+from worksheet_backend import (
+    COMPETENCY_LEVELS,
+    add_usage,
+    parse_agent_response,
+    run_openai_chat,
+)
+
+# Answers packed into one upstream call
+ASSESSMENT_BATCH_SIZE = int(os.getenv("ASSESSMENT_BATCH_SIZE", "15"))
+
+# Packed calls in flight at once
+ASSESSMENT_CONCURRENCY = int(os.getenv("ASSESSMENT_CONCURRENCY", "8"))
+
+# Grade empty, reference-matching and duplicate answers locally (1) or not (0)
+ASSESSMENT_PRESCORE = os.getenv("ASSESSMENT_PRESCORE", "1") == "1"
+
+# Normalized answers that count as no answer at all
+NON_ANSWERS = {
+    "",
+    "idk",
+    "i dont know",
+    "i don t know",
+    "no idea",
+    "n a",
+    "na",
+    "weiss nicht",
+    "ich weiss nicht",
+    "keine ahnung",
+    "k a",
+    "ka",
+}
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+# USD per million (input, output) tokens by model, for the cost report.
+# OPENAI_PRICES ({"model": [input, output]}) adds or overrides models;
+# OPENAI_PRICE_INPUT_PER_1M / OPENAI_PRICE_OUTPUT_PER_1M set the price of
+# the assessment route's primary model. Calls answered by a model without a
+# price leave the cost out of the report.
+DEFAULT_PRICES_PER_1M = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+
+def load_prices():
+    """Return the price table with the environment's prices applied"""
+    prices = dict(DEFAULT_PRICES_PER_1M)
+    for model, price in json.loads(os.getenv("OPENAI_PRICES", "{}")).items():
+        prices[model] = tuple(price)
+    if os.getenv("OPENAI_PRICE_INPUT_PER_1M") and os.getenv("OPENAI_PRICE_OUTPUT_PER_1M"):
+        prices[router.primary_model("assessment")] = (
+            float(os.getenv("OPENAI_PRICE_INPUT_PER_1M")),
+            float(os.getenv("OPENAI_PRICE_OUTPUT_PER_1M")),
+        )
+    return prices
+
+
+MODEL_PRICES_PER_1M = load_prices()
+
+
+class AssessmentError(ValueError):
+    """Raised for a malformed class set"""
+
+
+def validate_class_set(class_set):
+    """
+    Check a class set and return (questions by id, responses)
+    """
+    if not isinstance(class_set, dict):
+        raise AssessmentError("A class set must be a JSON object")
+
+    questions = {}
+    class_questions = class_set.get("questions", [])
+    if not isinstance(class_questions, list):
+        raise AssessmentError("'questions' must be a list")
+    for question in class_questions:
+        if not isinstance(question, dict):
+            raise AssessmentError("Every question must be an object")
+        if not question.get("id") or not question.get("question"):
+            raise AssessmentError("Every question needs an 'id' and a 'question'")
+        questions[str(question["id"])] = question
+
+    responses = class_set.get("responses", [])
+    if not isinstance(responses, list):
+        raise AssessmentError("'responses' must be a list")
+    if not responses:
+        raise AssessmentError("No responses to assess")
+    for response in responses:
+        if not isinstance(response, dict):
+            raise AssessmentError("Every response must be an object")
+        if str(response.get("question_id")) not in questions:
+            raise AssessmentError(
+                f"Response references unknown question: {response.get('question_id')}"
+            )
+        if not response.get("student_id"):
+            raise AssessmentError("Every response needs a 'student_id'")
+    return questions, responses
+
+
+def build_assessment_messages(question, answers, competency=None):
+    """
+    Build the chat messages that grade several answers to one question.
+    Answers are numbered; student ids never reach the model.
+    """
+    context = ""
+    if competency:
+        context = (
+            f"Lehrplan 21 Competency: {competency.get('name', '')}\n"
+            f"Competency focus: {competency.get('focus', '')}\n"
+        )
+    if question.get("difficulty_level"):
+        context += f"Intended difficulty level: {question['difficulty_level']}\n"
+    if question.get("reference_answer"):
+        context += f"Reference answer: {question['reference_answer']}\n"
+
+    numbered = "\n".join(
+        f"[{i}] {json.dumps(answer, ensure_ascii=False)}" for i, answer in enumerate(answers, 1)
+    )
+
+    prompt = f"""Assess each of the following student answers to the same question.
+
+{context}Question: {question['question']}
+
+Student answers:
+{numbered}
+
+For every answer, think through its quality, then return:
+- id: the number of the answer
+- level: the competency level shown, exactly one of {COMPETENCY_LEVELS}
+- feedback: specific, encouraging feedback for the student (1-3 sentences)
+- evidence: the part of the answer that supports the level
+
+Output ONLY a valid JSON array with one object per answer, in the same order.
+Do not include any text or formatting outside of this JSON.
+"""
+    return [
+        {"role": "system", "content": "You are an expert in educational assessment."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def parse_assessments(raw_response, count):
+    """
+    Map a packed grading response onto the answers
+
+    Returns:
+        list of count dicts (or None for answers the model skipped)
+    """
+    parsed = parse_agent_response(raw_response)
+    if isinstance(parsed, dict):
+        parsed = parsed.get("results") or parsed.get("assessments") or []
+
+    results = [None] * count
+    for position, item in enumerate(parsed if isinstance(parsed, list) else []):
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("id", position + 1)) - 1
+        except (TypeError, ValueError):
+            index = position
+        level = str(item.get("level", "")).strip().lower()
+        if not 0 <= index < count or level not in COMPETENCY_LEVELS:
+            continue
+        results[index] = {
+            "level": level,
+            "feedback": item.get("feedback", ""),
+            "evidence": item.get("evidence", ""),
+        }
+    return results
+
+
+def assess_group(question, answers, competency=None, priority="batch", tenant="default"):
+    """
+    Grade several answers to one question in one call. Answers the response
+    missed are retried once in a smaller call.
+
+    Returns:
+        (list of result dicts, usage dict per model that answered,
+        number of calls)
+    """
+    usage_by_model = {}
+
+    def grade(group_answers):
+        call_usage = {}
+        models = []
+        raw_response = run_openai_chat(
+            build_assessment_messages(question, group_answers, competency),
+            temperature=0.2,
+            priority=priority,
+            tenant=tenant,
+            usage=call_usage,
+            task="assessment",
+            models=models,
+        )
+        add_usage(usage_by_model.setdefault(models[0], {}), call_usage)
+        return parse_assessments(raw_response, len(group_answers))
+
+    calls = 1
+    results = grade(answers)
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        calls += 1
+        for i, result in zip(missing, grade([answers[i] for i in missing])):
+            results[i] = result
+
+    return [
+        result
+        if result is not None
+        else {"level": None, "feedback": "", "evidence": "", "status": "error"}
+        for result in results
+    ], usage_by_model, calls
+
+
+def usage_cost(usage, model):
+    """USD cost of a model's token usage, or None if its price is unknown"""
+    price = MODEL_PRICES_PER_1M.get(model)
+    if price is None:
+        return None
+    return (
+        usage.get("prompt_tokens", 0) * price[0]
+        + usage.get("completion_tokens", 0) * price[1]
+    ) / 1_000_000
+
+
+def student_profiles(results):
+    """
+    Aggregate graded answers into a competency profile per student
+    """
+    profiles = {}
+    for result in results:
+        profile = profiles.setdefault(
+            result["student_id"],
+            {"levels": {level: 0 for level in COMPETENCY_LEVELS}, "assessed": 0},
+        )
+        if result["level"] in profile["levels"]:
+            profile["levels"][result["level"]] += 1
+            profile["assessed"] += 1
+
+    for profile in profiles.values():
+        ranks = []
+        for rank, level in enumerate(COMPETENCY_LEVELS):
+            ranks.extend([rank] * profile["levels"][level])
+        # The median level is robust against a single outlier answer
+        profile["overall_level"] = (
+            COMPETENCY_LEVELS[ranks[(len(ranks) - 1) // 2]] if ranks else None
+        )
+    return profiles
+
+
+def normalize_answer(answer):
+    """Case-fold and strip punctuation and extra whitespace from an answer"""
+    text = unicodedata.normalize("NFKC", str(answer or "")).casefold()
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def prescore(question, answer):
+    """
+    Grade an answer locally when a deterministic rule applies.
+
+    Returns:
+        a result dict, or None if the answer needs the model
+    """
+    normalized = normalize_answer(answer)
+    if normalized in NON_ANSWERS:
+        return {
+            "level": None,
+            "feedback": "No answer was given.",
+            "evidence": "",
+            "status": "empty",
+        }
+
+    reference = question.get("reference_answer")
+    if reference and normalized == normalize_answer(reference):
+        level = question.get("difficulty_level")
+        return {
+            "level": level if level in COMPETENCY_LEVELS else COMPETENCY_LEVELS[-1],
+            "feedback": "Your answer matches the expected answer.",
+            "evidence": str(answer),
+            "status": "ok",
+        }
+    return None
+
+
+def assess_class_set(class_set, priority="batch", tenant="default", concurrency=None):
+    """
+    Grade a class set.
+
+    With ASSESSMENT_PRESCORE enabled, empty answers and answers equal to the
+    reference answer are graded by rule, and identical answers to the same
+    question (after normalization) are sent to the model once.
+
+    Returns:
+    {
+        "results": [{"student_id", "question_id", "level", "feedback",
+                     "evidence", "status", "source"}, ...],
+        "profiles": {student_id: {"levels", "assessed", "overall_level"}},
+        "stats": {"answers", "sent_to_model", "short_circuited",
+                  "short_circuit_fraction", "calls", "failed_batches",
+                  "calls_saved", "latency_saved_s_estimate", "elapsed_s",
+                  "answers_per_second", "prompt_tokens", "completion_tokens",
+                  "cost_usd", "cost_per_answer_usd", "model"}
+    }
+    """
+    from curriculum_topics import COMPETENCIES
+
+    started = time.perf_counter()
+    questions, responses = validate_class_set(class_set)
+    competency = COMPETENCIES.get(class_set.get("competency_id"))
+
+    def result_for(index, result, source):
+        return {
+            "student_id": responses[index]["student_id"],
+            "question_id": str(responses[index]["question_id"]),
+            "status": "ok",
+            "source": source,
+            **result,
+        }
+
+    # Pre-score locally; group the remaining distinct answers per question
+    results = [None] * len(responses)
+    answers_per_question = {}
+    distinct = {}
+    for index, response in enumerate(responses):
+        question_id = str(response["question_id"])
+        answers_per_question[question_id] = answers_per_question.get(question_id, 0) + 1
+        answer = str(response.get("answer") or "")
+        if ASSESSMENT_PRESCORE:
+            rule_result = prescore(questions[question_id], answer)
+            if rule_result is not None:
+                results[index] = result_for(index, rule_result, "rule")
+                continue
+            key = normalize_answer(answer)
+        else:
+            key = index
+        distinct.setdefault(question_id, {}).setdefault(key, []).append(index)
+
+    # Split each question's distinct answers into packed calls
+    groups = []
+    for question_id, answers in distinct.items():
+        same_answers = list(answers.values())
+        for start in range(0, len(same_answers), ASSESSMENT_BATCH_SIZE):
+            groups.append((question_id, same_answers[start : start + ASSESSMENT_BATCH_SIZE]))
+
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    usage_by_model = {}
+    calls = 0
+    model_seconds = 0.0
+
+    def run_group(group):
+        question_id, same_answers = group
+        answers = [str(responses[indices[0]].get("answer") or "") for indices in same_answers]
+        group_started = time.perf_counter()
+        graded = assess_group(questions[question_id], answers, competency, priority, tenant)
+        return same_answers, graded, time.perf_counter() - group_started
+
+    # A failed group (upstream error) marks its answers as errors; the
+    # other groups are still graded
+    failed_batches = 0
+    with ThreadPoolExecutor(max_workers=concurrency or ASSESSMENT_CONCURRENCY) as executor:
+        futures = {executor.submit(run_group, group): group for group in groups}
+        for future in as_completed(futures):
+            try:
+                same_answers, (group_results, group_usage_by_model, group_calls), seconds = (
+                    future.result()
+                )
+            except Exception as e:
+                failed_batches += 1
+                calls += 1
+                same_answers = futures[future][1]
+                group_results = [
+                    {"level": None, "feedback": "", "evidence": "", "status": "error",
+                     "error": str(e)}
+                ] * len(same_answers)
+            else:
+                calls += group_calls
+                model_seconds += seconds
+                for model, group_usage in group_usage_by_model.items():
+                    add_usage(usage_by_model.setdefault(model, {}), group_usage)
+                    for key in usage:
+                        usage[key] += group_usage.get(key, 0)
+            for indices, result in zip(same_answers, group_results):
+                results[indices[0]] = result_for(indices[0], result, "model")
+                for index in indices[1:]:
+                    results[index] = result_for(index, result, "duplicate")
+
+    # Savings compared with sending every answer to the model
+    sent = sum(len(answers) for answers in distinct.values())
+    short_circuited = len(results) - sent
+    calls_without_prescore = sum(
+        math.ceil(count / ASSESSMENT_BATCH_SIZE) for count in answers_per_question.values()
+    )
+
+    elapsed = time.perf_counter() - started
+    # Priced by the model that answered each call (a route may fall back)
+    models = {}
+    cost = 0.0
+    for model, model_usage in usage_by_model.items():
+        model_cost = usage_cost(model_usage, model)
+        models[model] = {
+            "prompt_tokens": model_usage.get("prompt_tokens", 0),
+            "completion_tokens": model_usage.get("completion_tokens", 0),
+            "cost_usd": round(model_cost, 6) if model_cost is not None else None,
+        }
+        cost = None if cost is None or model_cost is None else cost + model_cost
+    return {
+        "results": results,
+        "profiles": student_profiles(results),
+        "stats": {
+            "answers": len(results),
+            "sent_to_model": sent,
+            "short_circuited": short_circuited,
+            "short_circuit_fraction": round(short_circuited / len(results), 3),
+            "calls": calls,
+            "failed_batches": failed_batches,
+            "calls_saved": calls_without_prescore - calls,
+            # Upstream time per graded answer, applied to the skipped answers
+            "latency_saved_s_estimate": (
+                round(model_seconds / sent * short_circuited, 3) if sent else 0.0
+            ),
+            "elapsed_s": round(elapsed, 3),
+            "answers_per_second": round(len(results) / elapsed, 2) if elapsed else None,
+            **usage,
+            "cost_usd": round(cost, 6) if cost is not None else None,
+            "cost_per_answer_usd": (
+                round(cost / len(results), 8) if cost is not None else None
+            ),
+            "model": router.primary_model("assessment"),
+            "models": models,
+        },
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Assess a class set of student answers")
+    parser.add_argument("class_set", help="JSON file with questions and responses")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--concurrency", type=int, default=ASSESSMENT_CONCURRENCY)
+    args = parser.parse_args()
+
+    with open(args.class_set, "r", encoding="utf-8") as f:
+        class_set = json.load(f)
+
+    try:
+        report = assess_class_set(class_set, concurrency=args.concurrency)
+    except AssessmentError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    print("=" * 60)
+    print("STUDENT PROFILES")
+    print("=" * 60)
+    for student_id, profile in sorted(report["profiles"].items()):
+        counts = ", ".join(f"{level}: {n}" for level, n in profile["levels"].items())
+        print(f"  {student_id}: {profile['overall_level']} ({counts})")
+
+    stats = report["stats"]
+    print("-" * 60)
+    print(
+        f"{stats['answers']} answers in {stats['calls']} calls, {stats['elapsed_s']} s "
+        f"({stats['answers_per_second']} answers/s)"
+    )
+    print(
+        f"{stats['short_circuited']} answers ({stats['short_circuit_fraction']:.0%}) graded "
+        f"locally, {stats['calls_saved']} calls and ~{stats['latency_saved_s_estimate']} s "
+        f"of upstream time saved"
+    )
+    if stats["cost_usd"] is None:
+        cost = "cost unknown (no price for " + ", ".join(
+            model for model, model_stats in stats["models"].items()
+            if model_stats["cost_usd"] is None
+        ) + ")"
+    else:
+        cost = f"${stats['cost_usd']:.4f} (${stats['cost_per_answer_usd']:.6f} per answer)"
+    print(
+        f"{stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion tokens, "
+        f"{cost}"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"✓ Results saved to: {args.output}")
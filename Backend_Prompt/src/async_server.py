@@ -0,0 +1,362 @@
+"""
+Async serving mode for the worksheet API
+
+POST /api/generate_worksheet runs on an asyncio event loop with the async
+OpenAI client: all levels and the lesson ideas are requested concurrently,
+a waiting generation costs a coroutine instead of a thread, and when the
+client disconnects Quart cancels the handler, which aborts every outstanding
+upstream call. POST /api/materials also runs natively, so uploads are
+streamed to disk instead of buffered by the bridge. All other routes are
+served by the unchanged Flask app (api_server.py) through a WSGI bridge.
+
+Run with:
+    python async_server.py
+or
+    hypercorn async_server:app --bind 0.0.0.0:4000
+"""
+
+import asyncio
+import os
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, g, jsonify, request
+from quart import Request as QuartRequest
+from quart_cors import cors
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from admission import Overloaded, admission
+from api_server import app as flask_app
+from api_server import (
+    config_from_payload,
+    find_section,
+    finish_idempotency_key,
+    finish_worksheet,
+    idempotency_reply,
+    keep_section,
+    material_ids_error,
+    regenerate_sections,
+    release_idempotency_key,
+    request_deadline,
+    request_tenant,
+    reused_worksheet,
+    store_uploads,
+)
+from idempotency import (
+    IdempotencyError,
+    get_idempotency_store,
+    payload_hash,
+    scoped_key,
+)
+from model_router import router
+from pregenerate import pregenerated_activities
+from tracing import finish_trace, start_trace
+from uploads import MAX_UPLOAD_REQUEST_BYTES, HashingSpooledFile
+from worksheet_store import config_hash, get_store
+from worksheet_backend import (
+    DeadlineExceeded,
+    build_lesson_ideas_messages,
+    build_level_messages,
+    parse_agent_response,
+    remaining_time,
+    run_openai_chat_async,
+    selected_levels,
+)
+
+# Methods of the routes served natively on the event loop, with their CORS
+# preflights; everything else goes to Flask
+ASYNC_ROUTES = {
+    "/api/generate_worksheet": {"POST", "OPTIONS"},
+    "/api/materials": {"POST", "OPTIONS"},
+}
+
+# Largest request body the WSGI bridge buffers; only JSON requests pass
+# through it, uploads are streamed by the native /api/materials route
+MAX_BRIDGED_BODY_BYTES = 8 * 1024 * 1024
+
+
+class AsyncUploadRequest(QuartRequest):
+    """Quart request that streams uploaded files into HashingSpooledFile"""
+
+    def make_form_data_parser(self):
+        parser = super().make_form_data_parser()
+        parser.stream_factory = self._upload_stream
+        return parser
+
+    @staticmethod
+    def _upload_stream(total_content_length, content_type, filename, content_length):
+        return HashingSpooledFile(filename=filename)
+
+
+quart_app = cors(Quart(__name__))
+quart_app.request_class = AsyncUploadRequest
+quart_app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_REQUEST_BYTES
+
+wsgi_app = AsyncioWSGIMiddleware(flask_app, max_body_size=MAX_BRIDGED_BODY_BYTES)
+
+
+@quart_app.before_request
+async def begin_request_trace():
+    # No-op unless TRACING_ENABLED=1.
+    g.trace_token = start_trace(request.headers.get("X-Request-Id"))
+
+
+@quart_app.after_request
+async def end_request_trace(response):
+    finish_trace(
+        g.pop("trace_token", None),
+        response.headers,
+        method=request.method,
+        path=request.path,
+        status=response.status_code,
+    )
+    return response
+
+
+def level_messages_and_earlier(config, level, tenant, regenerate, deadline):
+    """
+    Build the messages of a level and look for activities generated before:
+    the pre-generated baselines first, then the tenant's earlier sections
+
+    Returns:
+        (messages, section key, activities or None, origin)
+    """
+    messages = build_level_messages(config, level, deadline=deadline)
+    if level not in regenerate:
+        baseline = pregenerated_activities(messages, level)
+        if baseline is not None:
+            return messages, None, baseline, "pregenerated"
+    section_key, activities = find_section(level, messages, tenant, regenerate)
+    return messages, section_key, activities, "reused"
+
+
+async def generate_level(config, level, tenant, deadline, regenerate):
+    """
+    Generate and parse the activities for one level.
+
+    Returns:
+        (activities, origin) where origin is "pregenerated" or "reused" for
+        activities generated before and None for a new generation
+    """
+    # Prompt building may extract files; keep it off the event loop (the
+    # thread stops waiting for extraction at the deadline)
+    messages, section_key, activities, origin = await asyncio.to_thread(
+        level_messages_and_earlier, config, level, tenant, regenerate, deadline
+    )
+    if activities is not None:
+        return activities, origin
+    models = []
+    raw_response = await run_openai_chat_async(
+        messages, tenant=tenant, task=f"level:{level}", deadline=deadline, models=models
+    )
+    activities = parse_agent_response(raw_response)
+    await asyncio.to_thread(keep_section, section_key, level, activities, models)
+    return activities, None
+
+
+async def generate_lesson_ideas(config, tenant, deadline, regenerate):
+    """Generate and parse the lesson ideas; returns (lesson ideas, origin)"""
+    messages = build_lesson_ideas_messages(config)
+    section_key, lesson_ideas = await asyncio.to_thread(
+        find_section, "lesson_ideas", messages, tenant, regenerate
+    )
+    if lesson_ideas is not None:
+        return lesson_ideas, "reused"
+    models = []
+    lesson_response = await run_openai_chat_async(
+        messages, tenant=tenant, task="lesson_ideas", deadline=deadline, models=models
+    )
+    lesson_ideas = parse_agent_response(lesson_response)
+    await asyncio.to_thread(
+        keep_section, section_key, "lesson_ideas", lesson_ideas, models
+    )
+    return lesson_ideas, None
+
+
+async def claim_idempotency_key(req, data, deadline):
+    """
+    Async equivalent of api_server.claim_idempotency_key; waiting for a
+    running execution with the same key does not hold a thread
+    """
+    header = req.headers.get("Idempotency-Key")
+    if header is None:
+        return None, None
+    key = scoped_key(request_tenant(req), header)
+    outcome, status, body = await get_idempotency_store().begin_async(
+        key, payload_hash(data), deadline
+    )
+    return key, idempotency_reply(outcome, status, body)
+
+
+@quart_app.route("/api/generate_worksheet", methods=["POST"])
+async def generate_worksheet():
+    """
+    Async equivalent of api_server.generate_worksheet (same request and
+    response shape, including Idempotency-Key handling and admission
+    control). All sections run
+    concurrently; those still running at the deadline are cancelled and
+    reported as "timeout".
+    """
+    try:
+        deadline = request_deadline(request)
+        data = await request.get_json()
+
+        # Retries of an already handled request never reach the model.
+        key, replay = await claim_idempotency_key(request, data, deadline)
+        if replay is not None:
+            body, status, headers = replay
+            return jsonify(body), status, headers
+        try:
+            async with admission.admit_async(remaining_time(deadline)):
+                body, status = await worksheet_response(
+                    data, deadline, request_tenant(request)
+                )
+        except BaseException:
+            # Also on cancellation, where awaiting a thread is not possible
+            release_idempotency_key(key)
+            raise
+        await asyncio.to_thread(finish_idempotency_key, key, body, status)
+        return jsonify(body), status
+
+    except Overloaded as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+    except IdempotencyError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        # Return a safe error payload for unexpected failures.
+        return jsonify({"error": str(e)}), 500
+
+
+async def worksheet_response(data, deadline, tenant):
+    """
+    Generate a worksheet for a request payload and return (body, status)
+    """
+    config = config_from_payload(data)
+
+    # Guard against missing required inputs before calling the model.
+    if not config.competency_id or not config.learning_objective:
+        return {"error": "Missing required fields: competency_id, learning_objective"}, 400
+
+    error = await asyncio.to_thread(material_ids_error, config)
+    if error is not None:
+        return {"error": error}, 400
+
+    try:
+        regenerate = regenerate_sections(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    fingerprint = config_hash(config, router.fingerprint())
+    if data.get("reuse_previous"):
+        previous = await asyncio.to_thread(get_store().find_latest, fingerprint)
+        if previous is not None:
+            return reused_worksheet(previous), 200
+
+    # Run every LLM call concurrently; results keep the level order.
+    levels = selected_levels(config)
+    tasks = {
+        level: asyncio.ensure_future(
+            generate_level(config, level, tenant, deadline, regenerate)
+        )
+        for level in levels
+    }
+    if config.include_lesson_ideas:
+        tasks["lesson_ideas"] = asyncio.ensure_future(
+            generate_lesson_ideas(config, tenant, deadline, regenerate)
+        )
+    pending = set()
+    try:
+        # asyncio.wait rejects an empty set (no levels and no lesson ideas)
+        if tasks:
+            _, pending = await asyncio.wait(
+                tasks.values(), timeout=max(0.0, remaining_time(deadline))
+            )
+    finally:
+        # Cancel what is left at the deadline, or everything if the
+        # client disconnected (this handler is then cancelled itself).
+        for task in tasks.values():
+            task.cancel()
+
+    sections = {}
+    results = {}
+    for name, task in tasks.items():
+        if task in pending or isinstance(task.exception(), DeadlineExceeded):
+            sections[name] = "timeout"
+        elif task.exception() is not None:
+            raise task.exception()
+        else:
+            sections[name] = "ok"
+            results[name] = task.result()
+
+    activities_by_level = {
+        level: results[level][0] for level in levels if level in results
+    }
+    worksheet = {
+        "competency_id": config.competency_id,
+        "learning_objective": config.learning_objective,
+        "activities": [
+            activity for level in activities_by_level.values() for activity in level
+        ],
+        "lesson_ideas": results["lesson_ideas"][0] if "lesson_ideas" in results else None,
+        "pregenerated_levels": [
+            level for level in levels
+            if level in results and results[level][1] == "pregenerated"
+        ],
+        "reused_sections": [
+            name for name in tasks if name in results and results[name][1] == "reused"
+        ],
+        "sections": sections,
+    }
+    return await asyncio.to_thread(
+        finish_worksheet, worksheet, activities_by_level, fingerprint, config
+    )
+
+
+@quart_app.route("/api/materials", methods=["POST"])
+async def upload_materials():
+    """
+    Async equivalent of api_server.upload_materials (same request and
+    response shape). Files are written to spooled, hashed temporary files
+    chunk by chunk as they arrive; extraction runs off the event loop.
+    """
+    try:
+        uploads = (await request.files).getlist("files")
+    except RequestEntityTooLarge as e:
+        # Per-file limit (while streaming) or per-request limit was exceeded.
+        return jsonify({"error": e.description}), 413
+
+    try:
+        body, status = await asyncio.to_thread(store_uploads, uploads)
+        return jsonify(body), status
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    finally:
+        for upload in uploads:
+            upload.close()
+
+
+async def app(scope, receive, send):
+    """ASGI entry point dispatching between the async and the Flask routes"""
+    if scope["type"] == "http" and scope["method"] not in ASYNC_ROUTES.get(
+        scope["path"], ()
+    ):
+        await wsgi_app(scope, receive, send)
+    else:
+        await quart_app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    port = int(os.getenv("PORT", "4000"))
+    config = Config()
+    config.bind = [f"0.0.0.0:{port}"]
+
+    print("=" * 60)
+    print("🚀 Lehrplan 21 Worksheet Generator API (async mode)")
+    print("=" * 60)
+    print(f"Server running at: http://localhost:{port}")
+    print("=" * 60)
+    asyncio.run(serve(app, config))
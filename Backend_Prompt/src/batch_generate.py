@@ -0,0 +1,298 @@
+"""
+Non-interactive batch generation of worksheets
+
+Reads many teacher configs from a JSON list or a JSON Lines file and
+generates their worksheets concurrently, as batch-priority traffic under
+the upstream rate limits. Each worksheet is written to the output directory
+as soon as it is complete, as <name>-<config hash>.json, and saved to the
+worksheet store.
+
+Files are never overwritten: a worksheet is written to a temporary file and
+linked into place only if no file of that name exists yet. The config hash
+covers every prompt input and the model routing (see
+worksheet_store.config_hash), so rerunning the same command after an
+interruption skips the worksheets already on disk and generates the rest,
+and an edited config gets a new file next to the old one.
+
+A config is an object shaped like TeacherConfig.to_dict() or like an
+/api/generate_worksheet payload, with an optional "name". Fields left out
+take the defaults of that shape, so a payload-shaped config gets lesson
+ideas only with "include_lesson_ideas": true, as in the API:
+    {"name": "7a-fake-news", "competency_id": "MI_MEDIEN_2",
+     "learning_objective": "...", "time_available": "45"}
+
+Usage:
+    python batch_generate.py semester.jsonl [--output DIR] [--concurrency 4] [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from model_router import router
+from teacher_interface import config_from_dict
+from worksheet_backend import generate_worksheet, parse_failed
+from worksheet_store import config_hash, get_store
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+
+DEFAULT_OUTPUT = os.path.join(project_root, "output", "batch")
+
+
+def load_entries(path):
+    """
+    Configs from a JSON list or a JSON Lines file
+
+    Returns:
+        list of (entry number, dict); the number is the line of a JSON Lines
+        file or the position (from 1) in a JSON list
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return list(enumerate(json.loads(text), 1))
+    entries = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.strip():
+            try:
+                entries.append((number, json.loads(line)))
+            except ValueError as e:
+                raise ValueError(f"Line {number}: invalid JSON ({e})") from e
+    return entries
+
+
+def file_name(name, fingerprint):
+    """Output file of a worksheet: a readable name plus the config hash"""
+    slug = re.sub(r"[^\w.-]+", "-", name).strip("-.")[:60] or "worksheet"
+    return f"{slug}-{fingerprint[:12]}.json"
+
+
+def write_new_file(path, data):
+    """
+    Write JSON to path unless it exists; the file appears complete or not
+    at all
+
+    Returns:
+        False if a file of that name already existed
+    """
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.link(temporary, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.unlink(temporary)
+
+
+def plan(entries, output_dir):
+    """
+    Split the entries into jobs to run, worksheets already on disk,
+    repeated entries and invalid entries
+
+    Returns:
+        (jobs, done, duplicates, invalid); done lists the existing files,
+        duplicates counts entries identical to an earlier one, invalid is a
+        list of (entry number, reason)
+    """
+    routing = router.fingerprint()
+    jobs, done, invalid = [], [], []
+    duplicates = 0
+    planned = set()
+    for number, data in entries:
+        try:
+            if not isinstance(data, dict):
+                raise ValueError("not a JSON object")
+            config = config_from_dict(data)
+            if not config.competency_id or not config.learning_objective:
+                raise ValueError("missing competency_id or learning_objective")
+            fingerprint = config_hash(config, routing)
+        except (ValueError, TypeError, OSError) as e:
+            invalid.append((number, str(e)))
+            continue
+
+        name = str(data.get("name") or config.competency_id)
+        path = os.path.join(output_dir, file_name(name, fingerprint))
+        if path in planned:
+            duplicates += 1
+            continue
+        if os.path.exists(path):
+            done.append(path)
+            continue
+        planned.add(path)
+        jobs.append(
+            {"number": number, "name": name, "config": config,
+             "fingerprint": fingerprint, "path": path}
+        )
+    return jobs, done, duplicates, invalid
+
+
+def unparsed_sections(worksheet, activities_by_level):
+    """The sections of a generated worksheet whose response did not parse"""
+    sections = [
+        level for level, activities in activities_by_level.items()
+        if parse_failed(activities)
+    ]
+    if worksheet["lesson_ideas"] is not None and parse_failed(worksheet["lesson_ideas"]):
+        sections.append("lesson_ideas")
+    return sections
+
+
+def run_job(job):
+    """
+    Generate one worksheet, save it to the store and write its file.
+    A worksheet with a section that did not parse is neither stored nor
+    written, so the next run generates it again.
+
+    Returns:
+        (seconds, usage, whether the file was written, unparsed sections)
+    """
+    started = time.perf_counter()
+    usage = {}
+    worksheet, activities_by_level = generate_worksheet(
+        job["config"], priority="batch", tenant="batch-cli", usage=usage
+    )
+    failed = unparsed_sections(worksheet, activities_by_level)
+    if failed:
+        return time.perf_counter() - started, usage, False, failed
+    worksheet["worksheet_id"] = get_store().add_worksheet(
+        worksheet, activities_by_level, job["fingerprint"], "batch", job["config"].cycle
+    )
+    worksheet["name"] = job["name"]
+    written = write_new_file(job["path"], worksheet)
+    return time.perf_counter() - started, usage, written, []
+
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def run_batch(input_path, output_dir, concurrency=4, dry_run=False):
+    """
+    Generate every pending worksheet of an input file; returns a summary.
+    On Ctrl-C the running worksheets are finished and the summary is marked
+    "interrupted".
+    """
+    entries = load_entries(input_path)
+    os.makedirs(output_dir, exist_ok=True)
+    jobs, done, duplicates, invalid = plan(entries, output_dir)
+
+    summary = {
+        "entries": len(entries),
+        "already_done": len(done),
+        "duplicates": duplicates,
+        "invalid": len(invalid),
+        "generated": 0,
+        "failed": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+    }
+    for number, reason in invalid:
+        print(f"  ✗ entry {number}: {reason}")
+    print(
+        f"{len(entries)} configs: {len(done)} already in {output_dir}, "
+        f"{duplicates} duplicates, {len(invalid)} invalid, {len(jobs)} to generate"
+    )
+    if dry_run or not jobs:
+        return summary
+
+    started = time.perf_counter()
+    reported = set()
+
+    def report(future):
+        reported.add(future)
+        finished = len(reported)
+        job = futures[future]
+        try:
+            seconds, usage, written, unparsed = future.result()
+        except Exception as e:
+            summary["failed"] += 1
+            outcome = f"✗ {job['name']} (entry {job['number']}): {e}"
+        else:
+            summary["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            summary["completion_tokens"] += usage.get("completion_tokens", 0)
+            if unparsed:
+                summary["failed"] += 1
+                outcome = (
+                    f"✗ {job['name']} (entry {job['number']}): response did not "
+                    f"parse for {', '.join(unparsed)}; not written"
+                )
+            else:
+                summary["generated"] += 1
+                target = os.path.basename(job["path"])
+                if not written:
+                    target += " (already written by another run, kept)"
+                outcome = f"✓ {job['name']} -> {target} ({seconds:.1f} s)"
+        remaining = len(jobs) - finished
+        eta = (time.perf_counter() - started) / finished * remaining
+        print(
+            f"  [{finished}/{len(jobs)}] {outcome}"
+            + (f" | ETA {format_eta(eta)}" if remaining else "")
+        )
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = {executor.submit(run_job, job): job for job in jobs}
+    try:
+        for future in as_completed(futures):
+            report(future)
+    except KeyboardInterrupt:
+        # Generations already running finish and write their files
+        running = [future for future in futures if future.running()]
+        print(
+            f"\nInterrupted: finishing {len(running)} running worksheets; "
+            "rerun the same command to resume"
+        )
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Also those that had finished but were not reported yet
+        for future in futures:
+            if future not in reported and not future.cancelled():
+                report(future)
+        summary["interrupted"] = True
+        return summary
+    executor.shutdown(wait=True)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate worksheets for many teacher configs without prompts"
+    )
+    parser.add_argument("input", help="JSON list or JSON Lines file of teacher configs")
+    parser.add_argument(
+        "--output", help="directory for the worksheet files (default output/batch/<input name>)"
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true", help="only report what is pending")
+    args = parser.parse_args()
+
+    output_dir = args.output or os.path.join(
+        DEFAULT_OUTPUT, os.path.splitext(os.path.basename(args.input))[0]
+    )
+    started = time.perf_counter()
+    try:
+        summary = run_batch(args.input, output_dir, args.concurrency, args.dry_run)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    print("=" * 60)
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+    print(f"  elapsed: {time.perf_counter() - started:.1f} s")
+    print("=" * 60)
+    if summary.get("interrupted"):
+        sys.exit(130)
+    sys.exit(1 if summary["failed"] or summary["invalid"] else 0)
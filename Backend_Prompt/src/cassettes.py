@@ -0,0 +1,223 @@
+"""
+Record and replay of upstream LLM calls
+
+With LLM_CASSETTE_MODE=record every chat completion made through
+run_openai_chat (sync or async) is appended to a cassette: one compact JSON
+line with the request hash, task, model, latency, token usage and the
+response text, or the error the call failed with. With
+LLM_CASSETTE_MODE=replay no upstream call is made at all; each request is
+answered from the cassettes by its hash, so whole-pipeline benchmarks and
+regression runs work offline on recorded production traffic, including the
+malformed responses that broke parsing.
+
+Replayed calls answer at once by default. LLM_CASSETTE_LATENCY scales the
+recorded latencies instead (1 = as recorded, 0.5 = twice as fast), which
+reproduces production slowdowns and the deadline timeouts they cause.
+
+Each process appends to its own file in LLM_CASSETTE_DIR and never rewrites
+a line, so several server workers can record at once; replay reads every
+*.jsonl file in the directory. A request recorded several times is answered
+with its recordings in turn.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+
+# "off", "record" or "replay"
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")
+
+LLM_CASSETTE_DIR = os.getenv(
+    "LLM_CASSETTE_DIR", os.path.join(project_root, "output", "cassettes")
+)
+
+# Factor applied to recorded latencies on replay; 0 answers immediately
+LLM_CASSETTE_LATENCY = float(os.getenv("LLM_CASSETTE_LATENCY", "0"))
+
+MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """Raised on replay for a request that was never recorded"""
+
+
+class ReplayedError(RuntimeError):
+    """A recorded upstream error, raised again on replay"""
+
+    def __init__(self, error_type, message):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+
+def request_hash(messages, temperature, task):
+    """
+    Hash of what the caller asked for. The model is left out: it is chosen
+    by the router at call time, and a replay should not depend on routing.
+    """
+    encoded = json.dumps(
+        [task, temperature, messages], sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Recorded interactions of one cassette directory"""
+
+    def __init__(self, directory=LLM_CASSETTE_DIR, mode="record", latency=LLM_CASSETTE_LATENCY):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', not {mode!r}")
+        self.directory = directory
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._file = None
+        self._interactions = {}
+        self._next = {}
+        self._counts = {"recorded": 0, "replayed": 0, "missed": 0, "skipped_lines": 0}
+        if mode == "replay":
+            self._load()
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def _load(self):
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.jsonl"))):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        interaction = json.loads(line)
+                        key = interaction["key"]
+                    except (ValueError, KeyError, TypeError):
+                        # A line cut short when a recording process died
+                        self._counts["skipped_lines"] += 1
+                        continue
+                    self._interactions.setdefault(key, []).append(interaction)
+
+    def _open(self):
+        # One file per process, so concurrent workers never interleave lines
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl"
+            self._file = open(
+                os.path.join(self.directory, name), "a", encoding="utf-8"
+            )
+        return self._file
+
+    def record(
+        self, messages, temperature, task, model, seconds,
+        usage=None, content=None, error=None,
+    ):
+        """Append one finished (or failed) upstream call"""
+        interaction = {
+            "key": request_hash(messages, temperature, task),
+            "task": task,
+            "model": model,
+            "latency_s": round(seconds, 4),
+            "usage": usage or {},
+            "recorded_at": round(time.time(), 3),
+        }
+        if error is not None:
+            interaction["error"] = {"type": type(error).__name__, "message": str(error)}
+        else:
+            interaction["content"] = content
+        line = json.dumps(interaction, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            f = self._open()
+            f.write(line + "\n")
+            f.flush()
+            self._counts["recorded"] += 1
+
+    def lookup(self, messages, temperature, task):
+        """
+        The next recorded interaction for a request
+
+        Raises:
+            CassetteMiss if the request was never recorded
+        """
+        key = request_hash(messages, temperature, task)
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                self._counts["missed"] += 1
+                raise CassetteMiss(
+                    f"No recorded response for this {task} request (hash {key[:12]}) "
+                    f"in {self.directory}"
+                )
+            position = self._next.get(key, 0)
+            self._next[key] = (position + 1) % len(recorded)
+            self._counts["replayed"] += 1
+            return recorded[position]
+
+    def delay(self, interaction):
+        """Seconds a replayed call takes"""
+        return max(0.0, interaction.get("latency_s", 0.0) * self.latency)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        """Mode, directory and how many calls were recorded, replayed or missed"""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "directory": self.directory,
+                "requests": len(self._interactions),
+                **self._counts,
+            }
+
+
+def replay_outcome(interaction):
+    """
+    The recorded response text
+
+    Raises:
+        ReplayedError if the recorded call failed
+    """
+    error = interaction.get("error")
+    if error is not None:
+        raise ReplayedError(error.get("type", "Error"), error.get("message", ""))
+    return interaction.get("content") or ""
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+_configured = False
+
+
+def get_cassette():
+    """
+    The cassette configured by LLM_CASSETTE_MODE, opened on first use, or
+    None when recording and replay are off
+    """
+    global _cassette, _configured
+    if _configured:
+        return _cassette
+    with _cassette_lock:
+        if not _configured:
+            if LLM_CASSETTE_MODE not in MODES:
+                raise ValueError(
+                    f"LLM_CASSETTE_MODE must be one of {', '.join(MODES)}, "
+                    f"not {LLM_CASSETTE_MODE!r}"
+                )
+            if LLM_CASSETTE_MODE != "off":
+                _cassette = Cassette(mode=LLM_CASSETTE_MODE)
+            _configured = True
+        return _cassette
+
+
+def use_cassette(cassette):
+    """Install a cassette (or None to turn recording and replay off)"""
+    global _cassette, _configured
+    with _cassette_lock:
+        _cassette = cassette
+        _configured = True
@@ -0,0 +1,200 @@
+"""
+Inverted index over the Lehrplan 21 catalog for competency search
+
+Every catalog entry (competency or sub-competency) is tokenized from its id,
+German and English names and focus texts; token postings are sorted arrays
+of entry numbers, except for the few frequent tokens, whose postings are
+kept as frozensets so that intersecting them costs no conversion. Queries
+match all their terms, the last one as a prefix
+("medien info" finds "Medien und Informatik" while typing), are filtered by
+cycle and domain, and are ranked with name matches above focus matches.
+
+Tokens are case- and accent-folded, so "schuler" finds "Schüler".
+"""
+
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+# Score of a query term found in the id or a name, and only in a focus text
+NAME_WEIGHT = 3
+TEXT_WEIGHT = 1
+
+MAX_LIMIT = 100
+
+# Postings longer than this are stored as frozensets instead of arrays
+DENSE_POSTING = 512
+
+# Prefixes up to this length expand to many tokens; their merged postings
+# are cached per index (there are only a few hundred such prefixes)
+SHORT_PREFIX = 2
+
+
+def fold(text):
+    """Casefold and strip accents (ü -> u, é -> e)"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _TOKEN.findall(fold(text or ""))
+
+
+def search_entry(entry):
+    """The fields of an entry returned by a search"""
+    return {
+        "id": entry["id"],
+        "name": entry["name"],
+        "name_de": entry.get("name_de", ""),
+        "domain": entry.get("domain", "unknown"),
+        "cycles": entry.get("cycles", []),
+        "parent_id": entry.get("parent_id"),
+    }
+
+
+class CompetencyIndex:
+    """Immutable search index built once per curriculum snapshot"""
+
+    def __init__(self, entries):
+        self.entries = tuple(search_entry(entry) for entry in entries)
+
+        text_postings = {}
+        name_postings = {}
+        by_cycle = {}
+        by_domain = {}
+        for number, entry in enumerate(entries):
+            name_tokens = set(tokenize(entry["id"]))
+            name_tokens.update(tokenize(entry.get("name")))
+            name_tokens.update(tokenize(entry.get("name_de")))
+            text_tokens = name_tokens.union(
+                tokenize(entry.get("focus")), tokenize(entry.get("focus_de"))
+            )
+            for token in name_tokens:
+                name_postings.setdefault(token, []).append(number)
+            for token in text_tokens:
+                text_postings.setdefault(token, []).append(number)
+            for cycle in entry.get("cycles", []):
+                by_cycle.setdefault(cycle, set()).add(number)
+            by_domain.setdefault(entry.get("domain"), set()).add(number)
+
+        # Entry numbers are appended in order, so every array is sorted
+        self.text_postings = {t: self._compact(p) for t, p in text_postings.items()}
+        self.name_postings = {t: self._compact(p) for t, p in name_postings.items()}
+        self.vocabulary = sorted(self.text_postings)
+        self.by_cycle = {c: frozenset(n) for c, n in by_cycle.items()}
+        self.by_domain = {d: frozenset(n) for d, n in by_domain.items()}
+        self._short_prefixes = {}
+
+    @staticmethod
+    def _compact(numbers):
+        return frozenset(numbers) if len(numbers) > DENSE_POSTING else array("I", numbers)
+
+    def _expand(self, term, prefix):
+        # Vocabulary tokens a query term stands for
+        if not prefix:
+            return [term] if term in self.text_postings else []
+        tokens = []
+        for token in self.vocabulary[bisect_left(self.vocabulary, term):]:
+            if not token.startswith(term):
+                break
+            tokens.append(token)
+        return tokens
+
+    def _matches(self, postings, tokens):
+        if len(tokens) == 1 and isinstance(postings.get(tokens[0]), frozenset):
+            return postings[tokens[0]]
+        matched = set()
+        for token in tokens:
+            matched.update(postings.get(token, ()))
+        return matched
+
+    def _term_matches(self, term, tokens):
+        """(entries containing the term, entries with it in the id or a name)"""
+        if len(term) > SHORT_PREFIX or len(tokens) == 1:
+            return (
+                self._matches(self.text_postings, tokens),
+                self._matches(self.name_postings, tokens),
+            )
+        cached = self._short_prefixes.get(term)
+        if cached is None:
+            cached = (
+                frozenset(self._matches(self.text_postings, tokens)),
+                frozenset(self._matches(self.name_postings, tokens)),
+            )
+            self._short_prefixes[term] = cached
+        return cached
+
+    def search(self, query="", cycle=None, domain=None, limit=20, offset=0):
+        """
+        Find entries matching every term of the query (the last term as a
+        prefix). An empty query lists all entries passing the filters.
+
+        Returns:
+            (total, [(entry, score), ...]) for the requested page
+        """
+        limit = max(0, min(limit, MAX_LIMIT))
+        offset = max(0, offset)
+        terms = tokenize(query)
+
+        candidates = None
+        if cycle:
+            candidates = self.by_cycle.get(cycle, frozenset())
+        if domain:
+            in_domain = self.by_domain.get(domain, frozenset())
+            candidates = in_domain if candidates is None else candidates & in_domain
+
+        if not terms:
+            numbers = range(len(self.entries)) if candidates is None else sorted(candidates)
+            page = [(self.entries[n], 0) for n in numbers[offset : offset + limit]]
+            return len(numbers), page
+
+        expanded = [
+            (term, self._expand(term, prefix=position == len(terms) - 1))
+            for position, term in enumerate(terms)
+        ]
+        # Rarest term first keeps the intermediate candidate sets small
+        expanded.sort(
+            key=lambda item: sum(len(self.text_postings[t]) for t in item[1])
+        )
+
+        name_hits = []
+        for term, tokens in expanded:
+            matched, in_name = self._term_matches(term, tokens)
+            candidates = matched if candidates is None else candidates & matched
+            if not candidates:
+                return 0, []
+            name_hits.append(in_name)
+
+        # Rank by the number of terms found in the id or a name, then by
+        # catalog order; set operations and integer sorts only
+        tiers = [()] * (len(terms) + 1)
+        if len(name_hits) == 1:
+            tiers[1] = name_hits[0] & candidates
+            tiers[0] = candidates - tiers[1]
+        else:
+            hits = Counter()
+            for in_name in name_hits:
+                hits.update(in_name & candidates)
+            tiers = [[] for _ in range(len(terms) + 1)]
+            for number, count in hits.items():
+                tiers[count].append(number)
+            tiers[0] = candidates.difference(hits)
+
+        page = []
+        skip = offset
+        for count in range(len(terms), -1, -1):
+            tier = tiers[count]
+            if skip >= len(tier):
+                skip -= len(tier)
+                continue
+            score = count * NAME_WEIGHT + (len(terms) - count) * TEXT_WEIGHT
+            for number in sorted(tier)[skip : skip + limit - len(page)]:
+                page.append((self.entries[number], score))
+            skip = 0
+            if len(page) >= limit:
+                break
+        return len(candidates), page
@@ -2,58 +2,373 @@
 Curriculum topics based on Swiss Lehrplan 21 - Media and Informatics Module
 Loads competencies from lehrplan21.json file
 Reference: https://v-ef.lehrplan.ch/
+
+The competencies, the level descriptors (level_descriptors.json) and the
+bilingual Lehrplan catalog export (LEHRPLAN_CATALOG_PATH, searched by
+/api/competencies/search) are served from one immutable in-memory snapshot,
+together with the indexes and pre-serialized catalog responses built from
+them. When any of the files
+changes (polled by start_watcher(), or reload() from the admin endpoint),
+a new snapshot is built and validated off the request path and swapped in
+with a single assignment; a request keeps the snapshot it started with,
+and an invalid file leaves the current snapshot in place.
 """
 
+import hashlib
 import json
 import os
+import threading
+import time
+from types import MappingProxyType
+
+from competency_search import CompetencyIndex
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+
+COMPETENCIES_PATH = os.path.join(project_root, "data", "lehrplan21.json")
+LEVEL_DESCRIPTORS_PATH = os.path.join(project_root, "data", "level_descriptors.json")
+
+# Full catalog export with German and English names and focus texts; entries
+# whose id is not in lehrplan21.json (e.g. sub-competencies) are searchable
+# and inherit domain and cycles from the competency their id extends
+LEHRPLAN_CATALOG_PATH = os.getenv(
+    "LEHRPLAN_CATALOG_PATH",
+    os.path.join(os.path.dirname(project_root), "data", "lehrplan21_media_informatics.json"),
+)
+
+# Seconds between checks of the data files for changes (0 disables polling)
+CURRICULUM_RELOAD_INTERVAL_S = float(os.getenv("CURRICULUM_RELOAD_INTERVAL_S", "5"))
+
+SUBJECTS = (("Media", "media"), ("Informatics", "informatics"))
+
+CYCLES = {
+    "Cycle 1 (Kindergarten-Grade 2)": "1",
+    "Cycle 2 (Grades 3-6)": "2",
+    "Cycle 3 (Grades 7-9)": "3",
+}
+
+LEVELS = ("beginner", "intermediate", "advanced")
+
+
+class CurriculumError(ValueError):
+    """Raised when a data file does not have the expected structure"""
+
+
+def serialize(payload):
+    # Same bytes as Flask's jsonify outside debug mode
+    return (json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n").encode(
+        "utf-8"
+    )
+
+
+def catalog_entry(comp):
+    """The fields of a competency shown in catalog listings"""
+    return {
+        "id": comp["id"],
+        "name": comp.get("name", "Unknown"),
+        "domain": comp.get("domain", "unknown"),
+        "cycles": comp.get("cycles", []),
+    }
+
+
+def validate(competencies_data, level_descriptors, catalog_data):
+    """
+    Check the data files before they are served.
+
+    Raises:
+        CurriculumError describing the first problem found
+    """
+    if not isinstance(competencies_data, dict) or not isinstance(
+        competencies_data.get("competencies"), list
+    ):
+        raise CurriculumError("lehrplan21.json needs a 'competencies' list")
+    seen = set()
+    for comp in competencies_data["competencies"]:
+        if not isinstance(comp, dict) or not isinstance(comp.get("id"), str):
+            raise CurriculumError("every competency needs a string 'id'")
+        if comp["id"] in seen:
+            raise CurriculumError(f"duplicate competency id {comp['id']}")
+        seen.add(comp["id"])
+        if not isinstance(comp.get("name"), str):
+            raise CurriculumError(f"competency {comp['id']} has no 'name'")
+        cycles = comp.get("cycles", [])
+        if not isinstance(cycles, list) or not all(isinstance(c, str) for c in cycles):
+            raise CurriculumError(f"competency {comp['id']} needs 'cycles' as strings")
+
+    if not isinstance(level_descriptors, dict):
+        raise CurriculumError("level_descriptors.json must be an object")
+    for level in LEVELS:
+        descriptor = level_descriptors.get(level)
+        if not isinstance(descriptor, dict) or not isinstance(
+            descriptor.get("description"), str
+        ):
+            raise CurriculumError(f"level '{level}' needs a 'description'")
+        examples = descriptor.get("example_activities")
+        if not isinstance(examples, list) or not all(isinstance(e, str) for e in examples):
+            raise CurriculumError(f"level '{level}' needs 'example_activities' as strings")
+
+    if not isinstance(catalog_data, dict) or not isinstance(
+        catalog_data.get("competencies"), list
+    ):
+        raise CurriculumError("the catalog export needs a 'competencies' list")
+    for entry in catalog_data["competencies"]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("id"), str):
+            raise CurriculumError("every catalog entry needs a string 'id'")
+
+
+def catalog_entries(competencies, catalog_data):
+    """
+    Merge lehrplan21.json with the catalog export into the searchable
+    entries: competencies get their German texts, export-only entries are
+    attached to the competency whose id is the longest prefix of theirs
+    """
+    exported = {entry["id"]: entry for entry in catalog_data["competencies"]}
+    entries = []
+    for comp_id, comp in competencies.items():
+        german = exported.get(comp_id, {})
+        entries.append(
+            {
+                **catalog_entry(comp),
+                "name_de": german.get("name_de", ""),
+                "focus": comp.get("focus", ""),
+                "focus_de": german.get("focus_de", ""),
+            }
+        )
+    for entry_id, entry in exported.items():
+        if entry_id in competencies:
+            continue
+        parents = [c for c in competencies if entry_id.startswith(c + "_")]
+        parent = competencies[max(parents, key=len)] if parents else {}
+        entries.append(
+            {
+                "id": entry_id,
+                "name": entry.get("name_en") or entry.get("name_de", ""),
+                "name_de": entry.get("name_de", ""),
+                "focus": entry.get("focus_en", ""),
+                "focus_de": entry.get("focus_de", ""),
+                "domain": entry.get("domain") or parent.get("domain", "unknown"),
+                "cycles": entry.get("cycles") or parent.get("cycles", []),
+                "parent_id": parent.get("id"),
+            }
+        )
+    return entries
+
+
+class CurriculumSnapshot:
+    """
+    One consistent version of the curriculum data with its indexes and
+    serialized catalog responses. Never modified after construction.
+    """
+
+    def __init__(self, competencies_raw, level_descriptors_raw, catalog_raw, signature):
+        competencies_data = json.loads(competencies_raw)
+        level_descriptors = json.loads(level_descriptors_raw)
+        catalog_data = json.loads(catalog_raw) if catalog_raw else {"competencies": []}
+        validate(competencies_data, level_descriptors, catalog_data)
+
+        digest = hashlib.sha256(competencies_raw)
+        digest.update(level_descriptors_raw)
+        digest.update(catalog_raw)
+        self.version = digest.hexdigest()[:12]
+        self.signature = signature
+        self.loaded_at = time.time()
+
+        # A plain dict: competency lookups sit on the prompt-building path
+        self.competencies = {comp["id"]: comp for comp in competencies_data["competencies"]}
+        self.level_descriptors = MappingProxyType(level_descriptors)
+
+        by_cycle = {}
+        by_domain = {}
+        for comp_id, comp in self.competencies.items():
+            by_domain.setdefault(comp.get("domain"), []).append(comp_id)
+            for cycle in comp.get("cycles", []):
+                by_cycle.setdefault(cycle, []).append(comp_id)
+        self.by_cycle = MappingProxyType({k: tuple(v) for k, v in by_cycle.items()})
+        self.by_domain = MappingProxyType({k: tuple(v) for k, v in by_domain.items()})
+
+        self.topics = {
+            subject_name: {
+                cycle_name: [
+                    f"{comp['id']} - {comp.get('name', 'Unknown')} - {comp.get('focus', '')}"
+                    for comp in self.competencies.values()
+                    if comp.get("domain") == subject_domain
+                    and cycle_id in comp.get("cycles", [])
+                ]
+                for cycle_name, cycle_id in CYCLES.items()
+            }
+            for subject_name, subject_domain in SUBJECTS
+        }
+
+        # Response bodies of the catalog endpoints
+        self.competencies_json = serialize(
+            {"competencies": [catalog_entry(c) for c in self.competencies.values()]}
+        )
+        self.cycle_json = {}
+        for cycle in by_cycle:
+            for _, domain in ((None, None),) + SUBJECTS:
+                self.cycle_json[(cycle, domain)] = self._cycle_response(cycle, domain)
+        self.details_json = {
+            comp_id: serialize(
+                {
+                    "id": comp_id,
+                    "name": comp.get("name", "Unknown"),
+                    "focus": comp.get("focus", ""),
+                    "domain": comp.get("domain", "unknown"),
+                    "cycles": comp.get("cycles", []),
+                }
+            )
+            for comp_id, comp in self.competencies.items()
+        }
+
+        self.search_index = CompetencyIndex(catalog_entries(self.competencies, catalog_data))
+
+    def _cycle_response(self, cycle, domain):
+        entries = [
+            catalog_entry(self.competencies[comp_id])
+            for comp_id in self.by_cycle.get(cycle, ())
+        ]
+        if domain:
+            entries = [entry for entry in entries if entry["domain"] == domain]
+        return serialize({"cycle": cycle, "competencies": entries})
+
+    def cycle_response(self, cycle, domain=None):
+        """Serialized /api/competencies/<cycle> response"""
+        body = self.cycle_json.get((cycle, domain or None))
+        return body if body is not None else self._cycle_response(cycle, domain)
+
+    def info(self):
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "competencies": len(self.competencies),
+            "catalog_entries": len(self.search_index.entries),
+        }
+
+
+def file_signature(path):
+    # Changes when a file is edited in place or replaced by a rename
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def data_signature():
+    # The catalog export is optional
+    catalog = (
+        file_signature(LEHRPLAN_CATALOG_PATH)
+        if os.path.exists(LEHRPLAN_CATALOG_PATH)
+        else None
+    )
+    return (
+        file_signature(COMPETENCIES_PATH),
+        file_signature(LEVEL_DESCRIPTORS_PATH),
+        catalog,
+    )
+
+
+def load_snapshot():
+    """
+    Read and validate the data files into a new snapshot.
+
+    Raises:
+        CurriculumError or OSError; nothing is swapped in that case
+    """
+    signature = data_signature()
+    with open(COMPETENCIES_PATH, "rb") as f:
+        competencies_raw = f.read()
+    with open(LEVEL_DESCRIPTORS_PATH, "rb") as f:
+        level_descriptors_raw = f.read()
+    catalog_raw = b""
+    if signature[2] is not None:
+        with open(LEHRPLAN_CATALOG_PATH, "rb") as f:
+            catalog_raw = f.read()
+    try:
+        return CurriculumSnapshot(
+            competencies_raw, level_descriptors_raw, catalog_raw, signature
+        )
+    except json.JSONDecodeError as e:
+        raise CurriculumError(f"invalid JSON: {e}") from e
+
+
+_snapshot = load_snapshot()
+_reload_lock = threading.Lock()
+_last_error = None
+_rejected_signature = None
+
+# Kept for callers that read the competency map directly; always the map
+# of the current snapshot
+COMPETENCIES = _snapshot.competencies
+
+
+def snapshot():
+    """
+    Return the current snapshot. Use one snapshot for everything a request
+    reads, so it never mixes two versions of the data.
+    """
+    return _snapshot
+
+
+def reload(force=False):
+    """
+    Swap in a new snapshot if a data file changed (or always with force).
+
+    Returns:
+        (reloaded, error): error is the reason a changed file was rejected
+    """
+    global _snapshot, COMPETENCIES, _last_error, _rejected_signature
+    with _reload_lock:
+        signature = None
+        try:
+            signature = data_signature()
+            # Unchanged, or the same broken files that were rejected before
+            if not force and signature in (_snapshot.signature, _rejected_signature):
+                return False, None
+            new = load_snapshot()
+        except (CurriculumError, OSError) as e:
+            _last_error = str(e)
+            _rejected_signature = signature
+            return False, _last_error
+        _last_error = None
+        _snapshot = new
+        COMPETENCIES = new.competencies
+        return True, None
+
+
+def status():
+    """Version of the served snapshot and the last rejected reload, if any"""
+    return {**_snapshot.info(), "last_error": _last_error}
+
+
+_watcher = None
+
+
+def start_watcher(interval=CURRICULUM_RELOAD_INTERVAL_S):
+    """Poll the data files in a daemon thread and reload on change"""
+    global _watcher
+    if interval <= 0 or _watcher is not None:
+        return
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            reloaded, error = reload()
+            if reloaded:
+                print(f"Curriculum data reloaded (version {_snapshot.version})")
+            elif error:
+                print(f"Warning: curriculum data not reloaded: {error}")
+
+    _watcher = threading.Thread(target=watch, name="curriculum-watcher", daemon=True)
+    _watcher.start()
 
-# Load competencies from JSON file
-def load_competencies():
-    """Load Lehrplan 21 competencies from JSON file"""
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(script_dir)
-    json_path = os.path.join(project_root, "data", "lehrplan21.json")
-    
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    return {comp['id']: comp for comp in data['competencies']}
-
-# Load competencies at module import
-COMPETENCIES = load_competencies()
 
 # Organize topics by domain and cycle
 def get_lehrplan_topics():
     """Get topics organized by subject and cycle"""
-    subjects = {
-        "Media": {},
-        "Informatics": {},
-    }
-    
-    cycles = {
-        "Cycle 1 (Kindergarten-Grade 2)": "1",
-        "Cycle 2 (Grades 3-6)": "2",
-        "Cycle 3 (Grades 7-9)": "3"
-    }
-    
-    # Build competency lists for each subject and cycle
-    for subject_name, subject_domain in [("Media", "media"), ("Informatics", "informatics")]:
-        for cycle_name, cycle_id in cycles.items():
-            # Get all competencies for this domain and cycle
-            competencies_list = []
-            for comp_id, comp in COMPETENCIES.items():
-                if comp.get("domain") == subject_domain and cycle_id in comp.get("cycles", []):
-                    competencies_list.append(
-                        f"{comp['id']} - {comp.get('name', 'Unknown')} - {comp.get('focus', '')}"
-                    )
-            
-            subjects[subject_name][cycle_name] = competencies_list
-    
-    return subjects
+    return _snapshot.topics
 
 def get_subjects():
     """Return list of all subjects"""
-    return ["Media", "Informatics"]
+    return [subject_name for subject_name, _ in SUBJECTS]
 
 def get_cycles(subject):
     """Return list of cycles for a given subject"""
@@ -67,25 +382,20 @@ def get_topics(subject, cycle):
 
 def get_competency_details(competency_id):
     """Get detailed information about a specific competency"""
-    if competency_id not in COMPETENCIES:
-        raise ValueError(f"Competency ID '{competency_id}' not found")
-    return COMPETENCIES.get(competency_id, None)
+    try:
+        return _snapshot.competencies[competency_id]
+    except KeyError:
+        raise ValueError(f"Competency ID '{competency_id}' not found") from None
 
 def get_competencies_by_cycle(cycle_id):
     """Get all competencies for a specific cycle"""
-    return {
-        comp_id: comp 
-        for comp_id, comp in COMPETENCIES.items() 
-        if cycle_id in comp.get('cycles', [])
-    }
+    current = _snapshot
+    return {comp_id: current.competencies[comp_id] for comp_id in current.by_cycle.get(cycle_id, ())}
 
 def get_competencies_by_domain(domain):
     """Get all competencies for a specific domain (media, informatics)"""
-    return {
-        comp_id: comp 
-        for comp_id, comp in COMPETENCIES.items() 
-        if comp.get('domain') == domain
-    }
+    current = _snapshot
+    return {comp_id: current.competencies[comp_id] for comp_id in current.by_domain.get(domain, ())}
 
 def get_all_cycles():
     """Get list of all cycle IDs"""
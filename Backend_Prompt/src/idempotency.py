@@ -0,0 +1,224 @@
+"""
+Idempotency keys for generation requests
+
+A client that sends an Idempotency-Key header with /api/generate_worksheet
+gets exactly one execution per key: the first request claims the key and
+runs, retries with the same key and payload wait for it to finish and get
+the stored response, and a different payload under the same key is
+rejected. Responses are kept for IDEMPOTENCY_WINDOW_S.
+
+Keys live in a small SQLite database, so workers of a multi-process server
+share them. A claim whose request died without finishing (crashed worker)
+is taken over once IDEMPOTENCY_LEASE_S has passed.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+
+IDEMPOTENCY_STORE_PATH = os.getenv(
+    "IDEMPOTENCY_STORE_PATH", os.path.join(project_root, "output", "idempotency.db")
+)
+
+# Seconds a finished response is replayed for retries with the same key
+IDEMPOTENCY_WINDOW_S = float(os.getenv("IDEMPOTENCY_WINDOW_S", "86400"))
+
+# Seconds after which an unfinished claim counts as abandoned; must exceed
+# the longest request deadline
+IDEMPOTENCY_LEASE_S = float(os.getenv("IDEMPOTENCY_LEASE_S", "330"))
+
+# Seconds between checks while a retry waits for the running execution
+POLL_INTERVAL_S = 0.05
+
+MAX_KEY_LENGTH = 255
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    payload_hash TEXT NOT NULL,
+    state TEXT NOT NULL,
+    status INTEGER,
+    body TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency_keys (expires_at);
+"""
+
+
+class IdempotencyError(ValueError):
+    """Raised for a malformed Idempotency-Key header"""
+
+
+def payload_hash(payload):
+    """Hash a JSON request payload independent of key order and whitespace"""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def scoped_key(tenant, key):
+    """
+    Keys are chosen by clients, so they are only unique per tenant
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(
+            f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"
+        )
+    return f"{tenant}\n{key}"
+
+
+class IdempotencyStore:
+    """Claims, results and replays of idempotency keys"""
+
+    def __init__(self, path=IDEMPOTENCY_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+        self._lock = threading.Lock()
+        self._counts = {"executed": 0, "replayed": 0, "waited": 0, "mismatched": 0}
+
+    def _connection(self):
+        # SQLite connections cannot be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, outcome):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def _try_claim(self, key, fingerprint):
+        """
+        One attempt to claim a key.
+
+        Returns:
+            ("claimed", None, None), ("done", status, body),
+            ("in_progress", None, None) or ("mismatch", None, None)
+        """
+        now = time.time()
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers cannot
+        # both see the key as free
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT payload_hash, state, status, body, expires_at "
+                "FROM idempotency_keys WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and row[4] > now:
+                stored_hash, state, status, body, _ = row
+                if stored_hash != fingerprint:
+                    return "mismatch", None, None
+                if state == "done":
+                    return "done", status, json.loads(body)
+                return "in_progress", None, None
+
+            # Free, expired, or abandoned by a request that never finished
+            conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys "
+                "(key, payload_hash, state, created_at, expires_at) "
+                "VALUES (?, ?, 'in_progress', ?, ?)",
+                (key, fingerprint, now, now + IDEMPOTENCY_LEASE_S),
+            )
+            return "claimed", None, None
+        finally:
+            conn.execute("COMMIT")
+
+    def begin(self, key, fingerprint, deadline):
+        """
+        Claim a key, or wait until its running execution finishes or the
+        time.monotonic() deadline passes.
+
+        Returns:
+            (outcome, status, body): "claimed" means the caller must run the
+            request and then call finish() or release(); "done" carries the
+            stored response; "in_progress" means the deadline passed while
+            waiting; "mismatch" means the key was used for another payload
+        """
+        waited = False
+        while True:
+            outcome, status, body = self._try_claim(key, fingerprint)
+            if outcome != "in_progress" or time.monotonic() >= deadline:
+                break
+            waited = True
+            time.sleep(min(POLL_INTERVAL_S, max(0.0, deadline - time.monotonic())))
+        self._count_outcome(outcome, waited)
+        return outcome, status, body
+
+    async def begin_async(self, key, fingerprint, deadline):
+        """
+        begin() for the event loop: each claim attempt runs in a worker
+        thread, but the waits between attempts are asyncio sleeps, so a
+        retry waiting for a long execution does not hold a thread
+        """
+        waited = False
+        while True:
+            outcome, status, body = await asyncio.to_thread(
+                self._try_claim, key, fingerprint
+            )
+            if outcome != "in_progress" or time.monotonic() >= deadline:
+                break
+            waited = True
+            await asyncio.sleep(
+                min(POLL_INTERVAL_S, max(0.0, deadline - time.monotonic()))
+            )
+        self._count_outcome(outcome, waited)
+        return outcome, status, body
+
+    def _count_outcome(self, outcome, waited):
+        if outcome == "claimed":
+            self._count("executed")
+        elif outcome == "mismatch":
+            self._count("mismatched")
+        elif outcome == "done":
+            self._count("waited" if waited else "replayed")
+
+    def finish(self, key, status, body):
+        """Store the response of a claimed key for the replay window"""
+        now = time.time()
+        self._connection().execute(
+            "UPDATE idempotency_keys SET state = 'done', status = ?, body = ?, "
+            "expires_at = ? WHERE key = ?",
+            (status, json.dumps(body, ensure_ascii=False), now + IDEMPOTENCY_WINDOW_S, key),
+        )
+
+    def release(self, key):
+        """Give up a claim, so that a retry executes the request again"""
+        self._connection().execute(
+            "DELETE FROM idempotency_keys WHERE key = ? AND state = 'in_progress'", (key,)
+        )
+
+    def stats(self):
+        """How often keys were executed, replayed, waited on or mismatched"""
+        with self._lock:
+            return dict(self._counts)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_idempotency_store():
+    """Return the shared store instance, opening it on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IdempotencyStore()
+        return _store
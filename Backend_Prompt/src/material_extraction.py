@@ -0,0 +1,354 @@
+"""
+Text extraction for uploaded teacher materials
+
+PDF and Word parsing is CPU-bound pure Python, so it runs in a bounded
+process pool instead of on the request thread. Workers are recycled after
+EXTRACTION_TASKS_PER_CHILD files, and a worker stuck on a pathological file
+past EXTRACTION_TIMEOUT is killed.
+"""
+
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+# Worker processes for extraction (0 extracts on the calling thread)
+EXTRACTION_WORKERS = int(
+    os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+
+# Seconds a single file may take to extract
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "30"))
+
+# Files a worker process extracts (on average) before it is replaced
+EXTRACTION_TASKS_PER_CHILD = int(os.getenv("EXTRACTION_TASKS_PER_CHILD", "20"))
+
+# Characters extracted per file at most; parsing stops once reached
+EXTRACTION_MAX_CHARS = int(os.getenv("EXTRACTION_MAX_CHARS", "2000000"))
+
+# WordprocessingML element names
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_BODY = _W + "body"
+_W_P = _W + "p"
+_W_T = _W + "t"
+_W_TAB = _W + "tab"
+_W_BR = _W + "br"
+_W_TC = _W + "tc"
+_W_TR = _W + "tr"
+
+
+# Human-readable labels for supported material formats
+MATERIAL_LABELS = {
+    ".txt": "Text file",
+    ".md": "Text file",
+    ".pdf": "PDF file",
+    ".docx": "Word file",
+}
+
+
+def read_material_text(file_path, stream=None):
+    """
+    Read the full text of an uploaded material
+    Supports: .txt, .pdf, .docx, .md
+
+    If stream is given (a binary file object), it is read instead of
+    opening file_path; file_path is then only used for its extension.
+
+    Returns:
+        (label, text) tuple; raises for missing or unreadable files
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+
+    if ext == ".txt" or ext == ".md":
+        if stream is not None:
+            return MATERIAL_LABELS[ext], stream.read().decode("utf-8")
+        with open(file_path, "r", encoding="utf-8") as f:
+            return MATERIAL_LABELS[ext], f.read()
+
+    elif ext == ".pdf":
+        pages = []
+        chars = 0
+        with open(file_path, "rb") if stream is None else stream as f:
+            reader = PyPDF2.PdfReader(f)
+            for page in reader.pages:
+                pages.append(page.extract_text() or "")
+                chars += len(pages[-1])
+                if chars >= EXTRACTION_MAX_CHARS:
+                    break
+        return MATERIAL_LABELS[ext], "\n\n".join(pages)[:EXTRACTION_MAX_CHARS]
+
+    elif ext == ".docx":
+        source = file_path if stream is None else stream
+        return MATERIAL_LABELS[ext], read_docx_text(source)
+
+    raise ValueError(f"{os.path.basename(file_path)} (unsupported format)")
+
+
+def read_docx_text(source, max_chars=EXTRACTION_MAX_CHARS):
+    """
+    Stream the text of a .docx file without loading its object model.
+
+    Only word/document.xml is read from the zip (images and other media
+    parts are never touched), parsed incrementally and discarded element by
+    element. Table cells are kept, separated by " | ", one row per line.
+    Parsing stops once max_chars characters have been collected.
+    """
+    parts = []
+    chars = 0
+    cell_depth = 0
+    depth = 0
+    body = None
+
+    with zipfile.ZipFile(source) as archive:
+        with archive.open("word/document.xml") as xml_stream:
+            for event, elem in ET.iterparse(xml_stream, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if elem.tag == _W_BODY:
+                        body = elem
+                    elif elem.tag == _W_TC:
+                        cell_depth += 1
+                    continue
+
+                depth -= 1
+                tag = elem.tag
+                if tag == _W_T:
+                    if elem.text:
+                        parts.append(elem.text)
+                        chars += len(elem.text)
+                elif tag == _W_TAB:
+                    parts.append("\t")
+                elif tag == _W_BR:
+                    parts.append("\n")
+                elif tag == _W_P:
+                    parts.append(" " if cell_depth else "\n")
+                elif tag == _W_TC:
+                    cell_depth -= 1
+                    parts.append("| ")
+                elif tag == _W_TR:
+                    parts.append("\n")
+
+                # Drop finished top-level blocks so memory stays flat
+                if body is not None and depth == 2:
+                    elem.clear()
+                    body.remove(elem)
+
+                if chars >= max_chars:
+                    break
+
+    return "".join(parts)[:max_chars]
+
+
+def _extract_worker(file_path, source_path=None):
+    # Runs in a pool process; uploads arrive as the path of their temporary
+    # file, with file_path naming the original file
+    if source_path is None:
+        return read_material_text(file_path)
+    with open(source_path, "rb") as stream:
+        return read_material_text(file_path, stream=stream)
+
+
+_events = None
+
+
+def _init_worker(events):
+    global _events
+    _events = events
+
+
+def _run_task(task_id, file_path, source_path=None):
+    # Runs in a pool process and reports when the file starts and ends, since
+    # futures count files waiting in the pool's call queue as running too
+    _events.put((task_id, time.time()))
+    try:
+        return _extract_worker(file_path, source_path)
+    finally:
+        _events.put((task_id, None))
+
+
+class _ExtractionPool:
+    """A process pool whose workers report which files they are extracting"""
+
+    def __init__(self):
+        context = multiprocessing.get_context("spawn")
+        self.events = context.Queue()
+        self.executor = ProcessPoolExecutor(
+            max_workers=EXTRACTION_WORKERS,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.events,),
+        )
+        self.submitted = 0
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def submit(self, items):
+        """Submit (file_path, source_path) items; returns a (task id, future) per item"""
+        tasks = []
+        for item in items:
+            task_id = next(_task_ids)
+            tasks.append((task_id, self.executor.submit(_run_task, task_id, *item)))
+        self.submitted += len(items)
+        return tasks
+
+    def running(self):
+        """Start times (time.time()) of the files being extracted, by task id"""
+        with self._lock:
+            while True:
+                try:
+                    task_id, started_at = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                if started_at is None:
+                    self._running.pop(task_id, None)
+                else:
+                    self._running[task_id] = started_at
+            return dict(self._running)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_task_ids = itertools.count()
+
+# Seconds between checks of the files being extracted
+_POLL_INTERVAL = 0.1
+
+# Seconds a worker may take to pick up a file on top of EXTRACTION_TIMEOUT,
+# so a file stuck from the start is seen running for the whole limit
+_START_GRACE = 1.0
+
+
+def _submit(items):
+    """
+    Submit files to the shared pool and return (pool, tasks).
+
+    Submitting under the lock means a pool retired by another request is
+    never handed new work; a pool broken by a crashed worker is replaced.
+    The whole pool is replaced after EXTRACTION_TASKS_PER_CHILD files per
+    worker: max_tasks_per_child never replaces an exited worker on Python
+    3.11 (CPython issue 115634), which leaves queued files stranded.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and (
+            _pool.submitted >= EXTRACTION_TASKS_PER_CHILD * EXTRACTION_WORKERS
+        ):
+            # Recycle the workers; files already submitted still finish
+            _pool.executor.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            _pool = _ExtractionPool()
+        try:
+            return _pool, _pool.submit(items)
+        except BrokenProcessPool:
+            _pool = _ExtractionPool()
+            return _pool, _pool.submit(items)
+
+
+def _retire_pool(pool):
+    """
+    Replace a pool whose worker is stuck. Other files already running in it
+    get one more timeout period to finish before its processes are killed.
+
+    ProcessPoolExecutor cannot kill a single worker, so every process of the
+    retired pool is killed, and files of other requests still extracting in
+    it then fail with BrokenProcessPool. That is accepted: it only happens
+    after a file blocked a worker for EXTRACTION_TIMEOUT, and the requests
+    that lose a file still get a worksheet, reporting the file as unread.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.executor.shutdown(wait=False, cancel_futures=False)
+
+    def terminate():
+        # ProcessPoolExecutor has no public API to kill a busy worker
+        for process in list((pool.executor._processes or {}).values()):
+            if process.is_alive():
+                process.kill()
+
+    timer = threading.Timer(EXTRACTION_TIMEOUT, terminate)
+    timer.daemon = True
+    timer.start()
+
+
+def extract_in_pool(files, deadline=None):
+    """
+    Extract several materials in parallel.
+
+    All files share one wait of EXTRACTION_TIMEOUT, cut short at the
+    deadline. Files still queued then (behind uploads of other requests)
+    are cancelled. The pool is retired only if a file, of this call or any
+    other, has itself been extracting for EXTRACTION_TIMEOUT.
+
+    Args:
+        files: list of file paths, or (file_name, path) tuples for uploads
+            stored in temporary files
+        deadline: optional time.monotonic() deadline of the request
+
+    Returns:
+        list with a (label, text) tuple or an Exception for each file
+    """
+    items = [item if isinstance(item, tuple) else (item, None) for item in files]
+
+    if EXTRACTION_WORKERS <= 0:
+        results = []
+        for item in items:
+            try:
+                results.append(_extract_worker(*item))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    pool, tasks = _submit(items)
+    futures = [future for _, future in tasks]
+
+    ends = time.monotonic() + EXTRACTION_TIMEOUT + _START_GRACE
+    if deadline is not None:
+        ends = min(ends, deadline)
+    pending = set(futures)
+    while pending:
+        remaining = ends - time.monotonic()
+        if remaining <= 0:
+            break
+        _, pending = wait(
+            pending, timeout=min(_POLL_INTERVAL, remaining), return_when=FIRST_COMPLETED
+        )
+
+    running = pool.running()
+    now = time.time()
+    stuck = {
+        task_id
+        for task_id, started_at in running.items()
+        if now - started_at >= EXTRACTION_TIMEOUT
+    }
+    results = []
+    for (file_path, _), (task_id, future) in zip(items, tasks):
+        name = os.path.basename(file_path)
+        if future.done():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        elif future.cancel():
+            # Still queued behind other files; nothing to clean up
+            results.append(TimeoutError(f"{name} was not extracted in time"))
+        elif task_id in stuck:
+            results.append(
+                TimeoutError(f"{name} took longer than {EXTRACTION_TIMEOUT:g}s to extract")
+            )
+        else:
+            # Started late in the wait; it finishes in the background unused
+            results.append(TimeoutError(f"{name} was not extracted in time"))
+    if stuck:
+        _retire_pool(pool)
+    return results
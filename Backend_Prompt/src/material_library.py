@@ -0,0 +1,262 @@
+"""
+Persistent teacher material library
+
+Materials are uploaded once, split into passages and indexed in an on-disk
+SQLite FTS5 index (BM25 ranking, memory-mapped reads). Worksheet generation
+then retrieves only the passages relevant to the learning objective instead
+of re-parsing every file on each request.
+
+Usage:
+    python material_library.py add <file> [<file> ...]
+    python material_library.py list
+    python material_library.py search "<query>"
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from material_packing import count_tokens, query_terms, split_passages
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+
+LIBRARY_PATH = os.getenv(
+    "MATERIAL_LIBRARY_PATH", os.path.join(project_root, "library", "materials.db")
+)
+
+# Target size of an indexed passage in tokens
+CHUNK_TOKENS = 150
+
+# Bytes of the index file SQLite may memory-map
+MMAP_SIZE = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS materials (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    label TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    chunks INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+    material_id UNINDEXED,
+    position UNINDEXED,
+    text,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def chunk_text(text, chunk_tokens=CHUNK_TOKENS):
+    """Group passages of a text into chunks of roughly chunk_tokens tokens"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for passage in split_passages(text, max_tokens=chunk_tokens):
+        tokens = count_tokens(passage)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(" ".join(current))
+            current = []
+            current_tokens = 0
+        current.append(passage)
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def material_id_for(sha256_hex):
+    """Derive a stable material id from the SHA-256 of the file content"""
+    return sha256_hex[:16]
+
+
+def file_sha256(file_path, chunk_size=64 * 1024):
+    """Hash a file in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MaterialLibrary:
+    """On-disk library of indexed teacher materials"""
+
+    def __init__(self, path=LIBRARY_PATH):
+        self.path = path
+        self._local = threading.local()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        # SQLite connections cannot be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def add_text(self, name, label, text, material_id=None):
+        """
+        Index extracted text and return its material id.
+        Re-adding identical content returns the existing id.
+        """
+        if material_id is None:
+            material_id = material_id_for(
+                hashlib.sha256(text.encode("utf-8")).hexdigest()
+            )
+        conn = self._connection()
+        if self.get_material(material_id) is not None:
+            return material_id
+
+        chunks = chunk_text(text)
+        with conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO materials "
+                "(id, name, label, tokens, chunks, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (material_id, name, label, count_tokens(text), len(chunks), time.time()),
+            ).rowcount
+            if not inserted:
+                # A concurrent upload of the same content indexed it first
+                return material_id
+            conn.executemany(
+                "INSERT INTO chunks (material_id, position, text) VALUES (?, ?, ?)",
+                [(material_id, i, chunk) for i, chunk in enumerate(chunks)],
+            )
+        return material_id
+
+    def add_file(self, file_path):
+        """Extract a file and add it to the library"""
+        from material_extraction import read_material_text
+
+        material_id = material_id_for(file_sha256(file_path))
+        if self.get_material(material_id) is not None:
+            return material_id
+        label, text = read_material_text(file_path)
+        return self.add_text(os.path.basename(file_path), label, text, material_id)
+
+    def get_material(self, material_id):
+        """Return metadata for a material, or None if unknown"""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT id, name, label, tokens, chunks, created_at "
+                "FROM materials WHERE id = ?",
+                (material_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        keys = ("id", "name", "label", "tokens", "chunks", "created_at")
+        return dict(zip(keys, row))
+
+    def list_materials(self, limit=50, offset=0):
+        """List materials, newest first"""
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT id, name, label, tokens, chunks, created_at FROM materials "
+                "ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            )
+            .fetchall()
+        )
+        keys = ("id", "name", "label", "tokens", "chunks", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def delete_material(self, material_id):
+        """Remove a material and its passages from the library"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM chunks WHERE material_id = ?", (material_id,))
+            conn.execute("DELETE FROM materials WHERE id = ?", (material_id,))
+
+    def search(self, query, material_ids=None, limit=8):
+        """
+        Return the passages most relevant to a query, best first.
+
+        Args:
+            query: free text (e.g. the learning objective)
+            material_ids: optionally restrict the search to these materials
+            limit: maximum number of passages
+
+        Returns:
+            list of dicts with material_id, position, text and score
+        """
+        terms = sorted(query_terms(query))
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+
+        sql = (
+            "SELECT material_id, position, text, bm25(chunks) AS score "
+            "FROM chunks WHERE chunks MATCH ?"
+        )
+        params = [match]
+        if material_ids is not None:
+            if not material_ids:
+                return []
+            sql += f" AND material_id IN ({', '.join('?' * len(material_ids))})"
+            params.extend(material_ids)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        rows = self._connection().execute(sql, params).fetchall()
+        # bm25() is lower-is-better; flip it so higher scores are better
+        return [
+            {"material_id": m, "position": p, "text": t, "score": -s}
+            for m, p, t, s in rows
+        ]
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_library():
+    """Return the shared library instance, opening it on first use"""
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = MaterialLibrary()
+        return _library
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("add", "list", "search"):
+        print(__doc__)
+        sys.exit(1)
+
+    library = get_library()
+    command = sys.argv[1]
+
+    if command == "add":
+        for file_path in sys.argv[2:]:
+            material_id = library.add_file(file_path)
+            print(f"✓ {os.path.basename(file_path)}: {material_id}")
+
+    elif command == "list":
+        for material in library.list_materials(limit=1000):
+            print(
+                f"  {material['id']}  {material['name']} "
+                f"({material['label']}, {material['tokens']} tokens)"
+            )
+
+    else:
+        started = time.perf_counter()
+        results = library.search(" ".join(sys.argv[2:]))
+        elapsed = (time.perf_counter() - started) * 1000
+        for result in results:
+            print(f"  [{result['material_id']}#{result['position']}] {result['text'][:120]}")
+        print(f"{len(results)} passage(s) in {elapsed:.1f} ms")
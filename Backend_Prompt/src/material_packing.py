@@ -0,0 +1,208 @@
+"""
+Token-budgeted packing of uploaded teacher materials into the system prompt.
+
+Instead of cutting every long file to its first 500 characters, the packer
+counts tokens, splits a total budget across all uploaded files in proportion
+to their value and fills each share with the most relevant passages.
+"""
+
+import math
+import os
+import re
+
+# Total prompt budget (in tokens) shared by all uploaded materials
+MATERIAL_TOKEN_BUDGET = int(os.getenv("MATERIAL_TOKEN_BUDGET", "1500"))
+
+# Marker inserted where passages were left out
+GAP_MARKER = "[...]"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_WORD_RE = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+
+
+def count_tokens(text):
+    """
+    Count tokens with a local, dependency-free approximation of a BPE tokenizer.
+
+    Every punctuation mark is one token and every word costs one token per
+    four characters, which slightly over-estimates OpenAI tokenizers for
+    English and German text, so packed prompts stay within their budget.
+    """
+    if not text:
+        return 0
+    total = 0
+    for token in _TOKEN_RE.findall(text):
+        total += (len(token) + 3) // 4
+    return total
+
+
+def query_terms(*texts):
+    """Return the set of lower-cased content words found in the given texts"""
+    terms = set()
+    for text in texts:
+        if text:
+            terms.update(word.lower() for word in _WORD_RE.findall(text))
+    return terms
+
+
+def split_passages(text, max_tokens=120):
+    """
+    Split text into passages (paragraphs, or sentences for long paragraphs)
+    """
+    passages = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            passages.append(paragraph)
+            continue
+        passages.extend(s for s in _SENTENCE_RE.split(paragraph) if s)
+    return passages
+
+
+def score_passage(passage, terms, position, total):
+    """
+    Score a passage by its overlap with the query terms and its information
+    density, with a slight preference for earlier passages.
+    """
+    words = [word.lower() for word in _WORD_RE.findall(passage)]
+    if not words:
+        return 0.0
+    unique = set(words)
+    density = len(unique) / len(words)
+    overlap = len(unique & terms) / (1 + len(terms)) if terms else 0.0
+    position_prior = 1.0 - 0.3 * (position / max(total, 1))
+    return (1.0 + 4.0 * overlap) * density * position_prior
+
+
+def pack_text(text, max_tokens, terms=None, scorer=score_passage):
+    """
+    Fill a token budget with the highest-value passages of a text.
+
+    Selected passages are returned in document order, with GAP_MARKER where
+    passages were skipped.
+    """
+    if max_tokens <= 0 or not text:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text.strip()
+
+    terms = terms or set()
+    passages = split_passages(text)
+    ranked = sorted(
+        range(len(passages)),
+        key=lambda i: scorer(passages[i], terms, i, len(passages)),
+        reverse=True,
+    )
+
+    gap_cost = count_tokens(GAP_MARKER)
+    chosen = []
+    used = 0
+    for i in ranked:
+        cost = count_tokens(passages[i]) + gap_cost
+        if used + cost > max_tokens:
+            continue
+        chosen.append(i)
+        used += cost
+
+    if not chosen:
+        # Every passage is larger than the budget; cut the best one by words
+        kept = []
+        used = gap_cost
+        for word in passages[ranked[0]].split():
+            used += count_tokens(word)
+            if used > max_tokens:
+                break
+            kept.append(word)
+        return " ".join(kept + [GAP_MARKER])
+
+    chosen.sort()
+    parts = []
+    previous = -1
+    for i in chosen:
+        if i != previous + 1:
+            parts.append(GAP_MARKER)
+        parts.append(passages[i])
+        previous = i
+    if chosen[-1] != len(passages) - 1:
+        parts.append(GAP_MARKER)
+    return " ".join(parts)
+
+
+def file_value(text, terms):
+    """
+    Estimate how much a file is worth to the prompt: grows with its size
+    (logarithmically) and with how many query terms it covers.
+    """
+    tokens = count_tokens(text)
+    if tokens == 0:
+        return 0.0
+    words = query_terms(text)
+    coverage = len(words & terms) / len(terms) if terms else 0.0
+    return math.log1p(tokens) * (1.0 + 2.0 * coverage)
+
+
+def allocate_budget(values, sizes, budget):
+    """
+    Split a token budget across files in proportion to their value.
+
+    Files that need less than their share keep only what they need and the
+    surplus is redistributed among the remaining files.
+    """
+    allocation = [0] * len(sizes)
+    active = [i for i, size in enumerate(sizes) if size > 0]
+    remaining = budget
+
+    while active and remaining > 0:
+        total_value = sum(values[i] for i in active)
+        shares = {
+            i: remaining * (values[i] / total_value if total_value else 1 / len(active))
+            for i in active
+        }
+        satisfied = [i for i in active if sizes[i] <= shares[i]]
+        if not satisfied:
+            for i in active:
+                allocation[i] = int(shares[i])
+            break
+        for i in satisfied:
+            allocation[i] = sizes[i]
+            remaining -= sizes[i]
+            active.remove(i)
+
+    return allocation
+
+
+def pack_materials(materials, budget=None, terms=None, fill=None):
+    """
+    Pack extracted materials into a shared token budget.
+
+    Args:
+        materials: list of (label, text) tuples
+        budget: total token budget (defaults to MATERIAL_TOKEN_BUDGET)
+        terms: query terms used to rank files and passages
+        fill: optional callable (index, text, max_tokens) -> str that fills
+            each file's share; defaults to pack_text
+
+    Returns:
+        list of (label, packed_text, original_tokens, packed_tokens)
+    """
+    budget = MATERIAL_TOKEN_BUDGET if budget is None else budget
+    terms = terms or set()
+
+    sizes = [count_tokens(text) for _, text in materials]
+    values = [file_value(text, terms) for _, text in materials]
+    allocation = allocate_budget(values, sizes, budget)
+
+    packed = []
+    for index, ((label, text), size, share) in enumerate(
+        zip(materials, sizes, allocation)
+    ):
+        if fill is None:
+            packed_text = pack_text(text, share, terms)
+        else:
+            packed_text = fill(index, text, share)
+        packed.append((label, packed_text, size, count_tokens(packed_text)))
+    return packed
@@ -0,0 +1,159 @@
+"""
+CPU-only extractive summarizer for uploaded teacher materials.
+
+Sentences are ranked with sparse TF-IDF vectors by their cosine similarity to
+the learning objective, the competency focus and the document centroid. Text
+is streamed sentence by sentence in two passes, so memory stays bounded by
+the vocabulary and the summary budget rather than the document size.
+"""
+
+import heapq
+import math
+import re
+from collections import Counter
+
+from material_packing import GAP_MARKER, count_tokens, pack_text, query_terms
+
+# Relative weights of the three similarity signals
+OBJECTIVE_WEIGHT = 0.5
+FOCUS_WEIGHT = 0.25
+CENTROID_WEIGHT = 0.25
+
+# Number of most frequent document terms kept in the centroid vector
+CENTROID_TERMS = 300
+
+# Sentences longer than this are skipped (usually tables or extraction noise)
+MAX_SENTENCE_TOKENS = 150
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|\n|$)")
+_WORD_RE = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+
+
+def iter_sentences(text):
+    """Yield normalized sentences of a text without building a full list"""
+    for match in _SENTENCE_RE.finditer(text):
+        sentence = " ".join(match.group(0).split())
+        if len(sentence) > 20:
+            yield sentence
+
+
+def sentence_terms(sentence):
+    """Return the term counts of a sentence"""
+    return Counter(_WORD_RE.findall(sentence.lower()))
+
+
+def tfidf_vector(counts, idf, default_idf):
+    """Build an L2-normalized sparse TF-IDF vector from term counts"""
+    vector = {
+        term: (1.0 + math.log(count)) * idf.get(term, default_idf)
+        for term, count in counts.items()
+    }
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if norm == 0:
+        return {}
+    return {term: weight / norm for term, weight in vector.items()}
+
+
+def cosine(a, b):
+    """Cosine similarity of two normalized sparse vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(term, 0.0) for term, weight in a.items())
+
+
+def summarize_text(text, max_tokens, objective="", focus=""):
+    """
+    Extract the sentences of a text that best fit a token budget.
+
+    Args:
+        text: full document text
+        max_tokens: summary budget in tokens
+        objective: learning objective the summary should support
+        focus: competency focus text
+
+    Returns:
+        Selected sentences in document order, with GAP_MARKER between
+        non-adjacent sentences. Text without a usable sentence (no
+        punctuation, only short lines, or sentences longer than
+        MAX_SENTENCE_TOKENS) is packed by passages instead.
+    """
+    if max_tokens <= 0 or not text:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text.strip()
+
+    # Pass 1: document frequencies and corpus term counts
+    document_frequency = Counter()
+    term_totals = Counter()
+    num_sentences = 0
+    for sentence in iter_sentences(text):
+        counts = sentence_terms(sentence)
+        document_frequency.update(counts.keys())
+        term_totals.update(counts)
+        num_sentences += 1
+
+    if num_sentences == 0:
+        return pack_text(text, max_tokens, query_terms(objective, focus))
+
+    idf = {
+        term: math.log((1 + num_sentences) / (1 + df)) + 1.0
+        for term, df in document_frequency.items()
+    }
+    default_idf = math.log(1 + num_sentences) + 1.0
+
+    objective_vector = tfidf_vector(sentence_terms(objective), idf, default_idf)
+    focus_vector = tfidf_vector(sentence_terms(focus), idf, default_idf)
+    centroid_vector = tfidf_vector(
+        dict(term_totals.most_common(CENTROID_TERMS)), idf, default_idf
+    )
+    del term_totals, document_frequency
+
+    # Pass 2: score sentences, keeping only as many as fit the budget
+    heap = []
+    heap_tokens = 0
+    seen = set()
+    for position, sentence in enumerate(iter_sentences(text)):
+        lowered = sentence.lower()
+        key = hash(lowered)
+        if key in seen:
+            continue
+        seen.add(key)
+        tokens = count_tokens(sentence)
+        if tokens > MAX_SENTENCE_TOKENS or tokens > max_tokens:
+            continue
+
+        vector = tfidf_vector(Counter(_WORD_RE.findall(lowered)), idf, default_idf)
+        if not vector:
+            continue
+        score = (
+            OBJECTIVE_WEIGHT * cosine(vector, objective_vector)
+            + FOCUS_WEIGHT * cosine(vector, focus_vector)
+            + CENTROID_WEIGHT * cosine(vector, centroid_vector)
+        )
+
+        heapq.heappush(heap, (score, -position, sentence, tokens))
+        heap_tokens += tokens
+        while heap_tokens > max_tokens:
+            _, _, _, dropped = heapq.heappop(heap)
+            heap_tokens -= dropped
+
+    # Leave room for gap markers by dropping the weakest sentences
+    gap_cost = count_tokens(GAP_MARKER)
+    while heap and heap_tokens + gap_cost * (len(heap) + 1) > max_tokens:
+        _, _, _, dropped = heapq.heappop(heap)
+        heap_tokens -= dropped
+
+    if not heap:
+        return pack_text(text, max_tokens, query_terms(objective, focus))
+
+    selected = sorted((-neg_position, sentence) for _, neg_position, sentence, _ in heap)
+    parts = []
+    previous = -1
+    for position, sentence in selected:
+        if position != previous + 1:
+            parts.append(GAP_MARKER)
+        parts.append(sentence)
+        previous = position
+    if previous != num_sentences - 1:
+        parts.append(GAP_MARKER)
+    return " ".join(parts)
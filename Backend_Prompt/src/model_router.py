@@ -0,0 +1,185 @@
+"""
+Model routing per task type
+
+Every upstream call names its task: "level:beginner", "level:intermediate",
+"level:advanced", "lesson_ideas", "assessment" or "repair". The router maps
+the task to a model from configuration and records latency and token usage
+per route. A route with a latency SLO and a fallback model switches to the
+fallback while the primary is slow, then probes the primary again after a
+cool-down.
+
+Configuration comes from MODEL_ROUTES (inline JSON) or MODEL_ROUTES_FILE
+(path to a JSON file):
+
+    {
+        "default": "gpt-4o-mini",
+        "routes": {
+            "level:beginner": {"model": "gpt-4.1-nano"},
+            "lesson_ideas": {"model": "gpt-4.1-nano"},
+            "level:advanced": {"model": "gpt-4.1-mini",
+                               "fallback": "gpt-4o-mini", "latency_slo_s": 12}
+        }
+    }
+
+Tasks without a route use the default model: OPENAI_MODEL, or the legacy
+MODEL variable, or gpt-4o-mini.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+DEFAULT_MODEL = os.getenv("OPENAI_MODEL") or os.getenv("MODEL") or "gpt-4o-mini"
+
+TASK_TYPES = (
+    "level:beginner",
+    "level:intermediate",
+    "level:advanced",
+    "lesson_ideas",
+    "assessment",
+    "repair",
+)
+
+# Recent primary calls a route's p95 latency is computed over
+SLO_WINDOW = int(os.getenv("MODEL_SLO_WINDOW", "20"))
+
+# Seconds a route stays on its fallback before the primary is tried again
+SLO_COOLDOWN_S = float(os.getenv("MODEL_SLO_COOLDOWN_S", "60"))
+
+
+def load_routes():
+    """Read the routing configuration from MODEL_ROUTES or MODEL_ROUTES_FILE"""
+    if os.getenv("MODEL_ROUTES"):
+        return json.loads(os.getenv("MODEL_ROUTES"))
+    path = os.getenv("MODEL_ROUTES_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ModelRouter:
+    """Chooses the model for each task and tracks per-route metrics"""
+
+    def __init__(self, config=None):
+        config = load_routes() if config is None else config
+        self.default = config.get("default") or DEFAULT_MODEL
+        self.routes = {}
+        for task, route in config.get("routes", {}).items():
+            if isinstance(route, str):
+                route = {"model": route}
+            if "model" not in route:
+                raise ValueError(f"Route {task} has no model")
+            self.routes[task] = route
+
+        self._lock = threading.Lock()
+        self._primary_latencies = {}
+        self._degraded_until = {}
+        self._metrics = {}
+
+    def route(self, task):
+        """Return the configured route of a task (default model if none)"""
+        return self.routes.get(task, {"model": self.default})
+
+    def primary_model(self, task):
+        return self.route(task)["model"]
+
+    def choose(self, task):
+        """Return the model to use for a call of this task right now"""
+        route = self.route(task)
+        if route.get("fallback"):
+            with self._lock:
+                if self._degraded_until.get(task, 0.0) > time.monotonic():
+                    return route["fallback"]
+        return route["model"]
+
+    def record(self, task, model, seconds, usage=None, error=False, deadline_hit=False):
+        """
+        Record a finished call; trips the fallback when the SLO is breached.
+
+        deadline_hit marks a call aborted at the caller's own deadline: its
+        latency is only a lower bound, so it counts against the SLO only if
+        it already exceeded it. A client with tight X-Request-Timeout
+        deadlines must not move every tenant onto the fallback.
+        """
+        route = self.route(task)
+        with self._lock:
+            metrics = self._metrics.setdefault((task, model), {
+                "calls": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "latencies": deque(maxlen=1000),
+            })
+            metrics["calls"] += 1
+            metrics["errors"] += int(error)
+            if usage:
+                metrics["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                metrics["completion_tokens"] += usage.get("completion_tokens", 0)
+            metrics["latencies"].append(seconds)
+
+            slo = route.get("latency_slo_s")
+            if not slo or not route.get("fallback") or model != route["model"]:
+                return
+            if deadline_hit and seconds <= slo:
+                return
+            # Timeouts and errors count as slow calls
+            window = self._primary_latencies.setdefault(task, deque(maxlen=SLO_WINDOW))
+            window.append(float("inf") if error else seconds)
+            if len(window) >= min(5, SLO_WINDOW) and percentile(window, 0.95) > slo:
+                self._degraded_until[task] = time.monotonic() + SLO_COOLDOWN_S
+                window.clear()
+
+    def fingerprint(self):
+        """Hash of the routing table, for cache keys that depend on the model"""
+        encoded = json.dumps([self.default, self.routes], sort_keys=True)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+    def table(self):
+        """The routing table in effect, including tasks on their fallback"""
+        now = time.monotonic()
+        with self._lock:
+            degraded = {
+                task for task, until in self._degraded_until.items() if until > now
+            }
+        table = {}
+        for task in sorted(set(TASK_TYPES) | set(self.routes)):
+            route = self.route(task)
+            table[task] = {
+                "model": route["model"],
+                "fallback": route.get("fallback"),
+                "latency_slo_s": route.get("latency_slo_s"),
+                "active": route["fallback"] if task in degraded else route["model"],
+            }
+        return {"default": self.default, "routes": table}
+
+    def stats(self):
+        """Calls, errors, latency and tokens per task and model"""
+        with self._lock:
+            stats = {}
+            for (task, model), metrics in sorted(self._metrics.items()):
+                latencies = metrics["latencies"]
+                calls = metrics["calls"]
+                stats.setdefault(task, {})[model] = {
+                    "calls": calls,
+                    "errors": metrics["errors"],
+                    "latency_p50_s": round(percentile(latencies, 0.5), 3),
+                    "latency_p95_s": round(percentile(latencies, 0.95), 3),
+                    "prompt_tokens": metrics["prompt_tokens"],
+                    "completion_tokens": metrics["completion_tokens"],
+                    "tokens_per_call": round(
+                        (metrics["prompt_tokens"] + metrics["completion_tokens"]) / calls, 1
+                    ),
+                }
+            return stats
+
+
+router = ModelRouter()
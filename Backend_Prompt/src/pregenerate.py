@@ -0,0 +1,230 @@
+"""
+Off-hours pre-generation of baseline activities
+
+Generates activities for every (competency, cycle, level) combination in
+lehrplan21.json, using the competency focus as a generic learning objective
+and, optionally, once more per preset. Results go into the worksheet store
+keyed by the fingerprint of the exact prompt, so /api/generate_worksheet
+serves any level whose prompt matches (i.e. no personal context was given)
+without calling the model.
+
+The job is incremental: a combination is regenerated only when its prompt
+fingerprint changed (edited data files, prompt template, model or preset).
+Combinations with an identical prompt share one generation; the prompt does
+not currently depend on the cycle.
+
+Usage:
+    python pregenerate.py [--presets presets.json] [--concurrency 4] [--force] [--dry-run]
+
+A presets file is a JSON list of objects with a "name", a
+"learning_objective" and optionally other request fields, e.g.
+    [{"name": "intro-45min", "learning_objective": "...", "time_available": "45",
+      "competency_ids": ["MI_MEDIEN_1"]}]
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from curriculum_topics import snapshot
+from model_router import router
+from teacher_interface import TeacherConfig
+from worksheet_backend import (
+    COMPETENCY_LEVELS,
+    build_level_messages,
+    parse_agent_response,
+    parse_failed,
+    run_openai_chat,
+)
+from worksheet_store import get_store, prompt_fingerprint
+
+# Serve pre-generated activities from /api/generate_worksheet (1) or not (0)
+SERVE_PREGENERATED = os.getenv("SERVE_PREGENERATED", "1") == "1"
+
+# Request fields a preset may set besides its learning objective
+PRESET_FIELDS = (
+    "materials_available",
+    "time_available",
+    "teaching_ideas",
+    "class_size_composition",
+    "class_composition",
+    "other_notes",
+    "num_questions_per_level",
+)
+
+
+def baseline_config(competency, cycle, level, preset=None):
+    """
+    Build the config of a baseline generation, with the same defaults as an
+    /api/generate_worksheet request that only names competency and objective
+    """
+    config = TeacherConfig()
+    config.competency_id = competency["id"]
+    config.cycle = cycle
+    config.learning_objective = competency.get("focus", "")
+    config.include_beginner = level == "beginner"
+    config.include_intermediate = level == "intermediate"
+    config.include_advanced = level == "advanced"
+    config.include_lesson_ideas = False
+    if preset:
+        config.learning_objective = preset["learning_objective"]
+        for field in PRESET_FIELDS:
+            if field in preset:
+                setattr(config, field, preset[field])
+    return config
+
+
+def plan_jobs(presets=()):
+    """
+    List every combination with its messages and prompt fingerprint
+    """
+    jobs = []
+    for competency in snapshot().competencies.values():
+        applicable = [None] + [
+            preset
+            for preset in presets
+            if competency["id"] in preset.get("competency_ids", [competency["id"]])
+        ]
+        for cycle in competency.get("cycles", []):
+            for level in COMPETENCY_LEVELS:
+                for preset in applicable:
+                    config = baseline_config(competency, cycle, level, preset)
+                    messages = build_level_messages(config, level)
+                    jobs.append(
+                        {
+                            "key": (
+                                competency["id"],
+                                cycle,
+                                level,
+                                preset["name"] if preset else "",
+                            ),
+                            "messages": messages,
+                            "fingerprint": prompt_fingerprint(
+                                messages, router.primary_model(f"level:{level}")
+                            ),
+                        }
+                    )
+    return jobs
+
+
+def pregenerated_activities(messages, level):
+    """
+    Return pre-generated activities for exactly these level messages (and
+    the level's current model), or None
+    """
+    if not SERVE_PREGENERATED:
+        return None
+    fingerprint = prompt_fingerprint(messages, router.primary_model(f"level:{level}"))
+    return get_store().find_baseline(fingerprint)
+
+
+def generate_activities(messages, level):
+    """Generate activities at batch priority; None if the response did not parse"""
+    raw_response = run_openai_chat(
+        messages, priority="batch", tenant="pregeneration", task=f"level:{level}"
+    )
+    activities = parse_agent_response(raw_response)
+    if parse_failed(activities) or not isinstance(activities, list) or any(
+        not isinstance(a, dict) for a in activities
+    ):
+        return None
+    return activities
+
+
+def pregenerate(presets=(), concurrency=4, force=False, dry_run=False):
+    """
+    Bring the baseline store up to date.
+
+    Returns:
+        dict with counts of planned, up-to-date, generated, shared and failed
+        combinations
+    """
+    store = get_store()
+    jobs = plan_jobs(presets)
+    stale = [
+        job
+        for job in jobs
+        if force or store.baseline_fingerprint(*job["key"]) != job["fingerprint"]
+    ]
+
+    # One generation per distinct prompt
+    by_fingerprint = {}
+    for job in stale:
+        by_fingerprint.setdefault(job["fingerprint"], []).append(job)
+
+    summary = {
+        "planned": len(jobs),
+        "up_to_date": len(jobs) - len(stale),
+        "generated": 0,
+        "shared": 0,
+        "failed": 0,
+    }
+    print(
+        f"{len(jobs)} combinations, {len(stale)} stale, "
+        f"{len(by_fingerprint)} distinct prompts to generate"
+    )
+    if dry_run:
+        return summary
+
+    # Reuse stored activities for prompts that are already generated elsewhere
+    pending = {}
+    for fingerprint, group in by_fingerprint.items():
+        activities = None if force else store.find_baseline(fingerprint)
+        if activities is None:
+            pending[fingerprint] = group
+            continue
+        for job in group:
+            store.put_baseline(*job["key"], fingerprint, activities)
+        summary["shared"] += len(group)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(
+                generate_activities, group[0]["messages"], group[0]["key"][2]
+            ): fingerprint
+            for fingerprint, group in pending.items()
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            fingerprint = futures[future]
+            group = pending[fingerprint]
+            try:
+                activities = future.result()
+            except Exception as e:
+                activities = None
+                print(f"  ✗ {group[0]['key']}: {e}")
+            if activities is None:
+                summary["failed"] += len(group)
+                continue
+            for job in group:
+                store.put_baseline(*job["key"], fingerprint, activities)
+            summary["generated"] += 1
+            summary["shared"] += len(group) - 1
+            print(f"  [{done}/{len(pending)}] ✓ {' / '.join(filter(None, group[0]['key']))}")
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pre-generate baseline activities for every competency, cycle and level"
+    )
+    parser.add_argument("--presets", help="JSON file with a list of presets")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--force", action="store_true", help="regenerate everything")
+    parser.add_argument("--dry-run", action="store_true", help="only report what is stale")
+    args = parser.parse_args()
+
+    presets = []
+    if args.presets:
+        with open(args.presets, "r", encoding="utf-8") as f:
+            presets = json.load(f)
+
+    started = time.perf_counter()
+    summary = pregenerate(presets, args.concurrency, args.force, args.dry_run)
+    print("=" * 60)
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+    print(f"  elapsed: {time.perf_counter() - started:.1f} s")
+    print("=" * 60)
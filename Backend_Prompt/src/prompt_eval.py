@@ -0,0 +1,417 @@
+"""
+Evaluation of system prompt variants
+
+Runs every combination of prompt variant x sample config x level (x repeat)
+through run_openai_chat, concurrently and under the upstream scheduler's
+rate limits, and compares the variants per call: latency, prompt and
+completion tokens, parse failures (no JSON in the response), validation
+failures (wrong number of activities, missing fields, wrong level) and
+duplicate activities (the same title twice for one config, across levels).
+
+The built-in SYSTEM_PROMPT_TEMPLATE is always the first variant and the
+baseline. A variant is a text file with the same {placeholders} (see
+system_prompt_fields), e.g. the prompts in "Research Material/3 - Prompt
+Engineering/Prompts". With --max-regression the run exits with status 1
+when a variant's median latency or tokens per call exceed the baseline's
+by more than that fraction, so a prompt that slows down or bloats the
+pipeline is caught before it ships.
+
+The calls go wherever run_openai_chat sends them: the live API, the fake
+upstream (OPENAI_BASE_URL=http://127.0.0.1:8900/v1 with
+benchmarks/fake_openai.py), or cassettes (--record DIR on one run, then
+--replay DIR for offline reruns at the recorded latencies). Jobs are
+interleaved across variants, so queueing for the rate limits, which is part
+of the measured latency, is spread evenly over them.
+
+Usage:
+    python prompt_eval.py --variant final="../../Research Material/3 - Prompt Engineering/Prompts/Final_Prompt.txt"
+        [--variant NAME=PATH ...] [--configs ../data/prompt_eval_configs.json]
+        [--levels beginner,advanced] [--repeats 2] [--concurrency 4]
+        [--record DIR | --replay DIR] [--max-regression 0.25] [--output DIR]
+
+Writes results.jsonl (every call with its raw response), summary.json and
+comparison.md to the output directory (output/prompt_eval/<timestamp>).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cassettes import Cassette, use_cassette
+from competency_search import tokenize
+from model_router import percentile
+from teacher_interface import config_from_payload
+from worksheet_backend import (
+    COMPETENCY_LEVELS,
+    SYSTEM_PROMPT_TEMPLATE,
+    build_level_messages,
+    parse_agent_response,
+    parse_failed,
+    run_openai_chat,
+    system_prompt_fields,
+    template_placeholders,
+)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+
+DEFAULT_CONFIGS = os.path.join(project_root, "data", "prompt_eval_configs.json")
+DEFAULT_OUTPUT = os.path.join(project_root, "output", "prompt_eval")
+
+BASELINE = "builtin"
+
+# Fields every generated activity must have (see SYSTEM_PROMPT_TEMPLATE)
+ACTIVITY_FIELDS = (
+    "title",
+    "difficulty_level",
+    "estimated_duration",
+    "materials_needed",
+    "min_number_students",
+    "max_number_students",
+    "description",
+)
+
+
+def load_variants(specs):
+    """
+    The built-in template followed by the variants given as PATH or
+    NAME=PATH, as (name, template) pairs
+    """
+    variants = [(BASELINE, SYSTEM_PROMPT_TEMPLATE)]
+    for spec in specs:
+        name, _, path = spec.rpartition("=")
+        if not name:
+            name = os.path.splitext(os.path.basename(path))[0]
+        if name in dict(variants):
+            raise ValueError(f"Duplicate variant name '{name}'")
+        with open(path, "r", encoding="utf-8") as f:
+            variants.append((name, f.read()))
+    return variants
+
+
+def load_configs(path):
+    """
+    Sample configs from a JSON list or a JSON Lines file of
+    /api/generate_worksheet payloads, each with an optional "name"
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        payloads = json.loads(text)
+    else:
+        payloads = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [
+        (payload.get("name") or f"config-{number}", config_from_payload(payload))
+        for number, payload in enumerate(payloads, 1)
+    ]
+
+
+def check_variants(variants, fields):
+    """
+    Raises:
+        ValueError for a variant with placeholders the prompt fields lack
+    """
+    for name, template in variants:
+        unknown = template_placeholders(template) - set(fields)
+        if unknown:
+            raise ValueError(
+                f"Variant '{name}' uses unknown placeholders: "
+                f"{', '.join(sorted(unknown))} (known: {', '.join(sorted(fields))})"
+            )
+
+
+def validation_errors(activities, level, expected_count):
+    """Why a parsed response does not match what the prompt asked for"""
+    if not isinstance(activities, list):
+        return ["response is not a list of activities"]
+    errors = []
+    if len(activities) != expected_count:
+        errors.append(f"{len(activities)} activities instead of {expected_count}")
+    for number, activity in enumerate(activities, 1):
+        if not isinstance(activity, dict):
+            errors.append(f"activity {number} is not an object")
+            continue
+        missing = [field for field in ACTIVITY_FIELDS if activity.get(field) in (None, "", [])]
+        if missing:
+            errors.append(f"activity {number} lacks {', '.join(missing)}")
+        if str(activity.get("difficulty_level", level)).strip().lower() != level:
+            errors.append(f"activity {number} has level {activity.get('difficulty_level')!r}")
+    return errors
+
+
+def evaluate_call(job):
+    """Run one generation and measure it"""
+    usage = {}
+    started = time.perf_counter()
+    try:
+        content = run_openai_chat(
+            job["messages"],
+            priority="batch",
+            tenant="prompt-eval",
+            usage=usage,
+            task=f"level:{job['level']}",
+        )
+    except Exception as e:
+        return {**job["key"], "seconds": time.perf_counter() - started, "error": str(e)}
+    return {
+        **job["key"],
+        "seconds": time.perf_counter() - started,
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "response": content,
+    }
+
+
+def check_response(result, job):
+    """
+    Add parse and validation outcomes to the result of a call. Runs on the
+    main thread: parse_agent_response reports failures on stdout, which is
+    silenced here for the whole process.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        activities = parse_agent_response(result["response"])
+    failed = parse_failed(activities)
+    result["parse_failed"] = failed
+    result["validation_errors"] = [] if failed else validation_errors(
+        activities, job["level"], job["expected_count"]
+    )
+    result["titles"] = [] if failed else [
+        activity.get("title", "") for activity in activities if isinstance(activity, dict)
+    ]
+    return result
+
+
+def plan_jobs(variants, configs, levels, repeats):
+    """All calls of the matrix, variants innermost so they interleave"""
+    jobs = []
+    for config_name, config in configs:
+        for level in levels:
+            for repeat in range(repeats):
+                for variant, template in variants:
+                    jobs.append({
+                        "key": {
+                            "variant": variant,
+                            "config": config_name,
+                            "level": level,
+                            "repeat": repeat,
+                        },
+                        "level": level,
+                        "expected_count": config.num_questions_per_level,
+                        "messages": build_level_messages(config, level, template),
+                    })
+    return jobs
+
+
+def duplicate_count(results):
+    """
+    Activities whose title already appeared for the same config and repeat
+    (across levels); titles are compared case- and accent-insensitively
+    """
+    seen = {}
+    duplicates = 0
+    for result in results:
+        group = seen.setdefault((result["config"], result["repeat"]), set())
+        for title in result.get("titles", []):
+            normalized = " ".join(tokenize(title))
+            if normalized in group:
+                duplicates += 1
+            group.add(normalized)
+    return duplicates
+
+
+def summarize(variant, results):
+    """Per-variant metrics over all its calls"""
+    answered = [result for result in results if "error" not in result]
+    parsed = [result for result in answered if not result["parse_failed"]]
+    activities = sum(len(result["titles"]) for result in parsed)
+    latencies = [result["seconds"] for result in answered]
+
+    def mean(key):
+        return round(statistics.mean(r[key] for r in answered), 1) if answered else 0.0
+
+    def rate(count, total):
+        return round(count / total, 3) if total else 0.0
+
+    summary = {
+        "variant": variant,
+        "calls": len(results),
+        "errors": len(results) - len(answered),
+        "latency_p50_s": round(percentile(latencies, 0.5), 3) if latencies else 0.0,
+        "latency_p95_s": round(percentile(latencies, 0.95), 3) if latencies else 0.0,
+        "prompt_tokens": mean("prompt_tokens"),
+        "completion_tokens": mean("completion_tokens"),
+        "parse_failure_rate": rate(len(answered) - len(parsed), len(answered)),
+        "validation_failure_rate": rate(
+            sum(1 for result in parsed if result["validation_errors"]), len(parsed)
+        ),
+        "duplicate_rate": rate(duplicate_count(parsed), activities),
+        "activities_per_call": round(activities / len(parsed), 2) if parsed else 0.0,
+    }
+    summary["tokens_per_call"] = round(
+        summary["prompt_tokens"] + summary["completion_tokens"], 1
+    )
+    return summary
+
+
+def regressions(summaries, threshold):
+    """Variants slower or using more tokens than the baseline by > threshold"""
+    baseline = summaries[0]
+    found = []
+    for summary in summaries[1:]:
+        for metric in ("latency_p50_s", "tokens_per_call"):
+            if baseline[metric] and summary[metric] > baseline[metric] * (1 + threshold):
+                change = summary[metric] / baseline[metric] - 1
+                found.append(f"{summary['variant']}: {metric} {change:+.0%} vs {BASELINE}")
+    return found
+
+
+def relative(value, base):
+    return f" ({value / base - 1:+.0%})" if base and value != base else ""
+
+
+def comparison_table(summaries):
+    """The summaries as a Markdown table, with changes against the baseline"""
+    baseline = summaries[0]
+    lines = [
+        "| Variant | Calls | Errors | p50 (s) | p95 (s) | Prompt tokens | Completion tokens "
+        "| Parse failures | Validation failures | Duplicates | Activities/call |",
+        "|---------|-------|--------|---------|---------|---------------|-------------------"
+        "|----------------|---------------------|------------|-----------------|",
+    ]
+    for s in summaries:
+        lines.append(
+            f"| {s['variant']} | {s['calls']} | {s['errors']} "
+            f"| {s['latency_p50_s']}{relative(s['latency_p50_s'], baseline['latency_p50_s'])} "
+            f"| {s['latency_p95_s']} "
+            f"| {s['prompt_tokens']}{relative(s['prompt_tokens'], baseline['prompt_tokens'])} "
+            f"| {s['completion_tokens']}"
+            f"{relative(s['completion_tokens'], baseline['completion_tokens'])} "
+            f"| {s['parse_failure_rate']:.1%} | {s['validation_failure_rate']:.1%} "
+            f"| {s['duplicate_rate']:.1%} | {s['activities_per_call']} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def evaluate(variants, configs, levels, repeats=1, concurrency=4):
+    """
+    Run the matrix and return (per-call results, per-variant summaries)
+    """
+    check_variants(variants, system_prompt_fields(configs[0][1], levels[0]))
+    jobs = plan_jobs(variants, configs, levels, repeats)
+    print(
+        f"{len(variants)} variants x {len(configs)} configs x {len(levels)} levels"
+        f" x {repeats} repeats = {len(jobs)} calls"
+    )
+
+    # Results keep the order of the matrix, whatever order calls finish in
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(evaluate_call, job): number for number, job in enumerate(jobs)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            number = futures[future]
+            result = future.result()
+            if "error" not in result:
+                check_response(result, jobs[number])
+            results[number] = result
+            if "error" in result:
+                outcome = f"✗ {result['error']}"
+            elif result["parse_failed"]:
+                outcome = "✗ parse failure"
+            elif result["validation_errors"]:
+                outcome = f"✗ {result['validation_errors'][0]}"
+            else:
+                outcome = "✓"
+            print(
+                f"  [{done}/{len(jobs)}] {result['variant']} / {result['config']} / "
+                f"{result['level']}: {outcome} {result['seconds']:.2f} s"
+            )
+
+    summaries = [
+        summarize(name, [result for result in results if result["variant"] == name])
+        for name, _ in variants
+    ]
+    return results, summaries
+
+
+def write_report(output_dir, results, summaries, table):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "results.jsonl"), "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(output_dir, "comparison.md"), "w", encoding="utf-8") as f:
+        f.write(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare system prompt variants on sample configs and levels"
+    )
+    parser.add_argument(
+        "--variant", action="append", default=[], metavar="[NAME=]PATH",
+        help="prompt template file to compare with the built-in one (repeatable)",
+    )
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help="JSON or JSONL payloads")
+    parser.add_argument("--levels", default=",".join(COMPETENCY_LEVELS))
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="DIR", help="record all calls to cassettes")
+    cassette.add_argument("--replay", metavar="DIR", help="answer calls from cassettes")
+    parser.add_argument(
+        "--replay-latency", type=float, default=1.0,
+        help="factor for recorded latencies on replay (0 answers at once)",
+    )
+    parser.add_argument(
+        "--max-regression", type=float, default=None,
+        help="exit 1 if a variant's p50 latency or tokens per call exceed the "
+        "baseline by more than this fraction (0.25 = 25%%)",
+    )
+    parser.add_argument("--output", help="report directory")
+    args = parser.parse_args()
+
+    levels = [level.strip() for level in args.levels.split(",") if level.strip()]
+    unknown_levels = set(levels) - set(COMPETENCY_LEVELS)
+    if unknown_levels:
+        parser.error(f"unknown levels: {', '.join(sorted(unknown_levels))}")
+    if args.record:
+        use_cassette(Cassette(args.record, mode="record"))
+    elif args.replay:
+        use_cassette(Cassette(args.replay, mode="replay", latency=args.replay_latency))
+
+    try:
+        variants = load_variants(args.variant)
+        configs = load_configs(args.configs)
+        started = time.perf_counter()
+        results, summaries = evaluate(
+            variants, configs, levels, args.repeats, args.concurrency
+        )
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    table = comparison_table(summaries)
+    output_dir = args.output or os.path.join(
+        DEFAULT_OUTPUT, time.strftime("%Y%m%d-%H%M%S")
+    )
+    write_report(output_dir, results, summaries, table)
+    print("=" * 60)
+    print(table)
+    print(f"  elapsed: {time.perf_counter() - started:.1f} s")
+    print(f"  report: {output_dir}")
+
+    if args.max_regression is not None:
+        found = regressions(summaries, args.max_regression)
+        for regression in found:
+            print(f"  REGRESSION {regression}")
+        if found:
+            sys.exit(1)
@@ -0,0 +1,242 @@
+"""
+Priority-aware scheduler in front of the OpenAI API
+
+Every upstream call first acquires capacity from two token buckets, one for
+requests per minute and one for tokens per minute, sized from estimated
+prompt tokens. Waiting calls are queued by priority class (interactive
+before batch) and served round-robin across tenants within a class. The
+bucket limits follow the x-ratelimit-* headers returned by the upstream.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Upstream quota assumed until the first response headers arrive
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+
+# Tokens reserved for the completion on top of the prompt estimate
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("COMPLETION_TOKEN_ESTIMATE", "800"))
+
+# Priority classes, highest first
+PRIORITIES = ("interactive", "batch")
+
+# Longest a waiter sleeps before re-checking the buckets
+_MAX_POLL_SECONDS = 0.05
+
+
+class TokenBucket:
+    """Token bucket refilled continuously up to its capacity"""
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self):
+        # Limits are per minute
+        return self.capacity / 60.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount tokens are available (0 if they are now)"""
+        # Requests larger than the bucket only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def set_limit(self, capacity, remaining=None):
+        self.capacity = float(capacity)
+        self.tokens = min(self.tokens, self.capacity)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+
+
+class _Waiter:
+    __slots__ = ("priority", "tenant", "tokens", "enqueued")
+
+    def __init__(self, priority, tenant, tokens):
+        self.priority = priority
+        self.tenant = tenant
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+
+
+class UpstreamScheduler:
+    """Admits upstream calls under RPM/TPM limits by priority and tenant"""
+
+    def __init__(self, rpm_limit=OPENAI_RPM_LIMIT, tpm_limit=OPENAI_TPM_LIMIT):
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # priority -> tenant -> deque of waiters; tenants rotate for fairness
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._waits = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+        self._admitted = {priority: 0 for priority in PRIORITIES}
+
+    def _enqueue(self, priority, tenant, tokens):
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        waiter = _Waiter(priority, tenant, tokens)
+        self._queues[priority].setdefault(tenant, deque()).append(waiter)
+        return waiter
+
+    def _next_waiter(self):
+        # Highest priority class first; within it the tenant at the front
+        for priority in PRIORITIES:
+            tenants = self._queues[priority]
+            if tenants:
+                return tenants[next(iter(tenants))][0]
+        return None
+
+    def _try_admit(self, waiter):
+        """
+        Admit the waiter if it is next in line and both buckets allow it.
+
+        Returns:
+            0.0 if admitted, otherwise a hint of how long to wait
+        """
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+
+        if self._next_waiter() is not waiter:
+            return _MAX_POLL_SECONDS
+
+        wait = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+        if wait > 0:
+            return min(wait, _MAX_POLL_SECONDS)
+
+        self.requests.tokens -= 1
+        self.tokens.tokens -= waiter.tokens
+
+        # Pop the waiter and move its tenant to the back of the rotation
+        tenants = self._queues[waiter.priority]
+        queue = tenants.pop(waiter.tenant)
+        queue.popleft()
+        if queue:
+            tenants[waiter.tenant] = queue
+
+        self._waits[waiter.priority].append(now - waiter.enqueued)
+        self._admitted[waiter.priority] += 1
+        self._changed.notify_all()
+        return 0.0
+
+    def acquire(self, tokens, priority="interactive", tenant="default", timeout=None):
+        """
+        Block until an upstream call with this many estimated tokens may start.
+
+        Raises:
+            TimeoutError if not admitted within timeout seconds
+
+        Returns:
+            seconds spent waiting in the queue
+        """
+        with self._lock:
+            waiter = self._enqueue(priority, tenant, tokens)
+            try:
+                while True:
+                    wait = self._try_admit(waiter)
+                    if wait == 0.0:
+                        return time.monotonic() - waiter.enqueued
+                    wait = self._bounded_wait(waiter, wait, timeout)
+                    self._changed.wait(wait)
+            except BaseException:
+                self._discard(waiter)
+                raise
+
+    async def acquire_async(
+        self, tokens, priority="interactive", tenant="default", timeout=None
+    ):
+        """Async variant of acquire; waits without blocking the event loop"""
+        with self._lock:
+            waiter = self._enqueue(priority, tenant, tokens)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_admit(waiter)
+                if wait == 0.0:
+                    return time.monotonic() - waiter.enqueued
+                await asyncio.sleep(self._bounded_wait(waiter, wait, timeout))
+        except BaseException:
+            # Includes cancellation when the client disconnects
+            with self._lock:
+                self._discard(waiter)
+            raise
+
+    @staticmethod
+    def _bounded_wait(waiter, wait, timeout):
+        # Shorten the wait to the waiter's timeout, raising once it has passed
+        if timeout is None:
+            return wait
+        left = waiter.enqueued + timeout - time.monotonic()
+        if left <= 0:
+            raise TimeoutError("Deadline passed while waiting for upstream capacity")
+        return min(wait, left)
+
+    def _discard(self, waiter):
+        # Remove a waiter that gave up (e.g. its client disconnected)
+        tenants = self._queues[waiter.priority]
+        queue = tenants.get(waiter.tenant)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del tenants[waiter.tenant]
+            self._changed.notify_all()
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once the real usage of a call is known"""
+        with self._lock:
+            self.tokens.tokens -= actual_tokens - estimated_tokens
+
+    def update_from_headers(self, headers):
+        """
+        Fit the bucket limits to the upstream's x-ratelimit-* headers
+        """
+
+        def header(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        with self._lock:
+            limit = header("x-ratelimit-limit-requests")
+            if limit:
+                self.requests.set_limit(limit, header("x-ratelimit-remaining-requests"))
+            limit = header("x-ratelimit-limit-tokens")
+            if limit:
+                self.tokens.set_limit(limit, header("x-ratelimit-remaining-tokens"))
+
+    def stats(self):
+        """Queue length and wait times (seconds) per priority class"""
+        with self._lock:
+            result = {
+                "limits": {
+                    "requests_per_minute": self.requests.capacity,
+                    "tokens_per_minute": self.tokens.capacity,
+                },
+                "priorities": {},
+            }
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                result["priorities"][priority] = {
+                    "queued": sum(len(q) for q in self._queues[priority].values()),
+                    "admitted": self._admitted[priority],
+                    "wait_p50": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                    "wait_p95": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+                    "wait_max": round(waits[-1], 3) if waits else 0.0,
+                }
+            return result
+
+
+scheduler = UpstreamScheduler()
@@ -23,6 +23,7 @@ class TeacherConfig:
         self.class_size_composition = ""
         self.other_notes = ""
         self.uploaded_materials = []
+        self.material_ids = []
         self.num_questions_per_level = 3
         self.include_lesson_ideas = True
         self.include_beginner = True
@@ -47,6 +48,7 @@ class TeacherConfig:
                 "other_notes": self.other_notes,
             },
             "uploaded_materials": self.uploaded_materials,
+            "material_ids": self.material_ids,
             "num_questions_per_level": self.num_questions_per_level,
             "include_lesson_ideas": self.include_lesson_ideas,
             "difficulty_levels": {
@@ -57,6 +59,56 @@ class TeacherConfig:
         }
 
 
+def config_from_payload(data):
+    """
+    Map a /api/generate_worksheet JSON payload onto a TeacherConfig
+    """
+    config = TeacherConfig()
+    config.competency_id = data.get("competency_id")
+    config.subject = data.get("subject")
+    config.cycle = data.get("cycle")
+    config.learning_objective = data.get("learning_objective", "")
+    config.materials_available = data.get("materials_available", "")
+    config.time_available = data.get("time_available", "")
+    config.teaching_ideas = data.get("teaching_ideas", "")
+    config.class_size_composition = data.get("class_size_composition", "")
+    config.other_notes = data.get("other_notes", "")
+    config.num_questions_per_level = data.get("num_questions_per_level", 3)
+    config.include_beginner = data.get("include_beginner", True)
+    config.include_intermediate = data.get("include_intermediate", True)
+    config.include_advanced = data.get("include_advanced", True)
+    config.include_lesson_ideas = data.get("include_lesson_ideas", False)
+    config.class_composition = data.get("class_composition", "")
+    config.material_ids = data.get("material_ids", [])
+    return config
+
+
+def config_from_dict(data):
+    """
+    Build a TeacherConfig from a to_dict() export or a flat
+    /api/generate_worksheet payload. Fields left out keep the defaults of
+    that shape: a payload gets the API's defaults (config_from_payload, so
+    no lesson ideas unless requested), an export those of TeacherConfig.
+    A "name" or "id" field is allowed and ignored.
+
+    Raises:
+        ValueError for a field TeacherConfig does not have
+    """
+    exported = "class_context" in data or "difficulty_levels" in data
+    config = TeacherConfig() if exported else config_from_payload({})
+    fields = {key: value for key, value in data.items() if key not in ("name", "id")}
+    fields.update(fields.pop("class_context", None) or {})
+    for level, included in (fields.pop("difficulty_levels", None) or {}).items():
+        fields[f"include_{level}"] = included
+
+    unknown = sorted(set(fields) - set(vars(config)))
+    if unknown:
+        raise ValueError(f"Unknown config fields: {', '.join(unknown)}")
+    for key, value in fields.items():
+        setattr(config, key, value)
+    return config
+
+
 def interactive_teacher_setup():
     """
     Interactive command-line interface for teachers to configure worksheet generation
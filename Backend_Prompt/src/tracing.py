@@ -0,0 +1,149 @@
+"""
+Lightweight request tracing
+
+Spans around the pipeline stages (material summaries, prompt building, each
+upstream call, response parsing) are collected per request and emitted as a
+Server-Timing response header and as one structured JSON log line with the
+request id. Enable with TRACING_ENABLED=1; when disabled, the decorators
+cost a single context-variable lookup per call.
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0") == "1"
+
+logger = logging.getLogger("worksheet.trace")
+if TRACING_ENABLED and not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = []
+        # Spans may be recorded from worker threads and concurrent tasks
+        self._lock = threading.Lock()
+
+    def add(self, name, started, duration, error=None):
+        with self._lock:
+            self.spans.append(
+                {
+                    "name": name,
+                    "start_ms": round((started - self.started) * 1000, 2),
+                    "duration_ms": round(duration * 1000, 2),
+                    "error": error,
+                }
+            )
+
+    def total_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def server_timing(self):
+        """Format the spans as a Server-Timing header value"""
+        counts = {}
+        entries = []
+        for span in sorted(self.spans, key=lambda s: s["start_ms"]):
+            counts[span["name"]] = counts.get(span["name"], 0) + 1
+            name = span["name"]
+            if counts[name] > 1:
+                name = f"{name}.{counts[name]}"
+            entries.append(f"{name};dur={span['duration_ms']}")
+        entries.append(f"total;dur={self.total_ms()}")
+        return ", ".join(entries)
+
+
+def start_trace(request_id=None):
+    """Start collecting spans for the current request; returns a reset token"""
+    if not TRACING_ENABLED:
+        return None
+    return _current_trace.set(Trace(request_id))
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def finish_trace(token, response_headers=None, **fields):
+    """
+    Emit the current trace: Server-Timing and X-Request-Id headers on the
+    response, plus one JSON log line with the given extra fields.
+    """
+    if token is None:
+        return
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return
+
+    if response_headers is not None:
+        response_headers["Server-Timing"] = trace.server_timing()
+        response_headers["X-Request-Id"] = trace.request_id
+
+    record = {
+        "request_id": trace.request_id,
+        "total_ms": trace.total_ms(),
+        **fields,
+        "spans": trace.spans,
+    }
+    logger.info(json.dumps(record, ensure_ascii=False))
+
+
+def traced(name):
+    """Record a span around every call of the decorated (sync or async) function"""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                trace = _current_trace.get()
+                if trace is None:
+                    return await func(*args, **kwargs)
+                started = time.perf_counter()
+                error = None
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    trace.add(name, started, time.perf_counter() - started, error)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                trace.add(name, started, time.perf_counter() - started, error)
+
+        return wrapper
+
+    return decorator
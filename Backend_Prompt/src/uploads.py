@@ -0,0 +1,99 @@
+"""
+Streaming multipart uploads for teacher materials
+
+File bodies are written chunk by chunk into spooled temporary files (kept in
+memory up to UPLOAD_SPOOL_BYTES, then moved to a named file on disk), hashed
+while they stream in and cut off as soon as they exceed the per-file size
+limit.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Per-file and per-request upload limits
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_MB", "20")) * 1024 * 1024
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_MB", "50")) * 1024 * 1024
+
+# Bytes of each upload held in memory before spilling to disk
+UPLOAD_SPOOL_BYTES = 512 * 1024
+
+
+class HashingSpooledFile:
+    """
+    Spooled temporary file that hashes and size-checks data as it is written
+
+    Data spills to a named temporary file (keeping the upload's extension),
+    so extraction workers can open the upload by path instead of receiving
+    its bytes.
+    """
+
+    def __init__(self, max_bytes=MAX_UPLOAD_FILE_BYTES, filename=None):
+        self._file = io.BytesIO()
+        self._path = None
+        self._sha256 = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.filename = filename
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(
+                f"{self.filename or 'Upload'} exceeds the per-file limit of "
+                f"{self.max_bytes // (1024 * 1024)} MB"
+            )
+        self._sha256.update(data)
+        if self._path is None and self.size > UPLOAD_SPOOL_BYTES:
+            self.rollover()
+        return self._file.write(data)
+
+    def rollover(self):
+        """Move the data written so far from memory to a file on disk"""
+        if self._path is not None:
+            return
+        suffix = os.path.splitext(self.filename or "")[1].lower()
+        # Removed on close, or when garbage-collected if parsing failed
+        # before the upload was handed out; workers open it while it exists
+        disk = tempfile.NamedTemporaryFile(suffix=suffix)
+        disk.write(self._file.getbuffer())
+        disk.seek(self._file.tell())
+        self._file.close()
+        self._file, self._path = disk, disk.name
+
+    @property
+    def path(self):
+        """Path of the upload on disk; small uploads are written out first"""
+        self.rollover()
+        self._file.flush()
+        return self._path
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, tell, close, ... go straight to the spooled file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class UploadRequest(Request):
+    """Flask request that streams uploaded files into HashingSpooledFile"""
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return HashingSpooledFile(filename=filename)
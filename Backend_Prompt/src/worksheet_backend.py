@@ -1,70 +1,232 @@
+import asyncio
 import json
 import os
-import PyPDF2
-import docx
-from openai import OpenAI
+import re
+import threading
+import time
+from openai import APITimeoutError, AsyncOpenAI, OpenAI
+from collections import OrderedDict
+from cassettes import ReplayedError, get_cassette, replay_outcome
+from material_extraction import MATERIAL_LABELS, extract_in_pool
+from material_packing import count_tokens, pack_materials, query_terms
+from material_summarizer import summarize_text
+from model_router import router
+from rate_limiter import COMPLETION_TOKEN_ESTIMATE, scheduler
+from tracing import traced
+
+
+# Extraction results (and their summaries) keyed by file identity
+MATERIAL_CACHE_SIZE = int(os.getenv("MATERIAL_CACHE_SIZE", "64"))
+_material_cache = OrderedDict()
+
+# Summaries kept per material, one per (budget, objective, focus) combination
+SUMMARIES_PER_MATERIAL = 16
+
+# Guards _material_cache and the summaries of its entries, which request
+# threads (and the async server's prompt-building threads) share
+_material_cache_lock = threading.Lock()
+
+
+def get_cached_materials(file_paths, deadline=None):
+    """
+    Return cache entries for several materials, extracting misses in parallel.
 
+    Entries are keyed by path, size and modification time, so edited files
+    are re-read. Each entry holds the extracted text and a dict of summaries.
+    Extraction stops waiting at the deadline (a time.monotonic() value).
 
-def extract_material_content(file_path):
+    Returns:
+        list with an entry dict or an Exception for each file
+    """
+    keys = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        keys.append((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns))
+
+    results = [None] * len(keys)
+    with _material_cache_lock:
+        for i, key in enumerate(keys):
+            entry = _material_cache.get(key)
+            if entry is not None:
+                _material_cache.move_to_end(key)
+                results[i] = entry
+
+    misses = [i for i, entry in enumerate(results) if entry is None]
+    extracted = extract_in_pool([file_paths[i] for i in misses], deadline) if misses else []
+
+    with _material_cache_lock:
+        for i, result in zip(misses, extracted):
+            if isinstance(result, Exception):
+                results[i] = result
+                continue
+            label, text = result
+            results[i] = {"label": label, "text": text, "summaries": OrderedDict()}
+            _material_cache[keys[i]] = results[i]
+        while len(_material_cache) > MATERIAL_CACHE_SIZE:
+            _material_cache.popitem(last=False)
+    return results
+
+
+def cached_summary(entry, key, build):
+    """
+    Return the summary of a material entry for a key, calling build() on a
+    miss; each entry keeps its SUMMARIES_PER_MATERIAL most recent summaries
+    """
+    summaries = entry["summaries"]
+    with _material_cache_lock:
+        if key in summaries:
+            summaries.move_to_end(key)
+            return summaries[key]
+    summary = build()
+    with _material_cache_lock:
+        summaries[key] = summary
+        while len(summaries) > SUMMARIES_PER_MATERIAL:
+            summaries.popitem(last=False)
+    return summary
+
+
+def format_material(label, text, original_tokens=None, packed_tokens=None):
+    """
+    Format extracted material text for the prompt, noting when it was packed
+    """
+    if original_tokens is not None and packed_tokens < original_tokens:
+        return f"[{label}, {original_tokens} tokens, packed to {packed_tokens}]: {text}"
+    return f"[{label}]: {text}"
+
+
+def extract_material_content(file_path, max_tokens=None):
     """
     Extract content from uploaded materials
     Supports: .txt, .pdf, .docx, .md
-    """
-    import os
 
+    The text is packed into max_tokens tokens (MATERIAL_TOKEN_BUDGET by default).
+    """
     if not os.path.exists(file_path):
         return f"File not found: {file_path}"
 
     ext = os.path.splitext(file_path)[1].lower()
+    if ext not in MATERIAL_LABELS:
+        return f"[{ext} file]: {os.path.basename(file_path)} (unsupported format)"
 
-    try:
-        if ext == ".txt" or ext == ".md":
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                # Summarize if too long (>2000 chars)
-                if len(content) > 2000:
-                    return f"[Text file, {len(content)} chars]: {content[:500]}... [truncated]"
-                return f"[Text file]: {content}"
-
-        elif ext == ".pdf":
-            content = ""
-            with open(file_path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    content += page.extract_text()
-            if len(content) > 2000:
-                return (
-                    f"[PDF file, {len(content)} chars]: {content[:500]}... [truncated]"
-                )
-            return f"[PDF file]: {content}"
-
-        elif ext == ".docx":
-            doc = docx.Document(file_path)
-            content = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            if len(content) > 2000:
-                return (
-                    f"[Word file, {len(content)} chars]: {content[:500]}... [truncated]"
-                )
-            return f"[Word file]: {content}"
+    (result,) = extract_in_pool([file_path])
+    if isinstance(result, Exception):
+        return f"[Error reading {os.path.basename(file_path)}]: {str(result)}"
+    label, content = result
 
-        else:
-            return f"[{ext} file]: {os.path.basename(file_path)} (unsupported format)"
+    (packed,) = pack_materials([(label, content)], budget=max_tokens)
+    return format_material(*packed)
 
-    except Exception as e:
-        return f"[Error reading {os.path.basename(file_path)}]: {str(e)}"
 
+# Number of library passages retrieved per worksheet request
+LIBRARY_PASSAGES = int(os.getenv("LIBRARY_PASSAGES", "12"))
+
+
+def retrieve_library_materials(config, focus=""):
+    """
+    Retrieve library passages relevant to the learning objective
+
+    Returns:
+        list of material entries (one per library material with hits)
+    """
+    from material_library import get_library
+
+    library = get_library()
+    passages = library.search(
+        f"{config.learning_objective} {focus}",
+        material_ids=config.material_ids,
+        limit=LIBRARY_PASSAGES,
+    )
 
-def summarize_uploaded_materials(config):
+    # Group passages by material, in document order within each material
+    grouped = OrderedDict()
+    for passage in passages:
+        grouped.setdefault(passage["material_id"], []).append(passage)
+
+    entries = []
+    for material_id, material_passages in grouped.items():
+        material = library.get_material(material_id)
+        material_passages.sort(key=lambda passage: passage["position"])
+        entry = {
+            "label": f"{material['label']} {material['name']} (library)",
+            "text": "\n\n".join(passage["text"] for passage in material_passages),
+            "summaries": OrderedDict(),
+        }
+        entries.append(entry)
+    return entries
+
+
+@traced("summarize_uploaded_materials")
+def summarize_uploaded_materials(config, token_budget=None, deadline=None):
     """
     Extract and summarize content from all uploaded materials
+
+    All files share one token budget (MATERIAL_TOKEN_BUDGET by default),
+    split in proportion to how relevant each file is to the learning objective.
+    Each share is filled by an extractive summary that ranks sentences by
+    their TF-IDF similarity to the learning objective and competency focus.
+
+    Materials referenced by config.material_ids come from the material
+    library; only their passages relevant to the objective are retrieved.
+    Files not extracted by the deadline (a time.monotonic() value) are
+    reported as unreadable.
     """
-    if not config.uploaded_materials:
+    if not config.uploaded_materials and not config.material_ids:
         return "No materials uploaded."
 
+    from curriculum_topics import COMPETENCIES
+
+    # Read every file first so the budget can be split across all of them
+    readable = [
+        material_path
+        for material_path in config.uploaded_materials
+        if os.path.exists(material_path)
+        and os.path.splitext(material_path)[1].lower() in MATERIAL_LABELS
+    ]
+    cached = dict(zip(readable, get_cached_materials(readable, deadline)))
+
     summaries = []
+    entries = []
     for material_path in config.uploaded_materials:
-        content = extract_material_content(material_path)
-        summaries.append(content)
+        if material_path not in cached:
+            summaries.append(extract_material_content(material_path))
+        elif isinstance(cached[material_path], Exception):
+            summaries.append(
+                f"[Error reading {os.path.basename(material_path)}]: "
+                f"{str(cached[material_path])}"
+            )
+        else:
+            entries.append(cached[material_path])
+            summaries.append(None)
+
+    focus = COMPETENCIES.get(config.competency_id, {}).get("focus", "")
+    objective = config.learning_objective or ""
+
+    if config.material_ids:
+        library_entries = retrieve_library_materials(config, focus)
+        entries.extend(library_entries)
+        summaries.extend([None] * len(library_entries))
+
+    def summarize(index, text, max_tokens):
+        # Summaries live next to the extracted text they were built from
+        return cached_summary(
+            entries[index],
+            (max_tokens, objective, focus),
+            lambda: summarize_text(text, max_tokens, objective, focus),
+        )
+
+    terms = query_terms(objective, focus, config.teaching_ideas)
+    packed = iter(
+        pack_materials(
+            [(entry["label"], entry["text"]) for entry in entries],
+            budget=token_budget,
+            terms=terms,
+            fill=summarize,
+        )
+    )
+    summaries = [
+        summary if summary is not None else format_material(*next(packed))
+        for summary in summaries
+    ]
 
     return "\n\n".join(summaries)
 
@@ -72,67 +234,40 @@ def summarize_uploaded_materials(config):
 # Define competency levels
 COMPETENCY_LEVELS = ["beginner", "intermediate", "advanced"]
 
-# OpenAI configuration
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# OpenAI configuration; the model of each call comes from the model router
 openai_client = OpenAI()
 
+# Created on first use so the sync entry points never open an event-loop client
+async_openai_client = None
 
-def build_system_prompt(config, level):
-    """
-    Build the system prompt for the LLM based on the new template.
-    """
-    from curriculum_topics import get_competency_details
-    import json
-    import os
 
-    # Load the single description file
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(script_dir)
+# System prompt of a level generation; {name} placeholders are filled from
+# system_prompt_fields(). Prompt variants for evaluation use the same names.
+SYSTEM_PROMPT_TEMPLATE = """You are an expert lesson activity designer specialised in Swiss Medien und Informatik aligned with Lehrplan 21.
 
-    desc_path = os.path.join(project_root, "data", "level_descriptors.json")
-    with open(desc_path, "r", encoding="utf-8") as f:
-        level_descriptors = json.load(f)
+This is the competency they are focusing on: {competency_name}.
 
-    # Get competency details
-    competency = get_competency_details(config.competency_id)
+This is how many students are in the class: {class_size}.
 
-    # Summarize materials
-    summarised_materials = summarize_uploaded_materials(config)
+This is the profile of the class composition: {class_composition}.
 
-    additional_input = f"{config.other_notes}\n{summarised_materials}"
+This is the time available: {lesson_duration} minutes.
 
-    # Get the descriptions and examples from the single file
-    description = level_descriptors[level]["description"]
-    example_activities_list = level_descriptors[level]["example_activities"]
-    example_activities = "\n".join(
-        [f"- {example}" for example in example_activities_list]
-    )
-
-    prompt = f"""You are an expert lesson activity designer specialised in Swiss Medien und Informatik aligned with Lehrplan 21.
-
-This is the competency they are focusing on: {competency['name']}.
-
-This is how many students are in the class: {config.class_size_composition}.
+Those are the materials available to the teacher: {materials_available} .
 
-This is the profile of the class composition: {config.class_composition}.
+This is the learning objective: {learning_objective}.
 
-This is the time available: {config.time_available} minutes.
-
-Those are the materials available to the teacher: {config.materials_available} .
-
-This is the learning objective: {config.learning_objective}.
-
-Here is the teacher's idea. It details what thoughts they want to build on in order to achieve the learning objective:  {config.teaching_ideas}.
+Here is the teacher's idea. It details what thoughts they want to build on in order to achieve the learning objective:  {teaching_idea}.
 
 This is any additional input they have, such as study materials or information etc. This can be useful for you to understand the context: {additional_input}.
 
-Your task is to generate a list of lesson activities for a single learner level. This can range from active activities to simple blocks of questions, whatever fits the context best. In this case generate ideas for the following learner level: {level}. 
+Your task is to generate a list of lesson activities for a single learner level. This can range from active activities to simple blocks of questions, whatever fits the context best. In this case generate ideas for the following learner level: {learner_level}. 
 
-Here is what a student can do on that level: {description}
+Here is what a student can do on that level: {level_description}
 
 Some example activities would include the following though beware that this is not a definite list and that you can come up with other ideas, those just help you to understand the level better: {example_activities}. 
 
-Lastly, here is some general guidance that should help you understand the level and what to think about: {description}
+Lastly, here is some general guidance that should help you understand the level and what to think about: {guidance}
 
 
 
@@ -142,7 +277,7 @@ For each activity, provide the following fields in the JSON output:
 
 - title: a concise activity name.
     
-- difficulty_level: the learner level ({level}).
+- difficulty_level: the learner level ({learner_level}).
     
 - estimated_duration: estimated time needed in minutes.
     
@@ -164,12 +299,148 @@ Output ONLY valid JSON containing an array called "activities" structured as spe
 
 Do not include any text or formatting outside of this JSON.
 """
-    return prompt
 
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
 
-import re
+
+def system_prompt_fields(config, level, deadline=None):
+    """
+    The values a system prompt template can use, by placeholder name
+    """
+    from curriculum_topics import snapshot
+
+    # Competency and level descriptors come from the same data snapshot
+    curriculum = snapshot()
+    level_descriptors = curriculum.level_descriptors
+
+    # Get competency details
+    if config.competency_id not in curriculum.competencies:
+        raise ValueError(f"Competency ID '{config.competency_id}' not found")
+    competency = curriculum.competencies[config.competency_id]
+
+    # Summarize materials
+    summarised_materials = summarize_uploaded_materials(config, deadline=deadline)
+
+    # Get the descriptions and examples from the single file
+    description = level_descriptors[level]["description"]
+    example_activities_list = level_descriptors[level]["example_activities"]
+    example_activities = "\n".join(
+        [f"- {example}" for example in example_activities_list]
+    )
+
+    return {
+        "competency_id": config.competency_id,
+        "competency_name": competency["name"],
+        "competency_focus": competency.get("focus", ""),
+        "class_size": config.class_size_composition,
+        "class_composition": config.class_composition,
+        "lesson_duration": config.time_available,
+        "materials_available": config.materials_available,
+        "learning_objective": config.learning_objective,
+        "teaching_idea": config.teaching_ideas,
+        "additional_input": f"{config.other_notes}\n{summarised_materials}",
+        "learner_level": level,
+        "level_description": description,
+        "example_activities": example_activities,
+        "guidance": description,
+    }
+
+
+def template_placeholders(template):
+    """The placeholder names a prompt template uses"""
+    return set(_PLACEHOLDER.findall(template))
+
+
+def render_prompt(template, fields):
+    """
+    Fill the {name} placeholders of a template in one pass, so braces in
+    the filled-in values (or JSON examples in the template) are kept as is.
+
+    Raises:
+        KeyError for a placeholder without a value
+    """
+    return _PLACEHOLDER.sub(lambda match: str(fields[match.group(1)]), template)
+
+
+@traced("build_system_prompt")
+def build_system_prompt(config, level, template=None, deadline=None):
+    """
+    Build the system prompt for the LLM based on the new template.
+    Pass a template to build a prompt variant instead, and a deadline to
+    stop waiting for material extraction at it.
+    """
+    return render_prompt(
+        SYSTEM_PROMPT_TEMPLATE if template is None else template,
+        system_prompt_fields(config, level, deadline),
+    )
+
+
+def selected_levels(config):
+    """
+    Return the difficulty levels selected in the config, in order
+    """
+    difficulty_levels = []
+    if config.include_beginner:
+        difficulty_levels.append("beginner")
+    if config.include_intermediate:
+        difficulty_levels.append("intermediate")
+    if config.include_advanced:
+        difficulty_levels.append("advanced")
+    return difficulty_levels
+
+
+def build_level_messages(config, level, template=None, deadline=None):
+    """
+    Build the chat messages that generate activities for one level
+    """
+    system_prompt = build_system_prompt(config, level, template, deadline)
+
+    user_prompt = f"Generate {config.num_questions_per_level} activities for the {level} level."
+
+    # Standard chat format expected by the OpenAI SDK.
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def build_lesson_ideas_messages(config):
+    """
+    Build the chat messages that generate lesson ideas as JSON
+    """
+    lesson_prompt = f"""
+Based on the following context, generate 3-5 creative lesson ideas.
+
+Lehrplan 21 Competency: {config.competency_id}
+Learning Objective: {config.learning_objective}
+Class Context: {config.class_size_composition}, {config.time_available}, {config.class_composition}
+Materials: {config.materials_available}
+
+Structure your ideas as an array of JSON objects, each with:
+- title
+- learning_objectives
+- activity_description
+- materials_needed
+- estimated_duration
+
+**IMPORTANT:** Your entire response must be a single, valid JSON array. Do not include any introductory text, explanations, or markdown formatting. The response should start with `[` and end with `]`.
+"""
+
+    # Use a specialized system prompt for lesson ideas.
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert education consultant specializing in Swiss Lehrplan 21 curriculum design.",
+        },
+        {"role": "user", "content": lesson_prompt},
+    ]
+
+
+# Title of the placeholder activity parse_agent_response returns on failure
+PARSE_ERROR_TITLE = "Error parsing response"
 
 
+@traced("parse_agent_response")
 def parse_agent_response(agent_response):
     """
     Parse a potentially messy LLM response to extract a JSON object or array.
@@ -221,18 +492,217 @@ def parse_agent_response(agent_response):
         print(f"Warning: Could not parse JSON from response. Error: {e}")
         print(f"--- Raw Response --- \n{agent_response}\n--------------------")
         print(f"--- Extracted JSON Text ---\n{json_text}\n-------------------------")
-        return [{"description": agent_response, "title": "Error parsing response"}]
+        return [{"description": agent_response, "title": PARSE_ERROR_TITLE}]
+
+
+def parse_failed(parsed):
+    """Whether parse_agent_response found no JSON in the response"""
+    return (
+        isinstance(parsed, list)
+        and len(parsed) == 1
+        and isinstance(parsed[0], dict)
+        and parsed[0].get("title") == PARSE_ERROR_TITLE
+    )
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before an upstream call finished"""
+
+
+def remaining_time(deadline):
+    """Seconds left until a time.monotonic() deadline (None: no deadline)"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(deadline):
+    """
+    Per-call timeout for the time left until the deadline
+
+    Raises:
+        DeadlineExceeded if the deadline has already passed
+    """
+    remaining = remaining_time(deadline)
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return remaining
 
 
-def run_openai_chat(messages, temperature: float = 0.4) -> str:
+def client_for_deadline(client, deadline):
+    """
+    The client to use before a deadline: the SDK would retry a timed-out
+    call with a fresh full timeout, so retries are off and the timeout is
+    the time left
+    """
+    timeout = call_timeout(deadline)
+    if timeout is None:
+        return client
+    return client.with_options(timeout=timeout, max_retries=0)
+
+
+def estimate_request_tokens(messages) -> int:
+    """
+    Estimate the tokens an upstream call will consume (prompt + completion)
+    """
+    prompt_tokens = sum(count_tokens(str(m.get("content", ""))) for m in messages)
+    return prompt_tokens + COMPLETION_TOKEN_ESTIMATE
+
+
+def replay_call(cassette, messages, temperature, task, deadline):
+    """
+    Look up the recorded answer to a call
+
+    Returns:
+        (interaction, seconds to wait before answering): the recorded
+        latency scaled by LLM_CASSETTE_LATENCY, cut short at the deadline
+
+    Raises:
+        CassetteMiss if the call was never recorded
+    """
+    interaction = cassette.lookup(messages, temperature, task)
+    delay = cassette.delay(interaction)
+    remaining = call_timeout(deadline)
+    if remaining is not None:
+        delay = min(delay, remaining)
+    return interaction, delay
+
+
+def finish_replay(cassette, interaction, task, delay, usage, models=None):
+    """
+    Account for a replayed call like for a real one and return its text.
+    The router sees the recorded latency, not the (scaled) replay delay.
+
+    Raises:
+        DeadlineExceeded if the delay was cut short at the deadline or the
+        recorded call timed out, ReplayedError if it failed otherwise
+    """
+    model = interaction.get("model", "replay")
+    seconds = interaction.get("latency_s", 0.0)
+    if delay < cassette.delay(interaction):
+        router.record(task, model, delay, error=True, deadline_hit=True)
+        raise DeadlineExceeded("Request deadline exceeded")
+    try:
+        content = replay_outcome(interaction)
+    except ReplayedError as e:
+        timed_out = e.error_type == "APITimeoutError"
+        router.record(task, model, seconds, error=True, deadline_hit=timed_out)
+        if timed_out:
+            raise DeadlineExceeded("Request deadline exceeded") from e
+        raise
+    call_usage = dict(interaction.get("usage") or {})
+    router.record(task, model, seconds, call_usage)
+    add_usage(usage, call_usage)
+    if models is not None:
+        models.append(model)
+    return content
+
+
+@traced("run_openai_chat")
+def run_openai_chat(
+    messages,
+    temperature: float = 0.4,
+    priority: str = "interactive",
+    tenant: str = "default",
+    usage: dict = None,
+    task: str = "default",
+    deadline: float = None,
+    models: list = None,
+) -> str:
     """
     Call OpenAI's Chat Completions API and return the string content.
+
+    The call is admitted by the upstream scheduler first, which enforces the
+    RPM/TPM limits and serves interactive requests ahead of batch work.
+    The model router picks the model for the task (e.g. "level:beginner",
+    "lesson_ideas", "assessment").
+    Pass a dict as usage to accumulate the prompt/completion tokens spent,
+    and a list as models to collect the model that answered (the route's
+    fallback while its primary is too slow).
+    With a deadline (a time.monotonic() value), queueing and the call
+    itself are limited to the time left, else DeadlineExceeded is raised.
+    LLM_CASSETTE_MODE records every call or replays recorded ones instead
+    of calling the API (see cassettes.py).
+    """
+    cassette = get_cassette()
+    if cassette is not None and cassette.replaying:
+        interaction, delay = replay_call(cassette, messages, temperature, task, deadline)
+        if delay:
+            time.sleep(delay)
+        return finish_replay(cassette, interaction, task, delay, usage, models)
+
+    estimated_tokens = estimate_request_tokens(messages)
+    try:
+        scheduler.acquire(
+            estimated_tokens,
+            priority=priority,
+            tenant=tenant,
+            timeout=call_timeout(deadline),
+        )
+    except TimeoutError as e:
+        raise DeadlineExceeded(str(e)) from e
+
+    model = router.choose(task)
+    call_usage = {}
+    client = client_for_deadline(openai_client, deadline)
+    started = time.perf_counter()
+    try:
+        raw = client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+        completion = raw.parse()
+    except Exception as e:
+        seconds = time.perf_counter() - started
+        # With a deadline the client timeout is the time left to the caller
+        deadline_hit = isinstance(e, APITimeoutError) and deadline is not None
+        router.record(task, model, seconds, error=True, deadline_hit=deadline_hit)
+        if cassette is not None:
+            cassette.record(messages, temperature, task, model, seconds, error=e)
+        if deadline_hit:
+            raise DeadlineExceeded("Request deadline exceeded") from e
+        raise
+    seconds = time.perf_counter() - started
+    settle_usage(raw.headers, completion, estimated_tokens, call_usage)
+    router.record(task, model, seconds, call_usage)
+    add_usage(usage, call_usage)
+    if models is not None:
+        models.append(model)
+    content = completion_text(completion)
+    if cassette is not None:
+        cassette.record(
+            messages, temperature, task, model, seconds, call_usage, content
+        )
+    return content
+
+
+def add_usage(totals, usage):
+    """Add the token counts of one call to a caller's totals, if any"""
+    if totals is None:
+        return
+    for key, value in usage.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def settle_usage(headers, completion, estimated_tokens, totals=None):
+    """
+    Feed rate-limit headers and real token usage back into the scheduler,
+    and add the usage to totals if given
+    """
+    scheduler.update_from_headers(headers)
+    usage = getattr(completion, "usage", None)
+    if usage is not None and usage.total_tokens:
+        scheduler.settle(estimated_tokens, usage.total_tokens)
+    if totals is not None and usage is not None:
+        totals["prompt_tokens"] = totals.get("prompt_tokens", 0) + usage.prompt_tokens
+        totals["completion_tokens"] = (
+            totals.get("completion_tokens", 0) + usage.completion_tokens
+        )
+
+
+def completion_text(completion) -> str:
+    """
+    Extract the string content from a chat completion.
     """
-    completion = openai_client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=messages,
-        temperature=temperature,
-    )
     message = completion.choices[0].message if completion.choices else None
     content = message.content if message else ""
     if isinstance(content, list):
@@ -244,6 +714,82 @@ def run_openai_chat(messages, temperature: float = 0.4) -> str:
     return content if content is not None else ""
 
 
+@traced("run_openai_chat")
+async def run_openai_chat_async(
+    messages,
+    temperature: float = 0.4,
+    priority: str = "interactive",
+    tenant: str = "default",
+    usage: dict = None,
+    task: str = "default",
+    deadline: float = None,
+    models: list = None,
+) -> str:
+    """
+    Async variant of run_openai_chat for the async server.
+    Cancelling the awaiting task aborts the upstream HTTP request.
+    """
+    cassette = get_cassette()
+    if cassette is not None and cassette.replaying:
+        interaction, delay = replay_call(cassette, messages, temperature, task, deadline)
+        if delay:
+            await asyncio.sleep(delay)
+        return finish_replay(cassette, interaction, task, delay, usage, models)
+
+    global async_openai_client
+    if async_openai_client is None:
+        async_openai_client = AsyncOpenAI()
+
+    estimated_tokens = estimate_request_tokens(messages)
+    try:
+        await scheduler.acquire_async(
+            estimated_tokens,
+            priority=priority,
+            tenant=tenant,
+            timeout=call_timeout(deadline),
+        )
+    except TimeoutError as e:
+        raise DeadlineExceeded(str(e)) from e
+
+    model = router.choose(task)
+    call_usage = {}
+    client = client_for_deadline(async_openai_client, deadline)
+    started = time.perf_counter()
+    try:
+        raw = await client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+        completion = raw.parse()
+    except asyncio.CancelledError:
+        # Cancellation (client gone) says nothing about the model's latency,
+        # so neither the router nor the cassette records the call
+        raise
+    except Exception as e:
+        seconds = time.perf_counter() - started
+        # With a deadline the client timeout is the time left to the caller
+        deadline_hit = isinstance(e, APITimeoutError) and deadline is not None
+        router.record(task, model, seconds, error=True, deadline_hit=deadline_hit)
+        if cassette is not None:
+            cassette.record(messages, temperature, task, model, seconds, error=e)
+        if deadline_hit:
+            raise DeadlineExceeded("Request deadline exceeded") from e
+        raise
+    seconds = time.perf_counter() - started
+    settle_usage(raw.headers, completion, estimated_tokens, call_usage)
+    router.record(task, model, seconds, call_usage)
+    add_usage(usage, call_usage)
+    if models is not None:
+        models.append(model)
+    content = completion_text(completion)
+    if cassette is not None:
+        cassette.record(
+            messages, temperature, task, model, seconds, call_usage, content
+        )
+    return content
+
+
 def assess_student_response(question, student_answer, difficulty_level):
     """
     Assess student response and assign competency level
@@ -269,34 +815,19 @@ Provide:
         {"role": "user", "content": assessment_prompt},
     ]
 
-    return run_openai_chat(messages)
-
-
-# Test the system with teacher interface
-if __name__ == "__main__":
-    from teacher_interface import interactive_teacher_setup
-
-    # Get configuration from teacher
-    config = interactive_teacher_setup()
-
-    if config is None:
-        print("Exiting...")
-        exit()
+    return run_openai_chat(messages, task="assessment")
 
-    print("\n" + "=" * 70)
-    print("GENERATING WORKSHEET...")
-    print("=" * 70)
 
-    # Determine which difficulty levels to include
-    difficulty_levels = []
-    if config.include_beginner:
-        difficulty_levels.append("beginner")
-    if config.include_intermediate:
-        difficulty_levels.append("intermediate")
-    if config.include_advanced:
-        difficulty_levels.append("advanced")
+def generate_worksheet(
+    config, priority="interactive", tenant="default", usage=None, on_section=None
+):
+    """
+    Generate the selected levels and the lesson ideas of a worksheet, one
+    call after another. on_section(name) is called after each section.
 
-    # Generate worksheet
+    Returns:
+        (worksheet, activities_by_level)
+    """
     worksheet = {
         "subject": config.subject,
         "cycle": config.cycle,
@@ -315,61 +846,59 @@ if __name__ == "__main__":
     }
 
     # Generate questions for each selected difficulty level
-    for difficulty in difficulty_levels:
-        print(f"\n--- Generating {difficulty} activities ---")
-
-        system_prompt = build_system_prompt(config, difficulty)
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": f"Generate {config.num_questions_per_level} activities for the {difficulty} level.",
-            },
-        ]
-
-        raw_response = run_openai_chat(messages)
-
+    activities_by_level = {}
+    for difficulty in selected_levels(config):
+        raw_response = run_openai_chat(
+            build_level_messages(config, difficulty),
+            priority=priority,
+            tenant=tenant,
+            usage=usage,
+            task=f"level:{difficulty}",
+        )
         structured_activities = parse_agent_response(raw_response)
-
+        activities_by_level[difficulty] = structured_activities
         worksheet["activities"].extend(structured_activities)
-
-        print(f"✓ {difficulty.capitalize()} activities generated and structured")
+        if on_section is not None:
+            on_section(difficulty)
 
     # Generate lesson ideas if requested
     if config.include_lesson_ideas:
-        print(f"\n--- Generating lesson ideas ---")
+        lesson_response = run_openai_chat(
+            build_lesson_ideas_messages(config),
+            priority=priority,
+            tenant=tenant,
+            usage=usage,
+            task="lesson_ideas",
+        )
+        worksheet["lesson_ideas"] = parse_agent_response(lesson_response)
+        if on_section is not None:
+            on_section("lesson_ideas")
 
-        lesson_prompt = f"""
-Based on the following context, generate 3-5 creative lesson ideas.
+    return worksheet, activities_by_level
 
-Lehrplan 21 Competency: {config.competency_id}
-Learning Objective: {config.learning_objective}
-Class Context: {config.class_size_composition}, {config.time_available}
-Materials: {config.materials_available}
 
-Structure your ideas as an array of JSON objects, each with:
-- title
-- learning_objectives
-- activity_description
-- materials_needed
-- estimated_duration
+# Test the system with teacher interface
+if __name__ == "__main__":
+    from teacher_interface import interactive_teacher_setup
 
-**IMPORTANT:** Your entire response must be a single, valid JSON array. Do not include any introductory text, explanations, or markdown formatting. The response should start with `[` and end with `]`.
-"""
+    # Get configuration from teacher
+    config = interactive_teacher_setup()
 
-        messages = [
-            {
-                "role": "system",
-                "content": "You are an expert education consultant specializing in Swiss Lehrplan 21 curriculum design.",
-            },
-            {"role": "user", "content": lesson_prompt},
-        ]
+    if config is None:
+        print("Exiting...")
+        exit()
 
-        lesson_response = run_openai_chat(messages)
+    print("\n" + "=" * 70)
+    print("GENERATING WORKSHEET...")
+    print("=" * 70)
 
-        worksheet["lesson_ideas"] = parse_agent_response(lesson_response)
-        print(f"✓ Lesson ideas generated and structured")
+    def report_section(name):
+        if name == "lesson_ideas":
+            print("✓ Lesson ideas generated and structured")
+        else:
+            print(f"✓ {name.capitalize()} activities generated and structured")
+
+    worksheet, activities_by_level = generate_worksheet(config, on_section=report_section)
 
     # Display results
     print("\n" + "=" * 70)
@@ -400,20 +929,16 @@ Structure your ideas as an array of JSON objects, each with:
         print("-" * 20)
     print()
 
-    # Save to file
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(script_dir)
-    output_dir = os.path.join(project_root, "output")
-
-    os.makedirs(output_dir, exist_ok=True)
+    # Save to the worksheet store; earlier worksheets are never overwritten
+    from worksheet_store import STORE_PATH, config_hash, get_store
 
-    safe_filename = (
-        f"worksheet_{config.competency_id}_{config.cycle.replace(' ', '_')}.json"
+    worksheet_id = get_store().add_worksheet(
+        worksheet,
+        activities_by_level,
+        config_hash(config, router.fingerprint()),
+        source="cli",
     )
-    output_file = os.path.join(output_dir, safe_filename)
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(worksheet, f, indent=2, ensure_ascii=False)
 
-    print(f"\n✓ Worksheet saved to: {output_file}")
+    print(f"\n✓ Worksheet saved to: {STORE_PATH} (id {worksheet_id})")
+    print(f"  Export with: python worksheet_store.py export {worksheet_id} <file.json>")
     print("\n" + "=" * 70)
@@ -0,0 +1,448 @@
+"""
+Persistent worksheet store
+
+Every generated worksheet (from the CLI and the API) is kept in an on-disk
+SQLite database instead of a JSON file per competency that overwrites the
+previous one. Worksheets are indexed by competency, cycle, level, config
+hash and creation time; activities live in their own table so listing and
+lookups never load them.
+
+Usage:
+    python worksheet_store.py list [competency_id]
+    python worksheet_store.py show <worksheet_id>
+    python worksheet_store.py export <worksheet_id> <file.json>
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+
+STORE_PATH = os.getenv(
+    "WORKSHEET_STORE_PATH", os.path.join(project_root, "output", "worksheets.db")
+)
+
+# Seconds a generated section stays reusable after it was last served
+SECTION_REUSE_TTL_S = float(os.getenv("SECTION_REUSE_TTL_S", str(7 * 86400)))
+
+# Bytes of the database file SQLite may memory-map
+MMAP_SIZE = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS worksheets (
+    id TEXT PRIMARY KEY,
+    config_hash TEXT NOT NULL,
+    competency_id TEXT,
+    cycle TEXT,
+    levels TEXT NOT NULL,
+    activity_count INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS worksheets_created ON worksheets (created_at);
+CREATE INDEX IF NOT EXISTS worksheets_competency
+    ON worksheets (competency_id, cycle, created_at);
+CREATE INDEX IF NOT EXISTS worksheets_config ON worksheets (config_hash, created_at);
+CREATE TABLE IF NOT EXISTS activities (
+    worksheet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    level TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (worksheet_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS activities_level ON activities (level, worksheet_id);
+CREATE TABLE IF NOT EXISTS baselines (
+    competency_id TEXT NOT NULL,
+    cycle TEXT NOT NULL,
+    level TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    activities TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (competency_id, cycle, level, preset)
+);
+CREATE INDEX IF NOT EXISTS baselines_fingerprint ON baselines (fingerprint);
+CREATE TABLE IF NOT EXISTS sections (
+    fingerprint TEXT PRIMARY KEY,
+    section TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sections_used ON sections (used_at);
+"""
+
+SUMMARY_COLUMNS = (
+    "id",
+    "config_hash",
+    "competency_id",
+    "cycle",
+    "levels",
+    "activity_count",
+    "source",
+    "created_at",
+)
+
+
+def config_hash(config, model=""):
+    """
+    Hash every config field that reaches a prompt, plus the model.
+    Uploaded files contribute their size and modification time, so an
+    edited file produces a different hash.
+    """
+    fields = config.to_dict()
+    fields["class_composition"] = config.class_composition
+    fields["uploaded_materials"] = []
+    for file_path in config.uploaded_materials:
+        try:
+            stat = os.stat(file_path)
+            fields["uploaded_materials"].append(
+                [os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns]
+            )
+        except OSError:
+            fields["uploaded_materials"].append([file_path, None, None])
+    fields["model"] = model
+    encoded = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def prompt_fingerprint(messages, model=""):
+    """
+    Hash the exact chat messages of an upstream call plus the model. The
+    prompt embeds the competency and level descriptor data, so a change to
+    either data file changes the fingerprint.
+    """
+    encoded = json.dumps([model, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def section_fingerprint(tenant, messages, model=""):
+    """
+    Fingerprint of one worksheet section (a level's activities or the lesson
+    ideas): its exact chat messages and model, per tenant. A config edit
+    changes only the fingerprints of the sections whose prompt uses the
+    edited field.
+    """
+    return prompt_fingerprint([tenant, messages], model)
+
+
+class WorksheetStore:
+    """On-disk store of generated worksheets"""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        # SQLite connections cannot be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def add_worksheet(self, worksheet, activities_by_level, config_hash, source, cycle=None):
+        """
+        Store a generated worksheet and return its id.
+
+        Args:
+            worksheet: the worksheet dict; its "activities" are stored separately
+            activities_by_level: dict of level -> list of activities, in order
+            config_hash: see config_hash()
+            source: "api", "cli" or "batch"
+            cycle: cycle to index by, if the worksheet dict has none
+        """
+        worksheet_id = uuid.uuid4().hex
+        data = {key: value for key, value in worksheet.items() if key != "activities"}
+        rows = []
+        for level, activities in activities_by_level.items():
+            for activity in activities:
+                rows.append(
+                    (worksheet_id, len(rows), level, json.dumps(activity, ensure_ascii=False))
+                )
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO worksheets (id, config_hash, competency_id, cycle, levels, "
+                "activity_count, source, created_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    worksheet_id,
+                    config_hash,
+                    worksheet.get("competency_id"),
+                    worksheet.get("cycle") or cycle,
+                    ",".join(activities_by_level),
+                    len(rows),
+                    source,
+                    time.time(),
+                    json.dumps(data, ensure_ascii=False),
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO activities (worksheet_id, position, level, data) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        return worksheet_id
+
+    def get_worksheet(self, worksheet_id):
+        """Return a stored worksheet with its activities, or None if unknown"""
+        conn = self._connection()
+        row = conn.execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)}, data FROM worksheets WHERE id = ?",
+            (worksheet_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        worksheet = json.loads(row[-1])
+        worksheet["activities"] = [
+            json.loads(data)
+            for (data,) in conn.execute(
+                "SELECT data FROM activities WHERE worksheet_id = ? ORDER BY position",
+                (worksheet_id,),
+            )
+        ]
+        worksheet["worksheet_id"] = worksheet_id
+        worksheet["created_at"] = row[SUMMARY_COLUMNS.index("created_at")]
+        return worksheet
+
+    def find_latest(self, config_hash):
+        """Return the newest worksheet generated from an identical config, or None"""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT id FROM worksheets WHERE config_hash = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (config_hash,),
+            )
+            .fetchone()
+        )
+        return self.get_worksheet(row[0]) if row else None
+
+    def list_worksheets(
+        self,
+        competency_id=None,
+        cycle=None,
+        level=None,
+        config_hash=None,
+        before=None,
+        limit=50,
+        offset=0,
+    ):
+        """
+        List worksheet summaries (without activities), newest first.
+
+        Args:
+            competency_id, cycle, level, config_hash: optional filters
+            before: only worksheets created before this timestamp; pass the
+                created_at of the last item to page through large stores
+                without an ever-growing offset
+            limit, offset: page size and number of worksheets to skip
+        """
+        clauses = []
+        params = []
+        for column, value in (
+            ("competency_id", competency_id),
+            ("cycle", cycle),
+            ("config_hash", config_hash),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if level is not None:
+            clauses.append(
+                "EXISTS (SELECT 1 FROM activities "
+                "WHERE level = ? AND worksheet_id = worksheets.id)"
+            )
+            params.append(level)
+        if before is not None:
+            clauses.append("created_at < ?")
+            params.append(before)
+
+        sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM worksheets"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        summaries = []
+        for row in self._connection().execute(sql, params):
+            summary = dict(zip(SUMMARY_COLUMNS, row))
+            summary["levels"] = summary["levels"].split(",") if summary["levels"] else []
+            summaries.append(summary)
+        return summaries
+
+    def delete_worksheet(self, worksheet_id):
+        """Remove a worksheet and its activities"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM activities WHERE worksheet_id = ?", (worksheet_id,))
+            conn.execute("DELETE FROM worksheets WHERE id = ?", (worksheet_id,))
+
+    def put_baseline(self, competency_id, cycle, level, preset, fingerprint, activities):
+        """Store (or replace) the pre-generated activities of one combination"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO baselines (competency_id, cycle, level, preset, "
+                "fingerprint, activities, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    competency_id,
+                    cycle,
+                    level,
+                    preset,
+                    fingerprint,
+                    json.dumps(activities, ensure_ascii=False),
+                    time.time(),
+                ),
+            )
+
+    def baseline_fingerprint(self, competency_id, cycle, level, preset=""):
+        """Return the prompt fingerprint a combination was generated from, or None"""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT fingerprint FROM baselines WHERE competency_id = ? AND cycle = ? "
+                "AND level = ? AND preset = ?",
+                (competency_id, cycle, level, preset),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def find_baseline(self, fingerprint):
+        """Return pre-generated activities for an identical prompt, or None"""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT activities FROM baselines WHERE fingerprint = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (fingerprint,),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def put_section(self, fingerprint, section, content):
+        """Store a generated section for reuse, dropping expired sections"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sections (fingerprint, section, content, "
+                "created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (fingerprint, section, json.dumps(content, ensure_ascii=False), now, now),
+            )
+            conn.execute(
+                "DELETE FROM sections WHERE used_at < ?", (now - SECTION_REUSE_TTL_S,)
+            )
+
+    def find_section(self, fingerprint):
+        """Return the stored content of a section with this fingerprint, or None"""
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT content FROM sections WHERE fingerprint = ? AND used_at >= ?",
+            (fingerprint, now - SECTION_REUSE_TTL_S),
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE sections SET used_at = ? WHERE fingerprint = ?", (now, fingerprint)
+            )
+        return json.loads(row[0])
+
+    def list_baselines(self, competency_id=None, cycle=None, level=None, preset=None):
+        """List pre-generated combinations with their activities"""
+        clauses = []
+        params = []
+        for column, value in (
+            ("competency_id", competency_id),
+            ("cycle", cycle),
+            ("level", level),
+            ("preset", preset),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+
+        sql = (
+            "SELECT competency_id, cycle, level, preset, fingerprint, activities, "
+            "created_at FROM baselines"
+        )
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY competency_id, cycle, level, preset"
+
+        keys = ("competency_id", "cycle", "level", "preset", "fingerprint", "activities", "created_at")
+        baselines = []
+        for row in self._connection().execute(sql, params):
+            baseline = dict(zip(keys, row))
+            baseline["activities"] = json.loads(baseline["activities"])
+            baselines.append(baseline)
+        return baselines
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the shared store instance, opening it on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = WorksheetStore()
+        return _store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("list", "show", "export"):
+        print(__doc__)
+        sys.exit(1)
+
+    store = get_store()
+    command = sys.argv[1]
+
+    if command == "list":
+        competency_id = sys.argv[2] if len(sys.argv) > 2 else None
+        for summary in store.list_worksheets(competency_id=competency_id, limit=1000):
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(summary["created_at"]))
+            print(
+                f"  {summary['id']}  {created}  {summary['competency_id']} "
+                f"({summary['cycle']}, {summary['activity_count']} activities, "
+                f"{summary['source']})"
+            )
+
+    else:
+        if len(sys.argv) < (4 if command == "export" else 3):
+            print(__doc__)
+            sys.exit(1)
+        worksheet = store.get_worksheet(sys.argv[2])
+        if worksheet is None:
+            print("Worksheet not found")
+            sys.exit(1)
+        if command == "show":
+            print(json.dumps(worksheet, indent=2, ensure_ascii=False))
+        else:
+            with open(sys.argv[3], "w", encoding="utf-8") as f:
+                json.dump(worksheet, f, indent=2, ensure_ascii=False)
+            print(f"✓ Worksheet saved to: {sys.argv[3]}")